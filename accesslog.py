@@ -0,0 +1,247 @@
+"""
+Structured access log: one row per request in its own SQLite file
+(STATS_ACCESS_LOG, default ./access_log.sqlite3), read by view_logger.py.
+
+Requests never touch the file. The after_request hook puts a tuple on a
+queue; a background thread per worker (batching.BatchWriter) drains it and
+writes a batch (up to BATCH_ROWS, or whatever arrived in FLUSH_SECONDS) in
+one transaction. If the writer falls behind, the queue fills up and records
+are dropped and counted, so requests never block.
+
+Besides the raw rows (indexed on ts, (path, ts) and (ip, ts)), each batch
+upserts per-minute and per-hour rollups by path and by ip. The viewer's
+"top paths / top IPs" tables add up whole hours plus the minutes of the
+partial hour at the edge of the window, instead of scanning the log.
+
+    flask --app statsapp prune-access-log --days 30
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import time
+from pathlib import Path
+
+from flask import request
+
+from batching import BatchWriter
+from compress import body_size
+
+BASE_DIR = Path(__file__).resolve().parent
+LOG_PATH = Path(os.environ.get("STATS_ACCESS_LOG", BASE_DIR / "access_log.sqlite3"))
+
+BATCH_ROWS = 500
+FLUSH_SECONDS = 1.0
+QUEUE_MAX = 20_000
+BUSY_TIMEOUT_MS = 10_000
+DEFAULT_KEEP_DAYS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS access_log (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,               -- unix seconds
+    ip TEXT,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    query TEXT,
+    status INTEGER NOT NULL,
+    bytes INTEGER,                  -- NULL for streamed responses
+    latency_ms REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_access_log_ts ON access_log(ts);
+CREATE INDEX IF NOT EXISTS idx_access_log_path_ts ON access_log(path, ts);
+CREATE INDEX IF NOT EXISTS idx_access_log_ip_ts ON access_log(ip, ts);
+"""
+
+# rollup tables: access_{path,ip}_{minute,hour}, bucket = unix seconds // width
+ROLLUP_WIDTHS = {"minute": 60, "hour": 3600}
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS access_path_{unit} (
+    bucket INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    errors INTEGER NOT NULL,        -- status >= 400
+    bytes INTEGER NOT NULL,
+    latency_ms_sum REAL NOT NULL,
+    latency_ms_max REAL NOT NULL,
+    PRIMARY KEY (bucket, path)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS access_ip_{unit} (
+    bucket INTEGER NOT NULL,
+    ip TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (bucket, ip)
+) WITHOUT ROWID;
+"""
+
+INSERT_SQL = """
+INSERT INTO access_log (ts, ip, method, path, query, status, bytes, latency_ms)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+PATH_ROLLUP_SQL = """
+INSERT INTO access_path_{unit} (bucket, path, requests, errors, bytes, latency_ms_sum, latency_ms_max)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (bucket, path) DO UPDATE SET
+    requests = requests + excluded.requests,
+    errors = errors + excluded.errors,
+    bytes = bytes + excluded.bytes,
+    latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum,
+    latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)
+"""
+
+IP_ROLLUP_SQL = """
+INSERT INTO access_ip_{unit} (bucket, ip, requests, errors, bytes)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (bucket, ip) DO UPDATE SET
+    requests = requests + excluded.requests,
+    errors = errors + excluded.errors,
+    bytes = bytes + excluded.bytes
+"""
+
+
+def connect(path=LOG_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(SCHEMA)
+    for unit in ROLLUP_WIDTHS:
+        conn.executescript(ROLLUP_SCHEMA.format(unit=unit))
+    return conn
+
+
+def rollups(batch, width):
+    """Fold a batch of rows into (bucket, path) and (bucket, ip) upsert rows."""
+    paths, ips = {}, {}
+    for ts, ip, _method, path, _query, status, size, latency in batch:
+        bucket = int(ts // width)
+        err = 1 if status >= 400 else 0
+        size = size or 0
+        p = paths.get((bucket, path))
+        if p is None:
+            paths[(bucket, path)] = [1, err, size, latency, latency]
+        else:
+            p[0] += 1
+            p[1] += err
+            p[2] += size
+            p[3] += latency
+            p[4] = max(p[4], latency)
+        if ip:
+            i = ips.get((bucket, ip))
+            if i is None:
+                ips[(bucket, ip)] = [1, err, size]
+            else:
+                i[0] += 1
+                i[1] += err
+                i[2] += size
+    return ([(*k, *v) for k, v in paths.items()],
+            [(*k, *v) for k, v in ips.items()])
+
+
+def write_batch(conn, batch):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(INSERT_SQL, batch)
+        for unit, width in ROLLUP_WIDTHS.items():
+            path_rows, ip_rows = rollups(batch, width)
+            conn.executemany(PATH_ROLLUP_SQL.format(unit=unit), path_rows)
+            conn.executemany(IP_ROLLUP_SQL.format(unit=unit), ip_rows)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+class AccessLog:
+    """Records go through a batching.BatchWriter; full queue -> dropped and counted."""
+
+    def __init__(self, path=LOG_PATH):
+        self.path = path
+        self.dropped = 0
+        self._conn = None
+        self._conn_pid = None
+        self._writer = BatchWriter("access-log", self._write, QUEUE_MAX, BATCH_ROWS, FLUSH_SECONDS)
+
+    def record(self, row):
+        try:
+            self._writer.put(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, batch):
+        try:
+            if self._conn is None or self._conn_pid != os.getpid():
+                self._conn = connect(self.path)
+                self._conn_pid = os.getpid()
+            write_batch(self._conn, batch)
+        except Exception as e:
+            print(f"[accesslog] dropped {len(batch)} records: {e}")
+            self.dropped += len(batch)
+            self._conn = None
+
+    def flush(self, timeout=5.0):
+        """Wait (up to `timeout`) for everything queued so far to be written."""
+        self._writer.flush(timeout)
+
+
+access_log = AccessLog()
+
+
+def before_request():
+    request._get_current_object().environ["statsapp.access_t0"] = time.perf_counter()
+
+
+def after_request(response):
+    req = request._get_current_object()
+    t0 = req.environ.pop("statsapp.access_t0", None)
+    if t0 is None:
+        return response
+    latency_ms = (time.perf_counter() - t0) * 1000
+    ip = req.headers.get("X-Forwarded-For", req.remote_addr)
+    ip = ip.split(",")[0].strip() if ip else None
+    size = body_size(response)
+    access_log.record((
+        time.time(), ip, req.method, req.path,
+        req.query_string.decode("latin-1") or None,
+        response.status_code, size, round(latency_ms, 3),
+    ))
+    return response
+
+
+def prune(days=DEFAULT_KEEP_DAYS, batch=5000, path=LOG_PATH):
+    """Delete raw rows and rollups older than `days`, a batch at a time."""
+    cutoff = time.time() - days * 86400
+    conn = connect(path)
+    deleted = 0
+    try:
+        while True:
+            n = conn.execute(
+                "DELETE FROM access_log WHERE id IN "
+                "(SELECT id FROM access_log WHERE ts < ? ORDER BY ts LIMIT ?)",
+                (cutoff, batch),
+            ).rowcount
+            deleted += n
+            if n < batch:
+                break
+        for unit, width in ROLLUP_WIDTHS.items():
+            for kind in ("path", "ip"):
+                conn.execute(f"DELETE FROM access_{kind}_{unit} WHERE bucket < ?",
+                             (int(cutoff // width),))
+    finally:
+        conn.close()
+    return deleted
+
+
+def init_app(app):
+    """
+    Hook into `app`. Like metrics.init_app, register it before other
+    after_request hooks so it runs last and logs the bytes actually sent.
+    """
+    app.before_request(before_request)
+    app.after_request(after_request)
+    atexit.register(access_log.flush)
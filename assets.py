@@ -0,0 +1,263 @@
+"""
+Static files: a build step that fingerprints and precompresses web/, and the
+routes that serve the result.
+
+    flask --app statsapp build-assets
+
+writes build/web/ (STATS_ASSETS_DIR):
+
+    assets/<name>.<hash>.<ext>[.br|.gz]   every non-HTML file in web/, plus
+                                          vendored third-party scripts
+    pages/<page>.html[.br|.gz]            the HTML, with references to those
+                                          files rewritten to /assets/...
+    manifest.json
+
+Chart.js used to come from a CDN on every page view; VENDOR lists the URLs
+we keep a pinned copy of under web/vendor/, committed along with its line in
+web/vendor/SHA256SUMS (`sha256sum -c` format). The build never downloads
+anything: a missing file, or one that doesn't match its checksum, is an
+error, so a deploy can't quietly go back to the CDN or ship something else.
+To add or bump one, download it, commit it and run
+`sha256sum chart.umd.min.js > SHA256SUMS` in web/vendor/.
+
+Fingerprinted files are served with a year-long `immutable` Cache-Control,
+so a repeat visit doesn't ask for them at all. Pages keep their URLs and are
+served `no-cache` with an ETag, so a repeat visit is a 304. Both go out via
+send_file, which hands the open file to the server's wsgi.file_wrapper
+(gunicorn's sync workers sendfile() it), choosing the .br/.gz variant the
+client accepts. Compression happens once, at build time, at the highest
+levels.
+
+Without a build everything is served straight from web/ as before. A page
+whose source changed after the last build is served from source too, so a
+forgotten build never serves stale HTML.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from flask import abort, request, send_file, send_from_directory
+
+from compress import encoded_etag
+
+try:
+    import brotli
+except ImportError:  # optional dependency: gzip variants only
+    brotli = None
+
+BASE_DIR = Path(__file__).resolve().parent
+WEB_DIR = BASE_DIR / "web"
+BUILD_DIR = Path(os.environ.get("STATS_ASSETS_DIR", BASE_DIR / "build" / "web"))
+
+# third-party files we serve ourselves: path under web/ -> where it came from
+VENDOR_SUMS = "vendor/SHA256SUMS"
+VENDOR = {
+    "vendor/chart.umd.min.js": "https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js",
+}
+
+SKIP_SUFFIXES = (".save", ".bak", "~")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MIN_SAVING = 0.9        # keep a compressed variant only if it's <90% of the original
+ENCODINGS = ("br", "gzip")
+SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+# src="..." / href="..." attributes, the only places the pages reference files
+REF_RE = re.compile(r"""(?P<attr>\b(?:src|href)\s*=\s*)(?P<q>["'])(?P<url>[^"']+)(?P=q)""")
+
+
+# --- build ---
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _variants(data: bytes):
+    """{encoding: body} for the encodings that are worth it."""
+    out = {}
+    if brotli is not None:
+        out["br"] = brotli.compress(data, quality=11)
+    out["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+    return {enc: body for enc, body in out.items() if len(body) < len(data) * MIN_SAVING}
+
+
+def _write(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _write_with_variants(path: Path, data: bytes):
+    _write(path, data)
+    variants = _variants(data)
+    for enc in ENCODINGS:
+        variant = path.with_name(path.name + SUFFIX[enc])
+        if enc in variants:
+            _write(variant, variants[enc])
+        else:
+            variant.unlink(missing_ok=True)
+    return [enc for enc in ENCODINGS if enc in variants]
+
+
+class VendorError(Exception):
+    pass
+
+
+def check_vendor(web_dir=WEB_DIR):
+    """Raise VendorError unless every VENDOR file is there and matches SHA256SUMS."""
+    for rel, url in VENDOR.items():
+        if not (web_dir / rel).exists():
+            raise VendorError(f"web/{rel} is missing: download {url} and commit it")
+    sums_path = web_dir / VENDOR_SUMS
+    try:
+        lines = sums_path.read_text().splitlines()
+    except FileNotFoundError:
+        raise VendorError(f"web/{VENDOR_SUMS} is missing") from None
+    sums = {}
+    for line in lines:
+        digest, _, name = line.strip().partition(" ")
+        if digest:
+            sums[name.lstrip(" *")] = digest.lower()
+    for rel in VENDOR:
+        name = rel.rpartition("/")[2]
+        if name not in sums:
+            raise VendorError(f"web/{VENDOR_SUMS} has no checksum for {name}")
+        if _digest((web_dir / rel).read_bytes()) != sums[name]:
+            raise VendorError(f"web/{rel} doesn't match its checksum in web/{VENDOR_SUMS}")
+
+
+def build(web_dir=WEB_DIR, out_dir=BUILD_DIR):
+    """
+    Build out_dir from web_dir and return the manifest. Old fingerprinted
+    files are left in place: pages still open in a browser keep working
+    across a deploy, and the names never clash.
+    """
+    check_vendor(web_dir)
+    (out_dir / "assets").mkdir(parents=True, exist_ok=True)
+    (out_dir / "pages").mkdir(parents=True, exist_ok=True)
+
+    manifest = {"assets": {}, "pages": {}}
+    urls = {}           # reference as written in a page -> fingerprinted URL
+    sources = sorted(
+        p for p in web_dir.rglob("*")
+        if p.is_file() and not p.name.startswith(".") and not p.name.endswith(SKIP_SUFFIXES)
+        and p != web_dir / VENDOR_SUMS
+    )
+    for src in sources:
+        if src.suffix == ".html":
+            continue
+        rel = src.relative_to(web_dir).as_posix()
+        data = src.read_bytes()
+        stem, dot, ext = src.name.rpartition(".")
+        name = f"{stem}.{_digest(data)[:12]}{dot}{ext}" if dot else f"{src.name}.{_digest(data)[:12]}"
+        encodings = _write_with_variants(out_dir / "assets" / name, data)
+        manifest["assets"][name] = {"source": rel, "size": len(data), "encodings": encodings}
+        urls["/" + rel] = urls[rel] = f"/assets/{name}"
+        if rel in VENDOR:
+            urls[VENDOR[rel]] = f"/assets/{name}"
+
+    def rewrite(m):
+        url = urls.get(m.group("url"))
+        return m.group(0) if url is None else f"{m.group('attr')}{m.group('q')}{url}{m.group('q')}"
+
+    for src in sources:
+        if src.suffix != ".html":
+            continue
+        rel = src.relative_to(web_dir).as_posix()
+        st = src.stat()
+        html = REF_RE.sub(rewrite, src.read_bytes().decode("utf-8")).encode("utf-8")
+        encodings = _write_with_variants(out_dir / "pages" / rel, html)
+        manifest["pages"][rel] = {
+            "etag": _digest(html)[:16],
+            "size": len(html),
+            "encodings": encodings,
+            "source_size": st.st_size,
+            "source_mtime_ns": st.st_mtime_ns,
+        }
+    _write(out_dir / "manifest.json", json.dumps(manifest, indent=1).encode())
+    return manifest
+
+
+# --- serving ---
+
+def load_manifest(out_dir=BUILD_DIR):
+    try:
+        return json.loads((out_dir / "manifest.json").read_text())
+    except FileNotFoundError:
+        return {"assets": {}, "pages": {}}
+
+
+manifest = load_manifest()
+
+
+def _pick_encoding(available):
+    accept = request.accept_encodings
+    for enc in ENCODINGS:
+        if enc in available and accept[enc]:
+            return enc
+    return None
+
+
+def _send(path: Path, encodings, etag, max_age=None):
+    """
+    send_file the best variant of `path` for this request. max_age=None
+    means no-cache: the client revalidates with If-None-Match every time.
+    """
+    enc = _pick_encoding(encodings)
+    target = path if enc is None else path.with_name(path.name + SUFFIX[enc])
+    response = send_file(
+        target,
+        mimetype=mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+        download_name=path.name,
+        etag=etag if enc is None else encoded_etag(etag, enc),
+        conditional=True,
+        max_age=max_age,
+    )
+    if enc is not None:
+        response.headers["Content-Encoding"] = enc
+    if encodings:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def _is_fresh(page, info):
+    """The built page still matches web/<page>."""
+    try:
+        st = (WEB_DIR / page).stat()
+    except FileNotFoundError:
+        return False
+    return st.st_size == info["source_size"] and st.st_mtime_ns == info["source_mtime_ns"]
+
+
+def send_page(page):
+    """A page from the build if it's current, else web/<page> as-is. Always revalidated."""
+    info = manifest["pages"].get(page)
+    if info is not None and _is_fresh(page, info):
+        return _send(BUILD_DIR / "pages" / page, info["encodings"], etag=info["etag"])
+    return send_from_directory(WEB_DIR, page)
+
+
+def serve_asset(name):
+    info = manifest["assets"].get(name)
+    if info is None:
+        abort(404)
+    response = _send(BUILD_DIR / "assets" / name, info["encodings"], etag=name,
+                     max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+
+def serve_static(filename):
+    """What Flask's static route did for web/, with pages going through send_page."""
+    if filename.endswith(".html"):
+        return send_page(filename)
+    return send_from_directory(WEB_DIR, filename)
+
+
+def init_app(app):
+    """Serve web/ (the app is created with static_folder=None) and /assets/."""
+    app.add_url_rule("/assets/<name>", "asset", serve_asset)
+    app.add_url_rule("/<path:filename>", "static", serve_static)
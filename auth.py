@@ -0,0 +1,33 @@
+"""
+Bearer tokens for the endpoints that aren't for the public:
+
+    POST /api/ingest                                        STATS_INGEST_TOKEN
+    GET  /api/metrics, /api/metrics/slow, /api/cache_stats  STATS_METRICS_TOKEN
+
+as `Authorization: Bearer <token>`. With the token unset the endpoint
+answers 403 to everyone, so nothing is open by default.
+"""
+import functools
+import hmac
+import os
+
+from flask import jsonify, request
+
+METRICS_TOKEN = os.environ.get("STATS_METRICS_TOKEN")
+
+
+def bearer_ok(header, token):
+    """Whether an Authorization header carries `token`. Always False if it's unset."""
+    if not token or not header or not header.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(header[len("Bearer "):].encode(), token.encode())
+
+
+def metrics_only(view):
+    """403 unless the request carries STATS_METRICS_TOKEN."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not bearer_ok(request.headers.get("Authorization"), METRICS_TOKEN):
+            return jsonify({"error": "needs STATS_METRICS_TOKEN"}), 403
+        return view(*args, **kwargs)
+    return wrapper
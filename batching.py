@@ -0,0 +1,80 @@
+"""
+Queue + background writer thread, shared by the access log (accesslog.py)
+and the ingest writer (ingest.py).
+
+Callers put items on a queue and return; one thread per process takes the
+first item, then whatever else arrives within `wait` seconds (up to
+`max_size`, where an item weighs size(item), 1 by default), and hands the
+list to write(batch) -- one transaction per batch instead of one per item.
+Threads don't survive a fork, so the queue and thread are created on first
+use in each process (gunicorn workers after --preload included).
+
+write() should deal with its own errors; anything it lets through is printed
+and the batch is dropped.
+"""
+import os
+import queue
+import threading
+import time
+
+
+class BatchWriter:
+    def __init__(self, name, write, max_queue, max_size, wait, size=None):
+        self.name = name
+        self.write = write
+        self.max_queue = max_queue
+        self.max_size = max_size
+        self.wait = wait
+        self.size = size or (lambda item: 1)
+        self._pid = None
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, args=(self._queue,),
+                             name=self.name, daemon=True).start()
+
+    def put(self, item, timeout=None):
+        """Queue `item`. Raises queue.Full right away, or after `timeout` seconds if given."""
+        if self._pid != os.getpid():
+            self._start()
+        if timeout is None:
+            self._queue.put_nowait(item)
+        else:
+            self._queue.put(item, timeout=timeout)
+
+    def _run(self, q):
+        while True:
+            batch = [q.get()]
+            size = self.size(batch[0])
+            deadline = time.monotonic() + self.wait
+            while size < self.max_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                size += self.size(batch[-1])
+            try:
+                self.write(batch)
+            except Exception as e:
+                print(f"[{self.name}] dropped a batch of {len(batch)}: {e}")
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+    def flush(self, timeout=5.0):
+        """Wait (up to `timeout`) for everything queued so far to be written."""
+        q = self._queue
+        if q is None or self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while q.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
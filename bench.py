@@ -0,0 +1,850 @@
+"""
+Benchmarks for the read API, run against a throwaway copy of the database.
+Prints one JSON document, so runs can be saved (--out) and diffed.
+
+    python bench.py                      # copies ./stats.sqlite3
+    python gen_data.py /tmp/big.sqlite3 --players 300 --days 365
+    python bench.py --db /tmp/big.sqlite3 --only routes,gunicorn --seconds 5
+
+Sections (--only picks some; default is all of them):
+
+"meta" is what was measured: row counts, git commit, python/sqlite versions.
+
+"compare" swaps in the old per-call sqlite3.connect() ("before") against the
+pooled statsdb layer ("after"), requests/sec on a few routes.
+
+"routes" drives every /api/* route through Flask's test client: paged
+/api/snapshots with with_deltas, clamp, a cursor and a date range, series,
+a per-player export, ... For each: requests, req/s, p50/p99 latency, and the
+process's peak RSS so far. /api/stream (never ends) and the POST to
+/api/trigger_refresh (a rate-limited write) are left out.
+
+"gunicorn" starts `gunicorn -w --workers statsapp:app` on a free local port
+and runs the same URLs from --concurrency client threads. Its peak RSS is
+the sum of VmHWM over the master and workers. Skipped if gunicorn isn't
+installed for this python.
+
+The response cache is off in all of the above (STATS_RESPONSE_CACHE_MB=0) so
+they measure the query path; --cache leaves it on.
+
+"payload" compares the rows and columnar wire formats of a 2000-row
+/api/snapshots?with_deltas=1 page: bytes (plain/gzip/brotli) and the time to
+turn fetched rows into the JSON body.
+
+"export" streams /api/export?with_deltas=1 from the copy, then grows the copy
+to EXPORT_GROWTH times the rows (shifted duplicates) and streams it again;
+peak Python heap should stay about the same while rows go up (peak_ratio;
+tests/test_export.py is the pass/fail version of this).
+
+"fields" compares projections (fields=all, the default set, kills+deaths)
+of a 2000-row /api/snapshots?with_deltas=1 page: query ms (execute +
+fetchall), serialize ms (rows -> JSON body) and bytes; and the whole
+/api/overall and /api/export?with_deltas=1 routes, ms and bytes.
+
+"static" builds the assets (assets.py, into the temp dir; skipped with the
+reason if the vendored files are missing or don't match SHA256SUMS) and adds up what a browser visit to each page transfers,
+br/gzip accepted: the page plus the files it loads from us, cold (empty
+cache), repeat (page revalidated by ETag; fingerprinted files are immutable,
+so not requested) and "before" (everything uncompressed, as web/ used to be
+served).
+
+"leaderboard" times a top-25 /api/leaderboard query (kd and kills, 7d) on
+its own copy of the database with the leaderboard padded to 100 / 10k /
+100k players, next to what the same 7d ranking costs computed from
+snapshot_delta on the real rows. The precomputed one should stay flat.
+
+"ingest" writes INGEST_ROWS snapshots (the players' latest counters, bumped,
+plus some new players) two ways: one transaction per row, the way the
+poller did it, and through ingest.py's writer queue as ticks of INGEST_TICK
+rows from INGEST_THREADS threads (group commit). Rows/sec for each, and
+/api/overall + /api/snapshots latency from a reader thread while each runs,
+next to the same reader with no writes. It adds rows to the copy, so it runs
+just before "export".
+
+"readmodel" builds the columnar read model (readmodel.py) into the temp dir
+and compares it with SQL: build time, file bytes (next to the database's),
+this process's resident memory before and after the build (the after
+figure includes the build's own garbage, not just the mapped file), and per query shape the ms to
+get the page's rows as dicts (SQL: execute + fetchall + dict(row); model:
+refresh + snapshots() + dict(zip)), plus whole /api/snapshots requests with
+the model swapped in and out.
+
+"metrics_overhead_us" is what the metrics hooks add: per request (the
+before/after_request pair) and per SQL statement (TimedConnection vs the bare
+connection on SELECT 1).
+"""
+import argparse
+import gzip
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import resource
+import secrets
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+SECTIONS = ("compare", "routes", "gunicorn", "payload", "fields", "static", "leaderboard", "readmodel",
+            "metrics", "ingest", "export")
+
+ROUTES = [
+    "/api/players",
+    "/api/timer",
+    "/api/last",
+    "/api/overall",
+    "/api/snapshots?order=desc&with_deltas=1&limit=100&paged=1",
+    "/api/snapshots?order=desc&limit=100&paged=1",
+]
+EXPORT_URL = "/api/export?with_deltas=1"
+EXPORT_GROWTH = 20
+HEADERS = {"Accept-Encoding": "gzip"}
+GUNICORN_BOOT_SECONDS = 30
+
+
+def legacy_db(path):
+    @contextmanager
+    def db():
+        conn = sqlite3.connect(path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+    return db
+
+
+def run(client, url, seconds):
+    n = 0
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    while time.perf_counter() < deadline:
+        res = client.get(url)
+        assert res.status_code == 200, (url, res.status_code)
+        n += 1
+    return n / (time.perf_counter() - t0)
+
+
+def meta_report(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        snapshots, players, lo, hi = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT player_id), MIN(ts), MAX(ts) FROM snapshot"
+        ).fetchone()
+    finally:
+        conn.close()
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "db_bytes": Path(db_path).stat().st_size,
+        "snapshots": snapshots,
+        "players": players,
+        "history": [lo, hi],
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpus": os.cpu_count(),
+    }
+
+
+def suite_urls(db_path, client):
+    """Every /api/* GET worth timing, with parameters that fit this database."""
+    conn = sqlite3.connect(db_path)
+    try:
+        player = conn.execute("""
+            SELECT p.name FROM snapshot s JOIN player p ON p.id = s.player_id
+            GROUP BY s.player_id ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()[0]
+        since, until = conn.execute(
+            "SELECT datetime(MAX(ts), '-7 days'), MAX(ts) FROM snapshot"
+        ).fetchone()
+    finally:
+        conn.close()
+    q = urllib.parse.quote
+    page = "/api/snapshots?order=desc&with_deltas=1&limit=100&paged=1"
+    cursor = client.get(page).get_json()["next_cursor"]
+    cursor_qs = f"&cursor_ts={q(cursor['ts'])}&cursor_id={cursor['id']}" if cursor else ""
+    week = f"&from={q(since)}&to={q(until)}"
+    return {
+        "players": "/api/players",
+        "timer": "/api/timer",
+        "last": "/api/last",
+        "overall": "/api/overall",
+        "overall_player": f"/api/overall?player={q(player)}",
+        "snapshots": "/api/snapshots",
+        "snapshots_paged": "/api/snapshots?order=desc&limit=100&paged=1",
+        "snapshots_deltas": page,
+        "snapshots_deltas_clamp": page + "&clamp=1",
+        "snapshots_cursor": page + cursor_qs,
+        "snapshots_player_week": f"/api/snapshots?player={q(player)}&with_deltas=1&limit=2000{week}",
+        "snapshots_columnar": "/api/snapshots?order=desc&with_deltas=1&limit=2000&format=columnar",
+        "series_1h": "/api/series?metric=kd_match&bucket=1h",
+        "leaderboard_kd_7d": "/api/leaderboard?metric=kd&window=7d",
+        "leaderboard_kills_all": "/api/leaderboard?metric=kills&window=all",
+        "series_1d_player": f"/api/series?metric=kda&bucket=1d&player={q(player)}",
+        "export_player_week": f"/api/export?player={q(player)}&with_deltas=1{week}",
+        "cache_stats": "/api/cache_stats",
+        "metrics": "/api/metrics",
+    }
+
+
+def latency_stats(latencies, elapsed):
+    lat = sorted(latencies)
+    pick = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 3) if lat else None
+    return {
+        "requests": len(lat),
+        "rps": round(len(lat) / elapsed, 1) if elapsed else None,
+        "p50_ms": pick(0.50),
+        "p99_ms": pick(0.99),
+    }
+
+
+def peak_rss_mib():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def routes_report(client, urls, seconds):
+    """Each URL through the test client for `seconds`."""
+    out = {}
+    for name, url in urls.items():
+        latencies = []
+        t0 = time.perf_counter()
+        deadline = t0 + seconds
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            res = client.get(url, headers=HEADERS)
+            res.get_data()
+            latencies.append(time.perf_counter() - t)
+            assert res.status_code == 200, (url, res.status_code)
+        out[name] = latency_stats(latencies, time.perf_counter() - t0)
+        out[name]["peak_rss_mib"] = peak_rss_mib()
+    return out
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _process_tree(pid):
+    """pid plus its direct children (gunicorn master + workers)."""
+    pids = [pid]
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            pids.append(int(stat.parent.name))
+    return pids
+
+
+def _vm_hwm_kib(pid):
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _hammer(port, url, seconds, concurrency):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine = []
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            try:
+                conn.request("GET", url, headers=HEADERS)
+                res = conn.getresponse()
+                res.read()
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(repr(e))
+                conn.close()
+                continue
+            mine.append(time.perf_counter() - t)
+            if res.status != 200:
+                errors.append(f"HTTP {res.status}")
+        conn.close()
+        latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    out = latency_stats(latencies, time.perf_counter() - t0)
+    if errors:
+        out["errors"] = len(errors)
+        out["first_error"] = errors[0]
+    return out
+
+
+def gunicorn_report(urls, seconds, workers, concurrency, tmp):
+    """The same URLs against a real gunicorn, over HTTP."""
+    if importlib.util.find_spec("gunicorn") is None:
+        return {"skipped": f"gunicorn not installed for {sys.executable}"}
+    port = _free_port()
+    log = open(Path(tmp) / "gunicorn.log", "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers),
+         "-b", f"127.0.0.1:{port}", "statsapp:app"],
+        cwd=BASE_DIR, env=os.environ.copy(), stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        deadline = time.monotonic() + GUNICORN_BOOT_SECONDS
+        while True:
+            try:
+                c = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+                c.request("GET", "/api/timer")
+                c.getresponse().read()
+                c.close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    return {"skipped": f"gunicorn didn't come up, see {log.name}"}
+                time.sleep(0.2)
+        out = {"workers": workers, "concurrency": concurrency, "routes": {}}
+        for name, url in urls.items():
+            out["routes"][name] = _hammer(port, url, seconds, concurrency)
+        out["peak_rss_mib"] = round(sum(_vm_hwm_kib(p) for p in _process_tree(proc.pid)) / 1024, 1)
+        return out
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+
+
+def payload_report(statsapp, repeat=20):
+    """Bytes and serialization time for format=rows vs format=columnar."""
+    from flask import jsonify
+    from compress import brotli
+
+    url = "/api/snapshots?order=desc&with_deltas=1&limit=2000"
+    with statsapp.db() as conn, statsapp.app.test_request_context(url):
+        sql = [
+            "SELECT", ", ".join(
+                statsapp.BASE_SNAPSHOT_COLS
+                + [f"s.{c}" for c in statsapp.DEFAULT_SNAPSHOT_FIELDS]
+                + [statsapp.delta_sql(c, False) for c in statsapp.DEFAULT_SNAPSHOT_FIELDS]
+            ),
+            "FROM snapshot s JOIN player p ON p.id = s.player_id",
+            "LEFT JOIN snapshot_delta d ON d.snapshot_id = s.id",
+            "ORDER BY s.ts DESC, s.id DESC LIMIT 2000",
+        ]
+        cur = conn.execute("\n".join(sql))
+        rows = cur.fetchall()
+        names = [d[0] for d in cur.description]
+
+        builders = {
+            "rows": lambda: jsonify([dict(r) for r in rows]).get_data(),
+            "columnar": lambda: jsonify(statsapp.to_columnar(names, rows)).get_data(),
+        }
+        out = {"rows_in_page": len(rows)}
+        for label, build in builders.items():
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                body = build()
+            ms = (time.perf_counter() - t0) / repeat * 1000
+            out[label] = {
+                "bytes": len(body),
+                "gzip_bytes": len(gzip.compress(body, 6)),
+                "br_bytes": len(brotli.compress(body, quality=5)) if brotli else None,
+                "serialize_ms": round(ms, 2),
+            }
+    return out
+
+
+FIELD_SETS = {"all": "all", "default": None, "kills_deaths": "kills,deaths"}
+
+
+def fields_report(statsapp, repeat=20):
+    """Query/serialize time and bytes per fields= projection."""
+    from flask import jsonify
+
+    def best_ms(fn):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - t0)
+        return round(min(times) * 1000, 2), result
+
+    out = {}
+    client = statsapp.app.test_client()
+    for label, fields in FIELD_SETS.items():
+        picked = statsapp.counter_registry.resolve(fields, default=statsapp.DEFAULT_SNAPSHOT_FIELDS)
+        sql = statsapp.snapshot_query_sql("snapshot", [], "DESC", True, False, limit=True,
+                                          fields=picked)
+        with statsapp.db() as conn, statsapp.app.test_request_context():
+            query_ms, rows = best_ms(lambda: conn.execute(sql, [2000]).fetchall())
+            ser_ms, body = best_ms(lambda: jsonify([dict(r) for r in rows]).get_data())
+        qs = f"&fields={fields}" if fields else ""
+        routes = {}
+        for name, url in (("overall", "/api/overall?x=1"), ("export", EXPORT_URL)):
+            route_ms, data = best_ms(lambda: client.get(url + qs).get_data())
+            routes[name] = {"ms": route_ms, "bytes": len(data)}
+        out[label] = {
+            "counters": len(picked),
+            "snapshots_query_ms": query_ms,
+            "snapshots_serialize_ms": ser_ms,
+            "snapshots_bytes": len(body),
+            **{f"{name}_{k}": v for name, r in routes.items() for k, v in r.items()},
+        }
+    return out
+
+
+def static_report(statsapp):
+    """Bytes per page visit: cold, repeat, and the old uncompressed serving."""
+    import re
+
+    import assets
+
+    try:
+        assets.manifest = assets.build()
+    except assets.VendorError as e:
+        return {"skipped": str(e)}
+    client = statsapp.app.test_client()
+    accept = {"Accept-Encoding": "br, gzip"}
+    out = {}
+    for page in assets.manifest["pages"]:
+        url = "/" if page == "stats.html" else f"/{page}"
+        res = client.get(url, headers=accept)
+        html = assets.BUILD_DIR.joinpath("pages", page).read_text(encoding="utf-8")
+        loads = sorted(set(re.findall(r"""\b(?:src|href)=["'](/assets/[^"']+)""", html)))
+        cold = len(res.data) + sum(len(client.get(u, headers=accept).data) for u in loads)
+        before = (assets.WEB_DIR / page).stat().st_size + sum(
+            assets.manifest["assets"][u.rsplit("/", 1)[1]]["size"] for u in loads
+        )
+        again = client.get(url, headers={**accept, "If-None-Match": res.headers["ETag"]})
+        out[page] = {
+            "before_bytes": before,
+            "cold_bytes": cold,
+            "repeat_bytes": len(again.data),
+            "repeat_status": again.status_code,
+            "assets": len(loads),
+        }
+    return out
+
+
+LEADERBOARD_SIZES = (100, 10_000, 100_000)
+
+# the 7d kd ranking without the leaderboard tables
+LEADERBOARD_ADHOC_SQL = """
+SELECT s.player_id, COUNT(*) AS snapshots,
+       CAST(SUM(d.delta_kills_gm_granitebr) AS REAL) / MAX(SUM(d.delta_deaths_gm_granitebr), 1) AS kd
+FROM snapshot s JOIN snapshot_delta d ON d.snapshot_id = s.id
+WHERE s.ts >= ?
+GROUP BY s.player_id
+ORDER BY kd DESC
+LIMIT 25
+"""
+
+
+def leaderboard_report(statsapp, db_path, tmp, repeat=50):
+    """Top-25 query ms against leaderboard size, and the ad-hoc SQL for comparison."""
+    import random
+    import schema
+
+    def best_ms(conn, sql, params):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            times.append(time.perf_counter() - t0)
+        return round(min(times) * 1000, 3)
+
+    path = Path(tmp) / "leaderboard.sqlite3"
+    conn = sqlite3.connect(path)
+    src = sqlite3.connect(db_path)     # backup(), not a file copy: the app's writes may still be in the WAL
+    src.backup(conn)
+    src.close()
+    rng = random.Random(1)
+    edge = conn.execute("SELECT edge FROM leaderboard_span WHERE span = '7d'").fetchone()[0]
+    query = {
+        col: f"""SELECT l.*, p.name FROM leaderboard l JOIN player p ON p.id = l.player_id
+                 WHERE l.span = ? ORDER BY l.{col} DESC LIMIT 25"""
+        for col in ("kd", "kills_gm_granitebr")
+    }
+    out = {"adhoc_7d_kd_ms": best_ms(conn, LEADERBOARD_ADHOC_SQL, (edge,))}
+    have = conn.execute("SELECT COUNT(*) FROM leaderboard WHERE span = '7d'").fetchone()[0]
+    next_id = conn.execute("SELECT MAX(id) FROM player").fetchone()[0] + 1
+    for size in LEADERBOARD_SIZES:
+        fill = []
+        for pid in range(next_id, next_id + max(0, size - have)):
+            matches = rng.randint(1, 200)
+            fill.append((pid, matches, *(rng.randint(0, 20 * matches) for _ in schema.DELTA_COLUMNS)))
+        with conn:
+            conn.executemany("INSERT INTO player (id, name) VALUES (?, ?)",
+                             [(r[0], f"bench{r[0]}") for r in fill])
+            conn.executemany(
+                f"INSERT INTO leaderboard (span, player_id, snapshots, {', '.join(schema.DELTA_COLUMNS)}) "
+                f"VALUES ('7d', {', '.join('?' * (len(schema.DELTA_COLUMNS) + 2))})", fill)
+        next_id += len(fill)
+        have += len(fill)
+        out[f"{have}_players"] = {
+            f"top25_{col}_ms": best_ms(conn, sql, ("7d",)) for col, sql in query.items()
+        }
+    conn.close()
+    path.unlink()
+    return out
+
+
+def _rss_mib():
+    with open("/proc/self/statm") as f:
+        return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+
+
+def readmodel_report(statsapp, db_path, tmp, repeat=20):
+    """Read model vs SQL for /api/snapshots pages: memory, build time, latency."""
+    import readmodel
+    import schema
+
+    client = statsapp.app.test_client()
+    rss0 = _rss_mib()
+    model = readmodel.ReadModel(db_path, list(statsapp.counter_registry.counters),
+                                schema.DELTA_COLUMNS, out_dir=Path(tmp) / "readmodel")
+    with statsapp.db() as conn:
+        model.refresh(conn)
+        # fault every page in, as serving would over time
+        for col in model.base.cols.values():
+            sum(col)
+        rss1 = _rss_mib()
+        out = {
+            "rows": model.base.n,
+            "build_seconds": model.build_seconds,
+            "model_bytes": model.base.nbytes,
+            "db_bytes": os.path.getsize(db_path),
+            "rss_before_mib": rss0,
+            "rss_after_build_mib": rss1,
+        }
+        player, since = conn.execute("""
+            SELECT p.name, datetime(MAX(s.ts), '-7 days') FROM snapshot s JOIN player p ON p.id = s.player_id
+            GROUP BY s.player_id ORDER BY COUNT(*) DESC LIMIT 1""").fetchone()
+        pid = statsapp.player_id_for(conn, player)
+        mid = conn.execute("SELECT ts, id FROM snapshot ORDER BY ts DESC, id DESC LIMIT 1 OFFSET 1000").fetchone()
+        fields = statsapp.counter_registry.resolve(None, default=statsapp.DEFAULT_SNAPSHOT_FIELDS)
+        shapes = {
+            "latest_100": dict(limit=100),
+            "latest_2000": dict(limit=2000),
+            "cursor_100": dict(limit=100, cursor_ts=mid[0] if mid else None, cursor_id=mid[1] if mid else None),
+            "player_week_2000": dict(limit=2000, player=player, since=since),
+        }
+
+        def best_ms(fn):
+            times = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - t0)
+            return round(min(times) * 1000, 3)
+
+        for label, shape in shapes.items():
+            limit = shape["limit"]
+            args = dict(since=shape.get("since"), cursor_ts=shape.get("cursor_ts"),
+                        cursor_id=shape.get("cursor_id"))
+            where, params = statsapp.snapshot_filters(conn, shape.get("player"), shape.get("since"),
+                                                      None, "DESC", args["cursor_ts"], args["cursor_id"])
+            sql = statsapp.snapshot_query_sql("snapshot", where, "DESC", True, False, True, fields)
+
+            def via_sql():
+                return [dict(r) for r in conn.execute(sql, params + [limit])]
+
+            def via_model():
+                model.refresh(conn)
+                names, rows = model.snapshots(fields, True, False, "DESC", limit, player_id=pid if
+                                              shape.get("player") else None, **args)
+                return [dict(zip(names, r)) for r in rows]
+
+            assert via_sql() == via_model(), label
+            out[label] = {"rows": len(via_sql()), "sql_ms": best_ms(via_sql), "model_ms": best_ms(via_model)}
+
+    q = urllib.parse.quote
+    routes = {
+        "route_latest_100": "/api/snapshots?with_deltas=1&limit=100&paged=1",
+        "route_player_week": f"/api/snapshots?with_deltas=1&limit=2000&player={q(player)}&from={q(since)}",
+    }
+    saved = statsapp.read_model
+    for label, url in routes.items():
+        timings = {}
+        for impl, m in (("sql_ms", None), ("model_ms", model)):
+            statsapp.read_model = m
+            timings[impl] = best_ms(lambda: client.get(url).get_data())
+        out[label] = timings
+    statsapp.read_model = saved
+    return out
+
+
+INGEST_ROWS = 3000
+INGEST_TICK = 100
+INGEST_THREADS = 4
+INGEST_READ_URLS = ("/api/overall", "/api/snapshots?limit=100&with_deltas=1")
+
+
+def _ingest_rows(db_path, n, start):
+    """n snapshot dicts for ingest.submit_snapshots: every player's latest counters, bumped."""
+    import schema
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    latest = conn.execute("""
+        SELECT p.name, s.* FROM player_summary ps
+        JOIN player p ON p.id = ps.player_id
+        JOIN snapshot s ON s.id = ps.latest_snapshot_id
+    """).fetchall()
+    conn.close()
+    counters = [c for c in latest[0].keys() if c.endswith("_gm_granitebr")]
+    rows = []
+    for i in range(n):
+        base = latest[i % len(latest)]
+        step = i // len(latest) + 1
+        # every 50th row is a player we haven't seen
+        name = f"ingest{i:06d}" if i % 50 == 0 else base["name"]
+        rows.append({
+            "player": name,
+            "ts": (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+            "counters": {c: (base[c] or 0) + step * (c in schema.DELTA_COLUMNS) for c in counters},
+        })
+    return rows
+
+
+def _reader(client, stop, latencies):
+    while not stop.is_set():
+        for url in INGEST_READ_URLS:
+            t = time.perf_counter()
+            res = client.get(url)
+            res.get_data()
+            latencies.append(time.perf_counter() - t)
+
+
+def _with_reader(client, write):
+    """Run write() with a reader thread going; (write seconds, reader latency stats)."""
+    stop, latencies = threading.Event(), []
+    reader = threading.Thread(target=_reader, args=(client, stop, latencies))
+    reader.start()
+    t0 = time.perf_counter()
+    write()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    reader.join()
+    return elapsed, latency_stats(latencies, elapsed)
+
+
+def ingest_report(statsapp, db_path):
+    """Per-row commits vs the ingest writer queue: rows/sec, and reader latency meanwhile."""
+    import ingest
+    client = statsapp.app.test_client()
+    start = datetime.now(timezone.utc) + timedelta(days=1)
+    per_row = _ingest_rows(db_path, INGEST_ROWS, start)
+    grouped = _ingest_rows(db_path, INGEST_ROWS, start + timedelta(seconds=INGEST_ROWS))
+    columns = list(statsapp.counter_registry.counters)
+    insert = ingest._insert_sql(columns)
+    out = {}
+
+    def idle():
+        time.sleep(2)
+
+    def one_per_row():
+        for name, ts, values, blob in ingest.prepare(per_row, statsapp.counter_registry):
+            with statsapp.db_write() as conn:
+                pid = ingest.resolve_players(conn, [name])[name]
+                conn.execute(insert, (pid, ts, *(values.get(c) for c in columns), blob))
+
+    def queued():
+        ticks = [grouped[i:i + INGEST_TICK] for i in range(0, len(grouped), INGEST_TICK)]
+        threads = [
+            threading.Thread(target=lambda mine: [ingest.submit_snapshots(t) for t in mine],
+                             args=(ticks[k::INGEST_THREADS],))
+            for k in range(INGEST_THREADS)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    for label, write in (("idle", idle), ("per_row_commit", one_per_row), ("writer_queue", queued)):
+        groups = ingest.writer.groups
+        elapsed, reads = _with_reader(client, write)
+        out[label] = {"reader": reads}
+        if label != "idle":
+            out[label]["rows_per_sec"] = round(INGEST_ROWS / elapsed, 1)
+            out[label]["seconds"] = round(elapsed, 3)
+        if label == "writer_queue":
+            out[label]["commits"] = ingest.writer.groups - groups
+    return out
+
+
+def metrics_overhead(statsapp, n=20000):
+    """Microseconds the metrics layer adds per request and per query."""
+    import metrics
+    import statsdb
+
+    with statsapp.app.test_request_context("/api/last"):
+        resp = statsapp.app.response_class(b"{}", mimetype="application/json")
+        t0 = time.perf_counter()
+        for _ in range(n):
+            metrics.before_request()
+            metrics.after_request(resp)
+        per_request = (time.perf_counter() - t0) / n * 1e6
+
+    raw = statsdb.read_conn()
+    timed = metrics.TimedConnection(raw)
+    per_query = {}
+    for label, conn in (("bare", raw), ("timed", timed)):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            conn.execute("SELECT 1").fetchone()
+        per_query[label] = (time.perf_counter() - t0) / n * 1e6
+    return {
+        "per_request": round(per_request, 2),
+        "per_query": round(per_query["timed"] - per_query["bare"], 2),
+    }
+
+
+def grow_db(path, factor):
+    """Append factor-1 copies of every snapshot row, each shifted a span later."""
+    conn = sqlite3.connect(path)
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(snapshot)") if r[1] != "id"]
+    lo, hi = conn.execute("SELECT julianday(MIN(ts)), julianday(MAX(ts)) FROM snapshot").fetchone()
+    span = (hi - lo) + 1
+    select = ", ".join("datetime(julianday(ts) + ?)" if c == "ts" else c for c in cols)
+    max_id = conn.execute("SELECT MAX(id) FROM snapshot").fetchone()[0]
+    with conn:
+        for i in range(1, factor):
+            conn.execute(
+                f"INSERT INTO snapshot ({', '.join(cols)}) SELECT {select} FROM snapshot "
+                "WHERE id <= ? ORDER BY ts, id",
+                (span * i, max_id),
+            )
+    conn.close()
+
+
+def stream_export(client):
+    """Stream the export through, returning rows, peak heap KiB and seconds."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    res = client.get(EXPORT_URL, buffered=False)
+    assert res.status_code == 200, res.status_code
+    rows = sum(chunk.count(b"\n") for chunk in res.response)
+    res.close()
+    secs = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"rows": rows, "peak_kib": round(peak / 1024, 1), "seconds": round(secs, 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=str(BASE_DIR / "stats.sqlite3"))
+    ap.add_argument("--seconds", type=float, default=2.0, help="per route")
+    ap.add_argument("--only", default=",".join(SECTIONS),
+                    help=f"comma separated, from: {', '.join(SECTIONS)}")
+    ap.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    ap.add_argument("--concurrency", type=int, default=4, help="client threads for gunicorn")
+    ap.add_argument("--cache", action="store_true", help="leave the response cache on")
+    ap.add_argument("--out", help="also write the JSON to this file")
+    args = ap.parse_args()
+    sections = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        ap.error(f"unknown section(s): {', '.join(sorted(unknown))}")
+
+    tmp = tempfile.mkdtemp(prefix="statsbench-")
+    db_copy = Path(tmp) / "stats.sqlite3"
+    shutil.copy(args.db, db_copy)
+    os.environ["STATS_DB"] = str(db_copy)
+    os.environ["STATS_METRICS_DIR"] = str(Path(tmp) / "metrics")
+    os.environ["STATS_ASSETS_DIR"] = str(Path(tmp) / "assets")
+    os.environ["STATS_ACCESS_LOG"] = str(Path(tmp) / "access_log.sqlite3")
+    os.environ.setdefault("STATS_METRICS_TOKEN", secrets.token_hex(16))
+    HEADERS["Authorization"] = f"Bearer {os.environ['STATS_METRICS_TOKEN']}"
+    if not args.cache:
+        os.environ["STATS_RESPONSE_CACHE_MB"] = "0"
+
+    import contextlib
+    import io
+
+    results = {"meta": meta_report(db_copy)}
+    # the app print()s on import and per request; keep that out of stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        import respcache
+        import statsapp
+        import statsdb
+
+        client = statsapp.app.test_client()
+        if "compare" in sections:
+            pooled_db = statsapp.db
+            cache_bytes = respcache.response_cache.max_bytes
+            respcache.response_cache.max_bytes = 0   # measure SQL + JSON, not cache hits
+            compare = {}
+            for label, impl in (("before", legacy_db(db_copy)), ("after", pooled_db)):
+                statsapp.db = impl
+                compare[label] = {url: round(run(client, url, args.seconds), 1) for url in ROUTES}
+            statsapp.db = pooled_db
+            respcache.response_cache.max_bytes = cache_bytes
+            compare["speedup"] = {
+                url: round(compare["after"][url] / compare["before"][url], 2)
+                if compare["before"][url] else None
+                for url in ROUTES
+            }
+            results["compare"] = compare
+        urls = suite_urls(db_copy, client)
+        if "routes" in sections:
+            results["routes"] = routes_report(client, urls, args.seconds)
+        if "gunicorn" in sections:
+            results["gunicorn"] = gunicorn_report(urls, args.seconds, args.workers,
+                                                  args.concurrency, tmp)
+        if "payload" in sections:
+            results["payload"] = payload_report(statsapp)
+        if "fields" in sections:
+            results["fields"] = fields_report(statsapp)
+        if "static" in sections:
+            results["static"] = static_report(statsapp)
+        if "leaderboard" in sections:
+            results["leaderboard"] = leaderboard_report(statsapp, db_copy, tmp)
+        if "readmodel" in sections:
+            results["readmodel"] = readmodel_report(statsapp, db_copy, tmp)
+        if "metrics" in sections:
+            results["metrics_overhead_us"] = metrics_overhead(statsapp)
+        if "ingest" in sections:   # adds rows to the copy
+            results["ingest"] = ingest_report(statsapp, db_copy)
+        if "export" in sections:   # last: it grows the copy
+            results["export"] = {"1x": stream_export(client)}
+            grow_db(db_copy, EXPORT_GROWTH)
+            results["export"][f"{EXPORT_GROWTH}x"] = stream_export(client)
+            results["export"]["peak_ratio"] = round(
+                results["export"][f"{EXPORT_GROWTH}x"]["peak_kib"] / results["export"]["1x"]["peak_kib"], 2)
+        statsdb.close_all()
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Negotiated gzip/brotli for /api/* responses.
+
+`compress_response` is an after_request hook for anything that isn't already
+encoded; respcache compresses cached bodies itself so each variant is only
+built once per data version. brotli is optional -- without the package we
+only offer gzip.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+MIN_SIZE = 512          # below this the headers cost more than we save
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5      # fast enough for per-response use, close to gzip -9 size
+
+
+def choose_encoding():
+    """Best encoding the client accepts, or None."""
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Each encoding is its own representation, so it gets its own ETag."""
+    return f"{etag}-{encoding}"
+
+
+def apply_encoding(response, body: bytes, encoding: str):
+    """Put an already-compressed body on `response` and fix up the headers."""
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak=weak)
+    return response
+
+
+def body_size(response):
+    """Body bytes `response` sends, or None for a streamed one (access log, metrics)."""
+    if response.status_code == 304:
+        return 0    # keeps the representation's Content-Length, sends no body
+    length = response.headers.get("Content-Length")    # send_file sets it; the body is a file
+    if length is not None:
+        return int(length)
+    if response.is_streamed:
+        return None
+    return response.calculate_content_length()
+
+
+def compress_response(response):
+    if (
+        not request.path.startswith("/api")
+        or response.is_streamed
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < MIN_SIZE:
+        return response
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    return apply_encoding(response, compress(body, encoding), encoding)
@@ -0,0 +1,96 @@
+"""
+Metric registry: the counter columns of `snapshot`, read from
+PRAGMA table_info(snapshot) once at startup instead of listed by hand.
+
+Columns are named <stat>_gm_<mode> (kills_gm_granitebr): `stat` is what is
+counted, `mode` the game mode. API params take a full column name or a stat
+name, looked up in ?mode= (default granitebr), so another mode's columns
+show up without code changes:
+
+    fields=kills,deaths      two counters (and their deltas, with_deltas=1)
+    fields=all               every counter of the mode
+    no fields=               the route's default set, what it always returned
+
+Which counters have stored deltas, player_summary and tier columns is still
+decided in schema.py (DELTA_COLUMNS, SUMMARY_COLUMNS, TIER_COLUMNS); the
+registry just records it, so a route can tell what it can read from where.
+"""
+import re
+
+import schema
+
+NUMERIC_TYPE_RE = re.compile(r"(INT|REAL|NUM|DEC|FLOA|DOUB)", re.I)
+COLUMN_RE = re.compile(r"^(?P<stat>\w+?)_gm_(?P<mode>[a-z0-9]+)$")
+NOT_COUNTERS = {"id", "player_id"}
+DEFAULT_MODE = "granitebr"
+
+
+class Counter:
+    __slots__ = ("column", "stat", "mode", "has_delta", "in_summary", "in_tiers")
+
+    def __init__(self, column: str):
+        m = COLUMN_RE.match(column)
+        self.column = column
+        self.stat, self.mode = (m["stat"], m["mode"]) if m else (column, None)
+        self.has_delta = column in schema.DELTA_COLUMNS
+        self.in_summary = column in schema.SUMMARY_COLUMNS
+        self.in_tiers = column in schema.TIER_COLUMNS
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Counter({self.column!r})"
+
+
+class Registry:
+    def __init__(self, table_info):
+        """`table_info`: rows of PRAGMA table_info(snapshot)."""
+        self.counters = {
+            row[1]: Counter(row[1]) for row in table_info
+            if row[1] not in NOT_COUNTERS and NUMERIC_TYPE_RE.search(row[2] or "")
+        }
+        self.modes = {}
+        for c in self.counters.values():
+            self.modes.setdefault(c.mode, {})[c.stat] = c
+
+    @classmethod
+    def from_conn(cls, conn):
+        return cls(conn.execute("PRAGMA table_info(snapshot)").fetchall())
+
+    def get(self, name: str, mode: str = DEFAULT_MODE):
+        """Counter for a column name, or a stat name in `mode`; None if unknown."""
+        c = self.counters.get(name)
+        if c is None:
+            c = self.modes.get(mode, {}).get(name)
+        return c
+
+    def column(self, stat: str, mode: str = DEFAULT_MODE):
+        c = self.modes.get(mode, {}).get(stat)
+        return c.column if c is not None else None
+
+    def resolve(self, fields, mode=DEFAULT_MODE, default=()):
+        """
+        Counters for a fields= value ("kills,deaths", "all" or None), in the
+        order asked for. `default` (column names) is used when it's empty.
+        Raises ValueError naming anything unknown.
+        """
+        mode = mode or DEFAULT_MODE
+        if mode not in self.modes:
+            raise ValueError(f"unknown mode {mode!r}")
+        names = [f.strip() for f in (fields or "").split(",") if f.strip()]
+        if not names:
+            return [self.counters[c] for c in default if c in self.counters]
+        if names == ["all"]:
+            return list(self.modes[mode].values())
+        picked = {}
+        unknown = []
+        for name in names:
+            c = self.get(name, mode)
+            if c is None:
+                unknown.append(name)
+            else:
+                picked[c.column] = c
+        if unknown:
+            raise ValueError(f"unknown field(s): {', '.join(unknown)}")
+        return list(picked.values())
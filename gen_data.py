@@ -0,0 +1,222 @@
+"""
+Synthetic stats database for benchmarking: the real player/snapshot/app_state
+schema (DDL copied from ./stats.sqlite3), filled with as many players and as
+much history as you ask for.
+
+    python gen_data.py /tmp/big.sqlite3 --players 300 --days 365
+    python gen_data.py /tmp/small.sqlite3 --players 20 --days 30 --interval 5 --seed 7
+
+It mimics the poller: every `--interval` minutes each online player is
+checked and a snapshot is written only if they finished a match since the
+last check. Players have their own play habits (how many days a week, when
+and how long they play) and skill, and counters only ever go up. Rows are
+inserted in ts order, so ids grow with time like in production.
+
+The derived tables (snapshot_delta, player_summary, ...) are built at the end
+via schema.ensure_schema, unless --raw-only.
+"""
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+SCHEMA_SOURCE = BASE_DIR / "stats.sqlite3"
+BASE_OBJECTS = ("player", "snapshot", "app_state", "idx_snapshot_player_ts", "view_snapshots")
+
+MATCH_MINUTES = 20          # a match plus queueing, roughly
+INSERT_BATCH = 5000
+
+# Mean per-match gain of each counter, from the sample database's most active
+# player. wins/losses/matches are handled separately.
+PER_MATCH = {
+    "assists_gm_granitebr": 2.5,
+    "deaths_gm_granitebr": 1.7,
+    "dmg_gm_granitebr": 1290.0,
+    "hsw_gm_granitebr": 0.63,
+    "intel_pickup_gm_granitebr": 0.8,
+    "kills_gm_granitebr": 4.8,
+    "kw_gm_granitebr": 0.06,
+    "obj_armed_gm_granitebr": 0.016,
+    "obj_destroyed_gm_granitebr": 0.016,
+    "obj_time_gm_granitebr": 7.9,
+    "revives_gm_granitebr": 0.59,
+    "scorein_gm_granitebr": 5160.0,
+    "spot_gm_granitebr": 5.25,
+    "tp_gm_granitebr": 934.0,
+    "vehd_gm_granitebr": 0.12,
+    "hlth_gm_granitebr": 0.26,
+    "obj_defended_gm_granitebr": 0.01,
+    "resp_gm_granitebr": 0.46,
+    "repair_gm_granitebr": 0.63,
+}
+WIN_RATE = 0.08
+SKILL_SCALED = {"kills_gm_granitebr", "dmg_gm_granitebr", "scorein_gm_granitebr",
+                "hsw_gm_granitebr", "kw_gm_granitebr"}
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def copy_schema(out: sqlite3.Connection, source: Path):
+    # immutable: only the DDL is read, and a plain read-only open of a WAL
+    # database leaves -wal/-shm files next to it
+    src = sqlite3.connect(f"file:{source}?mode=ro&immutable=1", uri=True)
+    try:
+        ddl = dict(src.execute(
+            "SELECT name, sql FROM sqlite_master WHERE name IN (%s)"
+            % ",".join("?" * len(BASE_OBJECTS)), BASE_OBJECTS
+        ).fetchall())
+    finally:
+        src.close()
+    missing = [n for n in BASE_OBJECTS if n not in ddl]
+    if missing:
+        raise SystemExit(f"{source} has no {', '.join(missing)}")
+    for name in BASE_OBJECTS:            # tables before the index/view on them
+        out.execute(ddl[name])
+
+
+class Player:
+    def __init__(self, pid: int, rng: random.Random):
+        self.id = pid
+        self.name = f"player{pid:05d}"
+        self.days_per_week = rng.uniform(0.5, 7)
+        self.start_hour = rng.gauss(20, 2.5)         # UTC, evenings mostly
+        self.session_hours = rng.uniform(0.5, 4)
+        self.skill = rng.lognormvariate(0, 0.3)
+        self.win_rate = min(0.5, WIN_RATE * self.skill)
+        self.pace = rng.uniform(0.6, 1.1)           # share of session time in matches
+        # career so far, so counters don't all start at zero
+        prior = int(rng.expovariate(1 / 200))
+        self.counters = {"matches_gm_granitebr": prior, "wins_gm_granitebr": 0,
+                         "losses_gm_granitebr": 0}
+        self.counters.update({c: 0 for c in PER_MATCH})
+        self.play(prior, rng)
+
+    def play(self, matches: int, rng: random.Random):
+        if not matches:
+            return
+        c = self.counters
+        for col, mean in PER_MATCH.items():
+            m = mean * matches * (self.skill if col in SKILL_SCALED else 1)
+            c[col] += max(0, round(rng.gauss(m, (m ** 0.5) * 1.5)))
+        wins = sum(rng.random() < self.win_rate for _ in range(matches))
+        c["wins_gm_granitebr"] += wins
+        c["losses_gm_granitebr"] += matches - wins
+
+    def sessions(self, day: datetime, rng: random.Random):
+        """(start, end) of the player's session on `day`, or None."""
+        if rng.random() > self.days_per_week / 7:
+            return None
+        start = day + timedelta(hours=rng.gauss(self.start_hour, 1))
+        length = max(0.25, rng.gauss(self.session_hours, self.session_hours / 3))
+        return start, start + timedelta(hours=length)
+
+
+def generate_day(players, day, interval, rng, columns, with_json):
+    """All snapshot rows for one day, sorted by ts."""
+    rows = []
+    per_poll = interval / MATCH_MINUTES
+    step = timedelta(minutes=interval)
+    for p in players:
+        session = p.sessions(day, rng)
+        if session is None:
+            continue
+        t, end = session
+        # poll times are on the poller's grid, with a few seconds of jitter
+        t = day + step * (int((t - day) / step) + 1)
+        while t <= end:
+            expected = per_poll * p.pace
+            n = int(expected) + (rng.random() < expected - int(expected))
+            if n:
+                p.play(n, rng)
+                p.counters["matches_gm_granitebr"] += n
+                ts = (t + timedelta(seconds=rng.randint(-12, 12))).strftime(TS_FORMAT)
+                values = [p.counters[c] for c in columns]
+                blob = json.dumps(p.counters) if with_json else None
+                rows.append((p.id, ts, *values, blob))
+            t += step
+    rows.sort(key=lambda r: r[1])
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("out", help="database file to create")
+    ap.add_argument("--players", type=int, default=50)
+    ap.add_argument("--days", type=float, default=90, help="history length")
+    ap.add_argument("--interval", type=float, default=10, help="poll interval, minutes")
+    ap.add_argument("--end", default=None, help="history stops at this date, YYYY-MM-DD (default: today)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--no-json", action="store_true", help="leave snapshot.json NULL")
+    ap.add_argument("--raw-only", action="store_true", help="skip building derived tables")
+    ap.add_argument("--schema-from", default=str(SCHEMA_SOURCE))
+    ap.add_argument("--force", action="store_true", help="overwrite `out` if it exists")
+    args = ap.parse_args()
+
+    out_path = Path(args.out)
+    if out_path.exists():
+        if not args.force:
+            raise SystemExit(f"{out_path} exists (use --force)")
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{out_path}{suffix}").unlink(missing_ok=True)
+
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(out_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")      # throwaway file, bulk load
+    copy_schema(conn, Path(args.schema_from))
+
+    columns = [r["name"] for r in conn.execute("PRAGMA table_info(snapshot)")
+               if r["name"] not in ("id", "player_id", "ts", "json")]
+    players = [Player(i, rng) for i in range(1, args.players + 1)]
+    conn.executemany("INSERT INTO player (id, name) VALUES (?, ?)",
+                     [(p.id, p.name) for p in players])
+
+    end = (datetime.strptime(args.end, "%Y-%m-%d") if args.end
+           else datetime.now(timezone.utc).replace(tzinfo=None))
+    end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    day = end - timedelta(days=int(args.days))
+    insert = (f"INSERT INTO snapshot (player_id, ts, {', '.join(columns)}, json) "
+              f"VALUES ({', '.join('?' * (len(columns) + 3))})")
+
+    t0 = time.perf_counter()
+    total, pending = 0, []
+    while day < end:
+        pending += generate_day(players, day, args.interval, rng, columns, not args.no_json)
+        if len(pending) >= INSERT_BATCH:
+            with conn:
+                conn.executemany(insert, pending)
+            total += len(pending)
+            pending = []
+            print(f"\r{day:%Y-%m-%d}  {total} snapshots", end="", file=sys.stderr)
+        day += timedelta(days=1)
+    with conn:
+        conn.executemany(insert, pending)
+        total += len(pending)
+        next_tick = datetime.now(timezone.utc) + timedelta(minutes=args.interval)
+        conn.executemany(
+            "INSERT INTO app_state (key, value, updated_at) VALUES (?, ?, datetime('now'))",
+            [("timer_minutes", json.dumps(int(args.interval))),
+             ("next_tick_at", json.dumps(next_tick.isoformat()))],
+        )
+    print(f"\r{total} snapshots for {len(players)} players in "
+          f"{time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    if not args.raw_only:
+        sys.path.insert(0, str(BASE_DIR))
+        import schema
+        t0 = time.perf_counter()
+        schema.ensure_schema(conn)
+        conn.commit()
+        print(f"derived tables built in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
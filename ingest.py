@@ -0,0 +1,278 @@
+"""
+Batched writes: snapshot ingest and the refresh flag, through one writer
+queue per process.
+
+    POST /api/ingest            (Authorization: Bearer $STATS_INGEST_TOKEN)
+    {"snapshots": [{"player": "name", "ts": "2026-10-17 12:00:00",
+                    "counters": {"kills": 812, "deaths_gm_granitebr": 640, ...},
+                    "json": "..."}],
+     "state": {"next_tick_at": "2026-10-17T12:10:00+00:00", "force_refresh": 0}}
+
+or from Python (the poller):
+
+    import ingest
+    ingest.submit_snapshots(rows, state={"next_tick_at": ...})
+
+Counters are column names or stat names in "mode" (default granitebr), as
+for fields= (counters.py); ones not given are NULL. `ts` is UTC and
+defaults to now. `state` sets app_state keys (STATE_KEYS), stored as JSON
+like the poller always has.
+
+Jobs go on a queue; a background thread (batching.BatchWriter, one per
+worker, as for the access log) takes whatever has piled up -- up to
+GROUP_MAX_ROWS, waiting at most GROUP_WAIT_SECONDS for more -- and writes it
+all in one BEGIN IMMEDIATE transaction on statsdb's writer connection:
+player names resolved to ids in one pass (new ones created), every snapshot
+in one executemany, then the state keys. The triggers keep snapshot_delta /
+player_summary / leaderboard current inside that same transaction, so
+readers see a tick all at once or not at all, and it is one commit (one WAL
+sync) however many players were polled. A group with snapshots in it also
+moves the leaderboard windows up to the current hour if they're behind (one
+read of leaderboard_span otherwise). /api/trigger_refresh goes through the
+same queue, so it never opens a write transaction of its own.
+
+The caller waits for its group to commit and gets a result dict back; if
+the transaction fails every job in the group gets the exception. A full
+queue, or no commit within SUBMIT_TIMEOUT, raises IngestBusy. Payloads
+are checked before they're queued, so one bad request can't fail the others.
+"""
+import atexit
+import json
+import os
+import queue
+from concurrent.futures import Future, TimeoutError
+from datetime import datetime, timezone
+
+import auth
+import counters
+import schema
+from batching import BatchWriter
+from statsdb import db, db_write
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"     # how snapshot.ts is stored
+STATE_KEYS = ("next_tick_at", "timer_minutes", "force_refresh")
+MAX_SNAPSHOTS = 10_000              # per request
+GROUP_MAX_ROWS = 5000
+GROUP_WAIT_SECONDS = 0.02
+QUEUE_MAX = 1000                    # jobs
+SUBMIT_TIMEOUT = 30.0
+NAME_CHUNK = 500                    # names per IN (...) lookup
+REFRESH_COOLDOWN_SECONDS = 30
+
+TOKEN = os.environ.get("STATS_INGEST_TOKEN")
+
+
+class IngestError(ValueError):
+    """A payload we won't queue (the API answers 400)."""
+
+
+class IngestBusy(Exception):
+    """The queue is full or the write didn't finish in time (the API answers 503)."""
+
+
+def authorized(header):
+    """Whether an Authorization header carries STATS_INGEST_TOKEN. Always False if it's unset."""
+    return auth.bearer_ok(header, TOKEN)
+
+
+def normalize_ts(raw):
+    """An ISO time (naive = UTC) or None (now) -> snapshot.ts format."""
+    if raw is None:
+        return datetime.now(timezone.utc).strftime(TS_FORMAT)
+    try:
+        dt = datetime.fromisoformat(str(raw).strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise IngestError(f"bad ts {raw!r}") from None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.strftime(TS_FORMAT)
+
+
+def prepare(snapshots, registry, mode=None):
+    """
+    Check a batch and turn it into (player name, ts, {column: value}, json)
+    tuples. Raises IngestError naming the first problem.
+    """
+    if not isinstance(snapshots, list):
+        raise IngestError("snapshots must be a list")
+    if len(snapshots) > MAX_SNAPSHOTS:
+        raise IngestError(f"at most {MAX_SNAPSHOTS} snapshots per batch")
+    mode = mode or counters.DEFAULT_MODE
+    out = []
+    for i, s in enumerate(snapshots):
+        if not isinstance(s, dict):
+            raise IngestError(f"snapshots[{i}]: not an object")
+        name = s.get("player")
+        if not isinstance(name, str) or not name.strip():
+            raise IngestError(f"snapshots[{i}]: player name missing")
+        values = {}
+        for key, value in (s.get("counters") or {}).items():
+            c = registry.get(key, mode)
+            if c is None:
+                raise IngestError(f"snapshots[{i}]: unknown counter {key!r}")
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+                raise IngestError(f"snapshots[{i}]: {key} must be an integer")
+            values[c.column] = value
+        blob = s.get("json")
+        if blob is not None and not isinstance(blob, str):
+            blob = json.dumps(blob)
+        out.append((name.strip(), normalize_ts(s.get("ts")), values, blob))
+    return out
+
+
+def prepare_state(state):
+    """{key: value} for app_state -> [(key, JSON text)]."""
+    if not state:
+        return []
+    if not isinstance(state, dict):
+        raise IngestError("state must be an object")
+    unknown = sorted(set(state) - set(STATE_KEYS))
+    if unknown:
+        raise IngestError(f"unknown state key(s): {', '.join(unknown)}")
+    return [(key, json.dumps(value)) for key, value in state.items()]
+
+
+# --- the writer ---
+
+def resolve_players(conn, names):
+    """{name: id} for `names`, creating the missing ones. Two statements per NAME_CHUNK names."""
+    ids = {}
+    names = list(dict.fromkeys(names))
+    conn.executemany("INSERT OR IGNORE INTO player (name) VALUES (?)", [(n,) for n in names])
+    for i in range(0, len(names), NAME_CHUNK):
+        chunk = names[i:i + NAME_CHUNK]
+        ids.update(conn.execute(
+            f"SELECT name, id FROM player WHERE name IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    return ids
+
+
+def _insert_sql(columns):
+    return (f"INSERT INTO snapshot (player_id, ts, {', '.join(columns)}, json) "
+            f"VALUES ({', '.join('?' * (len(columns) + 3))})")
+
+
+def _set_state(conn, items):
+    conn.executemany("""
+        INSERT INTO app_state (key, value, updated_at) VALUES (?, ?, datetime('now'))
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """, items)
+
+
+def _refresh(conn):
+    """The old /api/trigger_refresh body: set force_refresh unless it was set < 30s ago."""
+    row = conn.execute(
+        "SELECT (julianday('now') - julianday(updated_at)) * 86400 FROM app_state WHERE key = 'force_refresh'"
+    ).fetchone()
+    if row and row[0] is not None and row[0] < REFRESH_COOLDOWN_SECONDS:
+        return {"ok": False, "message": "Please wait before refreshing again."}
+    _set_state(conn, [("force_refresh", "1")])
+    return {"ok": True, "message": "Refresh requested"}
+
+
+def write_group(conn, jobs, columns):
+    """
+    Apply a group of jobs in one transaction; returns their results in order.
+    jobs: ("snapshots", (rows, state)) or ("refresh", None).
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    names = [r[0] for kind, payload in jobs if kind == "snapshots" for r in payload[0]]
+    ids = resolve_players(conn, names) if names else {}
+    insert = _insert_sql(columns)
+    results = []
+    for kind, payload in jobs:
+        if kind == "refresh":
+            results.append(_refresh(conn))
+            continue
+        rows, state = payload
+        conn.executemany(insert, [
+            (ids[name], ts, *(values.get(c) for c in columns), blob)
+            for name, ts, values, blob in rows
+        ])
+        _set_state(conn, state)
+        results.append({"ok": True, "snapshots": len(rows)})
+    # a tick also moves the leaderboard windows when the hour has turned, so
+    # its GETs stay read-only; other groups (refresh flags) leave them be
+    if names and schema.leaderboard_stale(conn):
+        schema.advance_leaderboard(conn)
+    return results
+
+
+def _job_rows(job):
+    kind, payload, _ = job
+    return len(payload[0]) if kind == "snapshots" else 1
+
+
+class Writer:
+    """Jobs (kind, payload, Future) through a batching.BatchWriter, one group commit per batch."""
+
+    def __init__(self):
+        self.groups = 0
+        self.rows = 0
+        self._columns = None
+        self._batcher = BatchWriter("ingest", self._write, QUEUE_MAX, GROUP_MAX_ROWS,
+                                    GROUP_WAIT_SECONDS, size=_job_rows)
+
+    def submit(self, kind, payload=None) -> Future:
+        future = Future()
+        try:
+            self._batcher.put((kind, payload, future), timeout=SUBMIT_TIMEOUT)
+        except queue.Full:
+            raise IngestBusy("the ingest queue is full, try again later") from None
+        return future
+
+    def _write(self, group):
+        try:
+            with db_write() as conn:
+                if self._columns is None:
+                    self._columns = list(counters.Registry.from_conn(conn).counters)
+                results = write_group(conn, [(k, p) for k, p, _ in group], self._columns)
+        except Exception as e:
+            print(f"[ingest] group of {len(group)} jobs failed: {e}")
+            for _, _, future in group:
+                future.set_exception(e)
+            return
+        self.groups += 1
+        self.rows += sum(_job_rows(job) for job in group)
+        for (_, _, future), result in zip(group, results):
+            future.set_result(result)
+
+    def flush(self, timeout=5.0):
+        """Wait (up to `timeout`) for everything queued so far to be written."""
+        self._batcher.flush(timeout)
+
+
+writer = Writer()
+atexit.register(writer.flush)
+
+
+def _result(future):
+    try:
+        return future.result(SUBMIT_TIMEOUT)
+    except TimeoutError:
+        raise IngestBusy("timed out waiting for the write; it may still be applied") from None
+
+
+_registry = None
+
+
+def submit_snapshots(snapshots, state=None, mode=None, registry=None, wait=True):
+    """
+    Queue a batch of snapshots (and app_state keys) for the writer. Returns
+    the result dict once it's committed, or the Future with wait=False.
+    Raises IngestError for a bad batch, IngestBusy if it can't be queued or
+    doesn't commit in time.
+    """
+    global _registry
+    if registry is None:
+        if _registry is None:
+            with db() as conn:
+                _registry = counters.Registry.from_conn(conn)
+        registry = _registry
+    future = writer.submit("snapshots", (prepare(snapshots, registry, mode), prepare_state(state)))
+    return _result(future) if wait else future
+
+
+def request_refresh():
+    """Set force_refresh through the writer queue; {"ok": False, ...} if it was set too recently."""
+    return _result(writer.submit("refresh"))
@@ -0,0 +1,482 @@
+"""
+Request and SQL metrics, served as Prometheus text from /api/metrics.
+
+Per process we keep, in memory:
+  - request count by route/method/status
+  - latency and response-size histograms by route/method
+  - execution time histograms per SQL statement (keyed by a short
+    fingerprint of the SQL text; statsapp_sql_query_info maps it back)
+  - the last few slow statements with their EXPLAIN QUERY PLAN
+
+SQL is timed by wrapping the connections statsdb.db()/db_write() hand out
+(see statsdb.set_connection_wrapper), so queries from respcache, stream and
+retention are counted too.
+
+gunicorn workers are separate processes, so each one has a background thread
+dumping its state to <METRICS_DIR>/<pid>.json every FLUSH_SECONDS (when
+something changed), and a scrape merges every worker's file. Files of
+workers that have exited are folded into dead.json so counters keep going
+up instead of resetting.
+
+/api/metrics and /api/metrics/slow need STATS_METRICS_TOKEN (auth.py).
+
+Settings (env):
+  STATS_METRICS=0            turn all of it off
+  STATS_METRICS_DIR          where worker files go (default: <tmp>/statsapp-metrics)
+  STATS_SLOW_SQL_MS          EXPLAIN statements slower than this (default 100)
+"""
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from pathlib import Path
+
+from flask import jsonify, request
+
+import auth
+import statsdb
+from compress import body_size
+
+ENABLED = os.environ.get("STATS_METRICS", "1") != "0"
+METRICS_DIR = Path(os.environ.get("STATS_METRICS_DIR",
+                                  Path(tempfile.gettempdir()) / "statsapp-metrics"))
+SLOW_SQL_MS = float(os.environ.get("STATS_SLOW_SQL_MS", "100"))
+FLUSH_SECONDS = 1.0
+MAX_SLOW = 50                 # slow statements kept per process
+MAX_FINGERPRINTS = 2000       # distinct SQL texts we'll label; the rest are "other"
+SQL_INFO_CHARS = 300          # SQL text length in statsapp_sql_query_info
+QUANTILES = (0.5, 0.95, 0.99)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+               0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+_lock = threading.Lock()
+_requests = {}                # (route, method, status) -> count
+_latency = {}                 # (route, method) -> [bucket counts..., +Inf count, sum]
+_sizes = {}
+_sql = {}                     # fingerprint -> histogram
+_sql_text = {}                # fingerprint -> SQL (trimmed)
+_fingerprints = {}            # SQL text -> fingerprint
+_slow = deque(maxlen=MAX_SLOW)
+_plans = {}                   # fingerprint -> EXPLAIN QUERY PLAN text
+_dirty = False
+_flusher_started = False     # threads don't survive fork; reset per worker
+
+
+# ---- collection ----
+
+def _observe(table, key, bounds, value):
+    hist = table.get(key)
+    if hist is None:
+        hist = table[key] = [0] * (len(bounds) + 2)
+    hist[bisect_left(bounds, value)] += 1
+    hist[-1] += value
+
+
+def _reset_after_fork():
+    """A forked worker starts from zero rather than re-reporting the master's counts."""
+    global _lock, _dirty, _flusher_started
+    _lock = threading.Lock()
+    _dirty = False
+    _flusher_started = False
+    for table in (_requests, _latency, _sizes, _sql):
+        table.clear()
+    _slow.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def fingerprint(sql: str) -> str:
+    fp = _fingerprints.get(sql)
+    if fp is None:
+        if len(_fingerprints) >= MAX_FINGERPRINTS:
+            return "other"
+        fp = hashlib.sha1(" ".join(sql.split()).encode()).hexdigest()[:10]
+        _fingerprints[sql] = fp
+        _sql_text[fp] = " ".join(sql.split())[:SQL_INFO_CHARS]
+    return fp
+
+
+def _explain(conn, sql, params):
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        return "\n".join(r[3] for r in rows)
+    except Exception as e:  # DDL, PRAGMA, multi-statement, ...
+        return f"(no plan: {e})"
+
+
+def observe_sql(conn, sql, params, seconds):
+    global _dirty
+    fp = fingerprint(sql)
+    with _lock:
+        _observe(_sql, fp, SQL_BUCKETS, seconds)
+        _dirty = True
+    if seconds * 1000 >= SLOW_SQL_MS:
+        plan = _plans.get(fp)
+        if plan is None:
+            plan = _plans[fp] = _explain(conn, sql, params)
+        _slow.append({
+            "query": fp,
+            "ms": round(seconds * 1000, 2),
+            "at": time.time(),
+            "sql": _sql_text.get(fp, sql[:SQL_INFO_CHARS]),
+            "plan": plan,
+        })
+
+
+class TimedCursor:
+    """
+    Cursor proxy for a SELECT. The statement is observed at its first fetch,
+    timed from the execute() call, so execute + fetch count as one query;
+    fetchmany() loops (exports) add one observation per batch after that.
+    """
+    __slots__ = ("_cur", "_conn", "_sql", "_params", "_t0")
+
+    def __init__(self, cur, conn, sql, params, t0):
+        self._cur = cur
+        self._conn = conn
+        self._sql = sql
+        self._params = params
+        self._t0 = t0
+
+    def fetchone(self):
+        out = self._cur.fetchone()
+        if self._t0:
+            observe_sql(self._conn, self._sql, self._params, time.perf_counter() - self._t0)
+            self._t0 = 0.0
+        return out
+
+    def fetchall(self):
+        t0 = self._t0 or time.perf_counter()
+        out = self._cur.fetchall()
+        observe_sql(self._conn, self._sql, self._params, time.perf_counter() - t0)
+        self._t0 = 0.0
+        return out
+
+    def fetchmany(self, size=None):
+        t0 = self._t0 or time.perf_counter()
+        out = self._cur.fetchmany(size or self._cur.arraysize)
+        observe_sql(self._conn, self._sql, self._params, time.perf_counter() - t0)
+        self._t0 = 0.0
+        return out
+
+    def __iter__(self):
+        # row-by-row iteration isn't timed; count the execute at least
+        if self._t0:
+            observe_sql(self._conn, self._sql, self._params, time.perf_counter() - self._t0)
+            self._t0 = 0.0
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class TimedConnection:
+    """
+    Connection proxy timing execute()/executemany(). Statements without a
+    result set are observed right away; SELECTs when they're fetched.
+    """
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, params=()):
+        t0 = time.perf_counter()
+        cur = self._conn.execute(sql, params)
+        if cur.description is None:
+            observe_sql(self._conn, sql, params, time.perf_counter() - t0)
+            return cur
+        return TimedCursor(cur, self._conn, sql, params, t0)
+
+    def executemany(self, sql, seq):
+        t0 = time.perf_counter()
+        cur = self._conn.executemany(sql, seq)
+        observe_sql(self._conn, sql, (), time.perf_counter() - t0)
+        return cur
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# The hooks resolve the request proxy once: every attribute read through
+# flask.request costs about a microsecond on its own.
+
+def before_request():
+    request._get_current_object().environ["statsapp.metrics_t0"] = time.perf_counter()
+
+
+def after_request(response):
+    global _dirty
+    req = request._get_current_object()
+    t0 = req.environ.pop("statsapp.metrics_t0", None)
+    if t0 is None:
+        return response
+    elapsed = time.perf_counter() - t0
+    rule = req.url_rule
+    route = rule.rule if rule is not None else "(unmatched)"
+    method = req.method
+    size = body_size(response)
+    with _lock:
+        key = (route, method, response.status_code)
+        _requests[key] = _requests.get(key, 0) + 1
+        _observe(_latency, (route, method), LATENCY_BUCKETS, elapsed)
+        if size is not None:
+            _observe(_sizes, (route, method), SIZE_BUCKETS, size)
+        _dirty = True
+    if not _flusher_started:
+        _start_flusher()
+    return response
+
+
+# ---- per-worker files ----
+
+def _snapshot():
+    with _lock:
+        return {
+            "requests": [[*k, v] for k, v in _requests.items()],
+            "latency": [[*k, list(h)] for k, h in _latency.items()],
+            "sizes": [[*k, list(h)] for k, h in _sizes.items()],
+            "sql": [[k, list(h)] for k, h in _sql.items()],
+            "sql_text": dict(_sql_text),
+            "slow": list(_slow),
+        }
+
+
+def _write_json(path: Path, data):
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+def flush():
+    """Write this worker's state to its file."""
+    global _dirty
+    _dirty = False
+    try:
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        _write_json(METRICS_DIR / f"{os.getpid()}.json", _snapshot())
+    except OSError as e:
+        print(f"[metrics] flush failed: {e}")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        if _dirty:
+            flush()
+
+
+def _start_flusher():
+    """One flusher thread per process, started from the first request after a fork."""
+    global _flusher_started
+    with _lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+    threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _empty():
+    return {"requests": {}, "latency": {}, "sizes": {}, "sql": {}, "sql_text": {}, "slow": []}
+
+
+def _merge_hist(into, key, hist):
+    cur = into.get(key)
+    if cur is None:
+        into[key] = list(hist)
+    else:
+        for i, v in enumerate(hist):
+            cur[i] += v
+
+
+def _merge(acc, data):
+    """Add one worker's dump (list form, as written by _snapshot) into acc (dict form)."""
+    for *key, n in data["requests"]:
+        key = tuple(key)
+        acc["requests"][key] = acc["requests"].get(key, 0) + n
+    for name in ("latency", "sizes"):
+        for route, method, hist in data[name]:
+            _merge_hist(acc[name], (route, method), hist)
+    for fp, hist in data["sql"]:
+        _merge_hist(acc["sql"], fp, hist)
+    acc["sql_text"].update(data["sql_text"])
+    acc["slow"].extend(data["slow"])
+
+
+def _as_lists(acc):
+    return {
+        "requests": [[*k, v] for k, v in acc["requests"].items()],
+        "latency": [[*k, h] for k, h in acc["latency"].items()],
+        "sizes": [[*k, h] for k, h in acc["sizes"].items()],
+        "sql": [[k, h] for k, h in acc["sql"].items()],
+        "sql_text": acc["sql_text"],
+        "slow": acc["slow"][-MAX_SLOW:],
+    }
+
+
+def collect():
+    """Merged state of every worker (this one flushed first)."""
+    flush()
+    acc = _empty()
+    workers = 0
+    with open(METRICS_DIR / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead_path = METRICS_DIR / "dead.json"
+        dead = _empty()
+        if dead_path.exists():
+            _merge(dead, json.loads(dead_path.read_text()))
+        folded = []
+        for path in METRICS_DIR.glob("*.json"):
+            if not path.stem.isdigit():
+                continue
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue  # half-written by a dying worker; skip this round
+            if _alive(int(path.stem)):
+                _merge(acc, data)
+                workers += 1
+            else:
+                _merge(dead, data)
+                folded.append(path)
+        if folded:
+            _write_json(dead_path, _as_lists(dead))
+            for path in folded:
+                path.unlink(missing_ok=True)
+    _merge(acc, _as_lists(dead))
+    acc["slow"].sort(key=lambda s: s["at"])
+    acc["workers"] = workers
+    return acc
+
+
+# ---- exposition ----
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+
+def quantile(q, bounds, hist):
+    """Estimate a quantile from bucket counts, interpolating inside the bucket."""
+    counts = hist[:-1]
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(counts):
+        if seen + n >= rank and n:
+            if i == len(bounds):        # +Inf bucket: best we can say is the top bound
+                return bounds[-1]
+            lo = bounds[i - 1] if i else 0.0
+            return lo + (bounds[i] - lo) * (rank - seen) / n
+        seen += n
+    return bounds[-1]
+
+
+def _histogram(out, name, help_text, bounds, series):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} histogram")
+    for labels, hist in series:
+        cumulative = 0
+        for bound, n in zip(bounds, hist):
+            cumulative += n
+            out.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += hist[len(bounds)]
+        out.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+        out.append(f"{name}_sum{{{labels}}} {hist[-1]:.6f}")
+        out.append(f"{name}_count{{{labels}}} {cumulative}")
+
+
+def _quantiles(out, name, help_text, bounds, series):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} gauge")
+    for labels, hist in series:
+        for q in QUANTILES:
+            v = quantile(q, bounds, hist)
+            if v is not None:
+                out.append(f'{name}{{{labels},quantile="{q}"}} {v:.6f}')
+
+
+def render(acc) -> str:
+    out = []
+    out.append("# HELP statsapp_http_requests_total Requests handled, by route and status.")
+    out.append("# TYPE statsapp_http_requests_total counter")
+    for (route, method, status), n in sorted(acc["requests"].items()):
+        out.append(f"statsapp_http_requests_total{{{_labels(route=route, method=method, status=status)}}} {n}")
+
+    latency = [(_labels(route=r, method=m), h) for (r, m), h in sorted(acc["latency"].items())]
+    _histogram(out, "statsapp_http_request_duration_seconds",
+               "Time from before_request to the end of after_request.", LATENCY_BUCKETS, latency)
+    _quantiles(out, "statsapp_http_request_duration_quantile_seconds",
+               "p50/p95/p99 estimated from the duration histogram.", LATENCY_BUCKETS, latency)
+
+    sizes = [(_labels(route=r, method=m), h) for (r, m), h in sorted(acc["sizes"].items())]
+    _histogram(out, "statsapp_http_response_size_bytes",
+               "Response body bytes on the wire (streamed responses excluded).", SIZE_BUCKETS, sizes)
+
+    sql = [(_labels(query=fp), h) for fp, h in sorted(acc["sql"].items())]
+    _histogram(out, "statsapp_sql_query_duration_seconds",
+               "Execute and fetch time per SQL statement.", SQL_BUCKETS, sql)
+    _quantiles(out, "statsapp_sql_query_duration_quantile_seconds",
+               "p50/p95/p99 estimated from the SQL duration histogram.", SQL_BUCKETS, sql)
+
+    out.append("# HELP statsapp_sql_query_info SQL text behind each query fingerprint.")
+    out.append("# TYPE statsapp_sql_query_info gauge")
+    for fp in sorted(acc["sql"]):
+        text = acc["sql_text"].get(fp, "")
+        out.append(f"statsapp_sql_query_info{{{_labels(query=fp, sql=text)}}} 1")
+
+    out.append("# HELP statsapp_metrics_workers Worker processes that reported.")
+    out.append("# TYPE statsapp_metrics_workers gauge")
+    out.append(f"statsapp_metrics_workers {acc['workers']}")
+    return "\n".join(out) + "\n"
+
+
+@auth.metrics_only
+def metrics_view():
+    return render(collect()), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@auth.metrics_only
+def slow_view():
+    return jsonify(collect()["slow"])
+
+
+def init_app(app):
+    """
+    Hook into `app`. Call this before registering other after_request hooks:
+    Flask runs them in reverse, so ours goes last and sees the final body.
+    """
+    if not ENABLED:
+        return
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.add_url_rule("/api/metrics", "api_metrics", metrics_view)
+    app.add_url_rule("/api/metrics/slow", "api_metrics_slow", slow_view)
+    statsdb.set_connection_wrapper(TimedConnection)
+    atexit.register(flush)
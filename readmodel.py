@@ -0,0 +1,385 @@
+"""
+Optional in-memory read model of `snapshot` for /api/snapshots
+(STATS_READMODEL=1).
+
+The raw table is integer counters keyed by (player_id, ts), so instead of
+turning every row into a sqlite3.Row and then a dict, the model keeps it as
+columns in one memory-mapped file under STATS_READMODEL_DIR (/dev/shm when
+there is one):
+
+    id        int64     \\
+    player_id int32      |  one entry per row, rows sorted by
+    ts        19 bytes   |  (player_id, ts, id): a player's history is one
+    <counter> int64      |  contiguous slice, found in `segments`
+    delta_*   int64     /   (the stored snapshot_delta values)
+    by_ts     int32     positions in (ts, id) order, for all-player pages
+
+A NULL counter is stored as NULL_VALUE. Rows whose player has no `player`
+row are left out, like the SQL's JOIN.
+
+A page is then: bisect the slice (or by_ts) for from/to/the cursor, cut
+`limit` positions, and read each column for those positions in one go
+(memoryview slices for a player, operator.itemgetter over by_ts otherwise),
+zipped into rows at the end. Same rows, names and order as
+snapshot_query_sql on `snapshot`. The retention tiers are still read with
+SQL and merged in by the route. `flask --app statsapp check-readmodel`
+compares the two for every query shape.
+
+Sharing: the file is mapped MAP_SHARED read-only. Built at import time, so
+with `gunicorn --preload` the master builds it once and every worker reads
+the same pages. Rows after the build (id > max_id) are caught up per
+process on each request into a small `tail` of tuples that queries merge
+in. The base is rebuilt (into a new file, named by max id, so workers that
+rebuild at the same point map one copy) when
+  - the tail passes TAIL_MAX rows,
+  - a row arrives out of order for its player (a late write changes the
+    next row's stored delta), or
+  - retention ran (app_state 'retention_at' moved: rows were deleted), or
+  - snapshot_delta was recomputed (app_state 'deltas_at', bumped by
+    `flask rebuild-deltas`): the mapped delta columns are stale.
+
+Stdlib only (array/mmap/bisect). There's no numpy here, so the "vector"
+operations are C-level slices and itemgetter gathers, not SIMD.
+"""
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from array import array
+from operator import itemgetter
+from pathlib import Path
+
+ENABLED = os.environ.get("STATS_READMODEL", "0").lower() in ("1", "true", "yes")
+MODEL_DIR = Path(os.environ.get(
+    "STATS_READMODEL_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+))
+
+TS_WIDTH = 19                       # "YYYY-MM-DD HH:MM:SS"
+NULL_VALUE = -(2 ** 63)
+TAIL_MAX = 20_000
+FETCH_BATCH = 10_000
+
+# the markers of writes that change existing rows (see schema.mark_changed)
+GENERATION_SQL = """
+SELECT COALESCE((SELECT value FROM app_state WHERE key = 'retention_at'), '') || '/' ||
+       COALESCE((SELECT value FROM app_state WHERE key = 'deltas_at'), '')"""
+
+
+class ModelError(Exception):
+    """The table can't be represented (e.g. a ts that isn't TS_WIDTH long)."""
+
+
+def _rows_sql(counter_cols, delta_cols, where=""):
+    cols = ", ".join(f"s.{c}" for c in counter_cols)
+    deltas = ", ".join(f"COALESCE(d.delta_{c}, 0)" for c in delta_cols)
+    return f"""
+        SELECT s.id, s.player_id, s.ts, {cols}, {deltas}
+        FROM snapshot s
+        JOIN player p ON p.id = s.player_id
+        LEFT JOIN snapshot_delta d ON d.snapshot_id = s.id
+        {where}"""
+
+
+class Base:
+    """The mapped columns: a file plus its metadata (.json next to it)."""
+
+    def __init__(self, path: Path, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.n = meta["n"]
+        self.max_id = meta["max_id"]
+        self.generation = meta["generation"]
+        self.segments = {int(pid): (start, end) for pid, start, end in meta["segments"]}
+        with open(path, "rb") as f:
+            # a zero-length file can't be mapped
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if meta["size"] else b""
+        view = memoryview(self._mm)
+
+        def col(name):
+            off, length, fmt = meta["columns"][name]
+            mv = view[off:off + length]
+            return mv if fmt == "B" else mv.cast(fmt)
+
+        self.ids = col("id")
+        self.pids = col("player_id")
+        self.ts = col("ts")
+        self.by_ts = col("by_ts")
+        self.cols = {name: col(name) for name in meta["columns"]
+                     if name not in ("id", "player_id", "ts", "by_ts")}
+        self.nbytes = meta["size"]
+
+    def ts_at(self, i):
+        return str(self.ts[i * TS_WIDTH:(i + 1) * TS_WIDTH], "ascii")
+
+    def key_at(self, i):
+        return (self.ts_at(i), self.ids[i])
+
+    def ts_range(self, lo, hi):
+        """ts of positions lo..hi-1 (contiguous), decoded in one go."""
+        raw = str(self.ts[lo * TS_WIDTH:hi * TS_WIDTH], "ascii")
+        return [raw[k:k + TS_WIDTH] for k in range(0, len(raw), TS_WIDTH)]
+
+    def last_key(self, pid):
+        seg = self.segments.get(pid)
+        return self.key_at(seg[1] - 1) if seg else None
+
+
+def _file_prefix(db_path):
+    return "readmodel-" + hashlib.sha1(str(Path(db_path).resolve()).encode()).hexdigest()[:12]
+
+
+def build(conn, db_path, counter_cols, delta_cols, out_dir=MODEL_DIR) -> Base:
+    """
+    Load `snapshot` into a new model file (or map an identical one another
+    process just built) and return it.
+    """
+    generation = (conn.execute(GENERATION_SQL).fetchone() or [None])[0]
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM snapshot").fetchone()[0]
+    prefix = _file_prefix(db_path)
+    gen_tag = hashlib.sha1(repr((generation, counter_cols, delta_cols)).encode()).hexdigest()[:8]
+    path = out_dir / f"{prefix}-{max_id}-{gen_tag}.bin"
+    meta_path = path.with_suffix(".json")
+    try:
+        return Base(path, json.loads(meta_path.read_text()))
+    except (FileNotFoundError, ValueError):
+        pass
+
+    ids, pids = array("q"), array("i")
+    ts = bytearray()
+    values = {c: array("q") for c in counter_cols}
+    deltas = {c: array("q") for c in delta_cols}
+    segments = []
+    ncounters = len(counter_cols)
+    # (player_id, ts) index order: ends in the rowid, so no sort
+    cur = conn.execute(_rows_sql(counter_cols, delta_cols, "ORDER BY s.player_id, s.ts, s.id"))
+    while True:
+        batch = cur.fetchmany(FETCH_BATCH)
+        if not batch:
+            break
+        for r in batch:
+            pid = r[1]
+            if not segments or segments[-1][0] != pid:
+                segments.append([pid, len(ids), len(ids)])
+            segments[-1][2] += 1
+            ids.append(r[0])
+            pids.append(pid)
+            t = r[2].encode("ascii") if isinstance(r[2], str) else b""
+            if len(t) != TS_WIDTH:
+                raise ModelError(f"snapshot {r[0]}: ts {r[2]!r} isn't {TS_WIDTH} characters")
+            ts += t
+            for k, c in enumerate(counter_cols, 3):
+                v = r[k]
+                values[c].append(NULL_VALUE if v is None else v)
+            for k, c in enumerate(delta_cols, 3 + ncounters):
+                deltas[c].append(r[k])
+    n = len(ids)
+    # (ts, id) order as one bytes key per row: compared in C by sorted()
+    keys = [bytes(ts[i * TS_WIDTH:(i + 1) * TS_WIDTH]) + ids[i].to_bytes(8, "big", signed=True)
+            for i in range(n)]
+    by_ts = array("i", sorted(range(n), key=keys.__getitem__))
+    del keys
+
+    columns, parts, off = {}, [], 0
+    for name, data, fmt in (
+        # widest first, so every column stays aligned
+        [("id", ids, "q")]
+        + [(c, values[c], "q") for c in counter_cols]
+        + [(f"delta_{c}", deltas[c], "q") for c in delta_cols]
+        + [("player_id", pids, "i"), ("by_ts", by_ts, "i"), ("ts", ts, "B")]
+    ):
+        blob = bytes(data) if fmt == "B" else data.tobytes()
+        columns[name] = (off, len(blob), fmt)
+        parts.append(blob)
+        off += len(blob)
+    meta = {"n": n, "max_id": max_id, "generation": generation, "size": off,
+            "columns": columns, "segments": segments}
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        for blob in parts:
+            f.write(blob)
+    os.replace(tmp, path)
+    tmp = meta_path.with_name(f"{meta_path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(meta))
+    os.replace(tmp, meta_path)
+    # older builds: processes that still map one keep their pages
+    for old in out_dir.glob(f"{prefix}-*"):
+        if old not in (path, meta_path) and not old.name.endswith(".tmp"):
+            old.unlink(missing_ok=True)
+    return Base(path, meta)
+
+
+class ReadModel:
+    def __init__(self, db_path, counter_cols, delta_cols, out_dir=MODEL_DIR):
+        self.db_path = db_path
+        self.counter_cols = list(counter_cols)
+        self.delta_cols = list(delta_cols)
+        self.out_dir = out_dir
+        # (base, tail, last, max_id, names), replaced as a whole so a reader
+        # that takes it once never mixes one base with another's tail:
+        #   tail   rows with id > base.max_id, in id order
+        #   last   player_id -> (ts, id) of their newest tail row
+        #   names  player_id -> name
+        self.state = (None, [], {}, 0, {})
+        self.builds = 0
+        self.build_seconds = None
+        self._lock = threading.Lock()
+        # tail tuples: id, player_id, ts, counters..., deltas...
+        self._col_index = {c: 3 + k for k, c in enumerate(self.counter_cols)}
+        self._col_index.update({f"delta_{c}": 3 + len(self.counter_cols) + k
+                                for k, c in enumerate(self.delta_cols)})
+
+    @property
+    def base(self):
+        return self.state[0]
+
+    def _rebuild(self, conn):
+        t0 = time.perf_counter()
+        base = build(conn, self.db_path, self.counter_cols, self.delta_cols, self.out_dir)
+        names = dict(conn.execute("SELECT id, name FROM player").fetchall())
+        self.state = (base, [], {}, base.max_id, names)
+        self.builds += 1
+        self.build_seconds = round(time.perf_counter() - t0, 3)
+
+    def refresh(self, conn):
+        """Catch up with rows written since the last call (two index lookups when there are none)."""
+        with self._lock:
+            base, tail, last, known_id, names = self.state
+            generation = (conn.execute(GENERATION_SQL).fetchone() or [None])[0]
+            if base is None or generation != base.generation:
+                self._rebuild(conn)
+                return
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM snapshot").fetchone()[0]
+            if max_id == known_id:
+                return
+            if max_id < known_id:
+                self._rebuild(conn)
+                return
+            rows = conn.execute(_rows_sql(self.counter_cols, self.delta_cols,
+                                          "WHERE s.id > ? ORDER BY s.id"), (known_id,)).fetchall()
+            # copies: readers may be using the published ones
+            tail, last, names = list(tail), dict(last), dict(names)
+            for r in rows:
+                pid, key = r[1], (r[2], r[0])
+                prev = last.get(pid) or base.last_key(pid)
+                if prev is not None and key < prev or len(tail) >= TAIL_MAX:
+                    self._rebuild(conn)
+                    return
+                last[pid] = key
+                tail.append(tuple(NULL_VALUE if v is None else v for v in r))
+                if pid not in names:
+                    row = conn.execute("SELECT name FROM player WHERE id = ?", (pid,)).fetchone()
+                    names[pid] = row[0] if row else None
+            self.state = (base, tail, last, max_id, names)
+
+    def stats(self):
+        base, tail, _, max_id, _ = self.state
+        return {
+            "rows": (base.n if base else 0) + len(tail),
+            "tail_rows": len(tail),
+            "max_id": max_id,
+            "file": str(base.path) if base else None,
+            "bytes": base.nbytes if base else 0,
+            "builds": self.builds,
+            "build_seconds": self.build_seconds,
+        }
+
+    def snapshots(self, fields, with_deltas, clamp, order_sql, limit, player_id=None,
+                  any_player=True, since=None, until=None, cursor_ts=None, cursor_id=None):
+        """
+        (column names, row tuples) for one /api/snapshots page from the raw
+        table, like snapshot_query_sql("snapshot", ...) with LIMIT `limit`.
+        `any_player=False` with player_id None is an unknown player: no rows.
+        """
+        base, tail, _, _, names = self.state
+        desc = order_sql == "DESC"
+        cols = [c.column for c in fields]
+        dcols = [f"delta_{c.column}" for c in fields if c.has_delta] if with_deltas else []
+        out_names = ["id", "player_id", "player_name", "timestamp"] + cols + dcols
+        if not any_player and player_id is None:
+            return out_names, []
+
+        # base: one contiguous range of positions (a player's slice) or of by_ts
+        if player_id is not None:
+            lo, hi = base.segments.get(player_id, (0, 0))
+            seq = range(base.n)
+        else:
+            lo, hi = 0, base.n
+            seq = base.by_ts
+        ts_key, full_key = base.ts_at, base.key_at
+        if since:
+            lo = bisect.bisect_left(seq, since, lo, hi, key=ts_key)
+        if until:
+            hi = bisect.bisect_left(seq, until, lo, hi, key=ts_key)
+        if cursor_ts:
+            if cursor_id is not None:
+                probe, key = (cursor_ts, cursor_id), full_key
+            else:
+                probe, key = cursor_ts, ts_key
+            if desc:
+                hi = bisect.bisect_left(seq, probe, lo, hi, key=key)
+            else:
+                lo = bisect.bisect_right(seq, probe, lo, hi, key=key)
+        if desc:
+            lo = max(lo, hi - limit)
+        else:
+            hi = min(hi, lo + limit)
+
+        if hi <= lo:
+            columns = [[] for _ in out_names]
+        elif player_id is not None:
+            columns = [base.ids[lo:hi].tolist(), [player_id] * (hi - lo), None, base.ts_range(lo, hi)]
+            columns += [base.cols[c][lo:hi].tolist() for c in cols + dcols]
+        else:
+            positions = base.by_ts[lo:hi].tolist()
+            gather = itemgetter(*positions) if len(positions) > 1 else (lambda mv: (mv[positions[0]],))
+            columns = [list(gather(base.ids)), list(gather(base.pids)), None,
+                       [base.ts_at(p) for p in positions]]
+            columns += [list(gather(base.cols[c])) for c in cols + dcols]
+        if columns[2] is None:
+            columns[2] = [names.get(pid) for pid in columns[1]]
+        for k in range(4, 4 + len(cols)):
+            if NULL_VALUE in columns[k]:
+                columns[k] = [None if v == NULL_VALUE else v for v in columns[k]]
+        if clamp:
+            for k in range(4 + len(cols), len(out_names)):
+                columns[k] = [v if v > 0 else 0 for v in columns[k]]
+        rows = list(zip(*columns))
+        if desc:
+            rows.reverse()
+
+        if tail:
+            rows = self._merge_tail(rows, tail, names, cols + dcols, clamp, desc, limit,
+                                    player_id, since, until, cursor_ts, cursor_id)
+        return out_names, rows
+
+    def _merge_tail(self, rows, tail, names, value_cols, clamp, desc, limit,
+                    player_id, since, until, cursor_ts, cursor_id):
+        picked = []
+        idx = [self._col_index[c] for c in value_cols]
+        ndeltas = sum(1 for c in value_cols if c.startswith("delta_"))
+        ncols = len(value_cols) - ndeltas
+        for r in tail:
+            rid, pid, ts = r[0], r[1], r[2]
+            if player_id is not None and pid != player_id:
+                continue
+            if since and ts < since or until and ts >= until:
+                continue
+            if cursor_ts:
+                key, probe = ((ts, rid), (cursor_ts, cursor_id)) if cursor_id is not None else (ts, cursor_ts)
+                if (key >= probe) if desc else (key <= probe):
+                    continue
+            vals = [r[i] for i in idx]
+            counters = [None if v == NULL_VALUE else v for v in vals[:ncols]]
+            deltas = [v if v > 0 else 0 for v in vals[ncols:]] if clamp else vals[ncols:]
+            picked.append((rid, pid, names.get(pid), ts, *counters, *deltas))
+        if not picked:
+            return rows
+        merged = rows + picked
+        merged.sort(key=lambda r: (r[3], r[0]), reverse=desc)
+        return merged[:limit]
@@ -0,0 +1,228 @@
+"""
+Response cache for the read API, keyed on the data version.
+
+The data only changes once per poll tick, so a rendered response for
+(route, query args) stays valid until the next write. The data version is
+derived from the database itself -- max(snapshot.id), the snapshot count in
+player_summary, the latest app_state.updated_at and the retention and
+leaderboard markers (retention.py, schema.advance_leaderboard) -- so every gunicorn
+worker sharing the file computes the same version, keeps its own cache, and
+hands out the same ETag for the same bytes. Last-Modified is the latest
+app_state.updated_at: every snapshot insert bumps 'snapshot_at'
+(schema.create_write_marker) and the other writes their own markers, so it
+moves with every write, not only with the poller's timer state. It only
+has one-second resolution, so it is left off (and If-Modified-Since isn't
+answered with a 304) until that second is over: another write in the same
+second would not move it, and an If-Modified-Since-only client would keep
+the older body.
+
+Compressed variants (see compress.py) are cached next to the plain body,
+so a hot response is gzipped/brotli'd once per data version, not per hit.
+
+Working out the version is itself skipped while `PRAGMA data_version` on the
+thread's read connection is unchanged (it only moves when another
+connection commits). The memo is keyed on the bare connection
+(statsdb.read_conn()): db() may hand out a fresh wrapper per call (metrics).
+
+STATS_RESPONSE_CACHE_MB sets the size budget; 0 turns caching off (bench.py
+does that to time the query path).
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Response, request
+
+from compress import MIN_SIZE, apply_encoding, choose_encoding, compress, encoded_etag
+from statsdb import db, read_conn
+
+MAX_ENTRIES = 512
+MAX_BYTES = int(os.environ.get("STATS_RESPONSE_CACHE_MB", "32")) * 1024 * 1024
+
+VERSION_SQL = """
+SELECT
+    (SELECT MAX(id) FROM snapshot),
+    (SELECT SUM(snapshots) FROM player_summary),
+    (SELECT MAX(updated_at) FROM app_state),
+    (SELECT value FROM app_state WHERE key = 'retention_at'),
+    (SELECT value FROM app_state WHERE key = 'leaderboard_at')
+"""
+
+_local = threading.local()
+
+
+def data_version():
+    """(version string, last-modified datetime or None) for the current data."""
+    with db() as conn:
+        dv = conn.execute("PRAGMA data_version").fetchone()[0]
+        cached = getattr(_local, "version", None)
+        raw = read_conn()
+        if cached is not None and _local.conn is raw and _local.dv == dv:
+            return cached
+        max_id, total, updated_at, retention_at, leaderboard_at = conn.execute(VERSION_SQL).fetchone()
+    last_modified = None
+    if updated_at:
+        try:
+            last_modified = datetime.fromisoformat(updated_at).replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    version = (f"{max_id or 0}.{total or 0}.{updated_at or ''}.{retention_at or ''}.{leaderboard_at or ''}",
+               last_modified)
+    _local.conn, _local.dv, _local.version = raw, dv, version
+    return version
+
+
+class ResponseCache:
+    """
+    LRU of rendered bodies, bounded by entry count and total bytes.
+    An entry is (mimetype, {encoding: bytes}); "identity" is the plain body.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (mimetype, {encoding: bytes})
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self._version:
+                # new data: everything we hold is stale
+                self._entries.clear()
+                self._bytes = 0
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, variants) = self._entries.popitem(last=False)
+            self._bytes -= sum(len(v) for v in variants.values())
+            self.evictions += 1
+
+    def put(self, key, version, body, mimetype):
+        """Store the plain body; returns the entry (cached or not)."""
+        entry = (mimetype, {"identity": body})
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            if version != self._version:
+                return entry
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= sum(len(v) for v in old[1].values())
+            self._entries[key] = entry
+            self._bytes += len(body)
+            self._evict()
+        return entry
+
+    def add_variant(self, key, version, entry, encoding, data):
+        """Remember a compressed variant of a cached entry."""
+        with self._lock:
+            if version != self._version or self._entries.get(key) is not entry:
+                return
+            if encoding not in entry[1]:
+                entry[1][encoding] = data
+                self._bytes += len(data)
+                self._evict()
+
+    def note_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def _request_key():
+    args = tuple(sorted(request.args.items(multi=True)))
+    return (request.path, args)
+
+
+def cached_response(view):
+    """
+    Serve a GET route from `response_cache` with ETag/Last-Modified and
+    negotiated compression. Conditional requests matching the current
+    version get a 304 before any SQL or JSON work.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version, last_modified = data_version()
+        if last_modified is not None and last_modified >= datetime.now(timezone.utc).replace(microsecond=0):
+            last_modified = None        # this second may see more writes
+        key = _request_key()
+        etag = hashlib.sha1(repr((key, version)).encode()).hexdigest()[:20]
+
+        def finish(resp, tag=etag):
+            resp.set_etag(tag)
+            if last_modified is not None:
+                resp.last_modified = last_modified
+            # let browsers keep a copy but always revalidate
+            resp.headers["Cache-Control"] = "no-cache"
+            resp.vary.add("Accept-Encoding")
+            return resp
+
+        fresh = None
+        if request.if_none_match:
+            for tag in (etag, encoded_etag(etag, "gzip"), encoded_etag(etag, "br")):
+                if request.if_none_match.contains(tag):
+                    fresh = tag
+                    break
+        else:
+            ims = request.if_modified_since
+            if ims is not None and last_modified is not None and last_modified <= ims:
+                fresh = etag
+        if fresh:
+            response_cache.note_not_modified()
+            return finish(Response(status=304), fresh)
+
+        entry = response_cache.get(key, version)
+        if entry is not None:
+            cache_status = "HIT"
+        else:
+            resp = view(*args, **kwargs)
+            if not isinstance(resp, Response) or resp.status_code != 200:
+                return resp
+            entry = response_cache.put(key, version, resp.get_data(), resp.mimetype)
+            cache_status = "MISS"
+
+        mimetype, variants = entry
+        resp = finish(Response(variants["identity"], mimetype=mimetype))
+        resp.headers["X-Cache"] = cache_status
+        encoding = choose_encoding()
+        if encoding and len(variants["identity"]) >= MIN_SIZE:
+            data = variants.get(encoding)
+            if data is None:
+                data = compress(variants["identity"], encoding)
+                response_cache.add_variant(key, version, entry, encoding, data)
+            apply_encoding(resp, data, encoding)
+        return resp
+
+    return wrapper
@@ -0,0 +1,252 @@
+"""
+Tiered retention: roll old raw snapshots up into snapshot_hourly, and old
+hourly buckets into snapshot_daily (tables defined in schema.py).
+
+Everything runs in small batches, each its own short BEGIN IMMEDIATE
+transaction, so the poller's writes interleave and WAL readers never wait.
+Per batch:
+  raw -> hourly   fold the batch into (player, hour) buckets -- last counter
+                  values, summed deltas, count, first ts -- then delete the
+                  raw rows. A player's latest snapshot is never compacted,
+                  and player_summary's count/first_seen are put back after the
+                  delete triggers run, so /api/overall doesn't move.
+  hourly -> daily the same fold one level up.
+  json            the `json` TEXT copy of the counters is NULLed on raw rows
+                  older than json_days, optionally appended to an NDJSON.gz
+                  archive first. Off unless json_days is given: without
+                  an archive there's no getting the blobs back.
+Freed pages are then handed back with PRAGMA incremental_vacuum, when the
+file has auto_vacuum=INCREMENTAL (see enable_incremental_vacuum()). Folding
+keeps max(snapshot.id) and the snapshot counts, so each batch bumps app_state
+'retention_at' (schema.mark_changed) for the response cache's data version.
+
+Run it from cron / the poller host:
+    flask --app statsapp retention --raw-days 30 --hourly-days 180
+"""
+import gzip
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from schema import DELTA_COLUMNS, TIER_COLUMNS, TIER_TABLES, mark_changed
+from statsdb import db_write
+
+DEFAULT_RAW_DAYS = 30
+DEFAULT_HOURLY_DAYS = 180
+DEFAULT_JSON_DAYS = None    # keep snapshot.json unless asked
+DEFAULT_BATCH = 500
+BATCH_PAUSE_SECONDS = 0.05
+VACUUM_PAGES = 256
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"   # how snapshot.ts is stored
+
+
+def _cutoff(days: float, align: str) -> str:
+    """now - days in UTC, rounded down to the start of the hour/day."""
+    t = datetime.now(timezone.utc) - timedelta(days=days)
+    t = t.replace(minute=0, second=0, microsecond=0)
+    if align == "day":
+        t = t.replace(hour=0)
+    return t.strftime(TS_FORMAT)
+
+
+# Source rows for a fold, restricted to the ids in temp._retention_ids.
+# Both expose: id, player_id, ts, first_ts, n, <TIER_COLUMNS>, delta_<DELTA_COLUMNS>.
+def _raw_source() -> str:
+    cols = ", ".join(f"s.{c}" for c in TIER_COLUMNS)
+    deltas = ", ".join(f"COALESCE(d.delta_{c}, 0) AS delta_{c}" for c in DELTA_COLUMNS)
+    return f"""
+        SELECT s.id, s.player_id, s.ts, s.ts AS first_ts, 1 AS n, {cols}, {deltas}
+        FROM snapshot s
+        LEFT JOIN snapshot_delta d ON d.snapshot_id = s.id
+        WHERE s.id IN (SELECT id FROM temp._retention_ids)"""
+
+
+def _tier_source(table: str) -> str:
+    cols = ", ".join(TIER_COLUMNS + [f"delta_{c}" for c in DELTA_COLUMNS])
+    return f"""
+        SELECT id, player_id, ts, first_ts, snapshots AS n, {cols}
+        FROM {table}
+        WHERE id IN (SELECT id FROM temp._retention_ids)"""
+
+
+def _fold_sql(source: str, target: str) -> str:
+    """Upsert the source rows into `target`, one row per (player, bucket)."""
+    fmt = TIER_TABLES[target]
+    sums = ", ".join(f"SUM(delta_{c}) OVER p AS delta_{c}" for c in DELTA_COLUMNS)
+    cols = TIER_COLUMNS + [f"delta_{c}" for c in DELTA_COLUMNS]
+    newer = "(excluded.ts > ts OR (excluded.ts = ts AND excluded.id > id))"
+    updates = ",\n            ".join(
+        [f"{c} = CASE WHEN {newer} THEN excluded.{c} ELSE {c} END" for c in TIER_COLUMNS]
+        + [f"delta_{c} = delta_{c} + excluded.delta_{c}" for c in DELTA_COLUMNS]
+    )
+    return f"""
+    WITH src AS (
+        SELECT *, strftime('{fmt}', ts) AS bucket FROM ({source})
+    ), folded AS (
+        SELECT
+            id, player_id, bucket, ts,
+            MIN(first_ts) OVER p AS first_ts,
+            SUM(n) OVER p AS snapshots,
+            {", ".join(TIER_COLUMNS)},
+            {sums},
+            ROW_NUMBER() OVER (PARTITION BY player_id, bucket ORDER BY ts DESC, id DESC) AS rn
+        FROM src
+        WINDOW p AS (PARTITION BY player_id, bucket)
+    )
+    INSERT INTO {target} (id, player_id, bucket, ts, first_ts, snapshots, {", ".join(cols)})
+    SELECT id, player_id, bucket, ts, first_ts, snapshots, {", ".join(cols)}
+    FROM folded
+    WHERE rn = 1
+    ON CONFLICT (player_id, bucket) DO UPDATE SET
+            snapshots = snapshots + excluded.snapshots,
+            first_ts = MIN(first_ts, excluded.first_ts),
+            {updates},
+            ts = CASE WHEN {newer} THEN excluded.ts ELSE ts END,
+            id = CASE WHEN {newer} THEN excluded.id ELSE id END"""
+
+
+def _begin_batch(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _retention_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp._retention_ids")
+
+
+def compact_raw(cutoff: str, batch: int = DEFAULT_BATCH, pause: float = BATCH_PAUSE_SECONDS) -> int:
+    """Fold raw snapshots with ts < cutoff into snapshot_hourly. Returns rows folded."""
+    fold = _fold_sql(_raw_source(), "snapshot_hourly")
+    done, last_id = 0, 0
+    while True:
+        with db_write() as conn:
+            _begin_batch(conn)
+            conn.execute("""
+                INSERT INTO temp._retention_ids
+                SELECT id FROM snapshot
+                WHERE id > ? AND ts < ?
+                  AND id NOT IN (SELECT latest_snapshot_id FROM player_summary
+                                 WHERE latest_snapshot_id IS NOT NULL)
+                ORDER BY id
+                LIMIT ?
+            """, (last_id, cutoff, batch))
+            n, max_id = conn.execute(
+                "SELECT COUNT(*), MAX(id) FROM temp._retention_ids"
+            ).fetchone()
+            if not n:
+                break
+            # the delete triggers shrink player_summary; the rows still count
+            kept = conn.execute("""
+                SELECT snapshots, first_seen, player_id FROM player_summary
+                WHERE player_id IN (SELECT s.player_id FROM snapshot s
+                                    WHERE s.id IN (SELECT id FROM temp._retention_ids))
+            """).fetchall()
+            conn.execute(fold)
+            conn.execute("DELETE FROM snapshot WHERE id IN (SELECT id FROM temp._retention_ids)")
+            conn.executemany(
+                "UPDATE player_summary SET snapshots = ?, first_seen = ? WHERE player_id = ?",
+                [tuple(r) for r in kept],
+            )
+            mark_changed(conn, "retention_at")
+        done += n
+        last_id = max_id
+        time.sleep(pause)
+    return done
+
+
+def compact_hourly(cutoff: str, batch: int = DEFAULT_BATCH, pause: float = BATCH_PAUSE_SECONDS) -> int:
+    """Fold hourly buckets with ts < cutoff into snapshot_daily. Returns rows folded."""
+    fold = _fold_sql(_tier_source("snapshot_hourly"), "snapshot_daily")
+    done = 0
+    while True:
+        with db_write() as conn:
+            _begin_batch(conn)
+            conn.execute("""
+                INSERT INTO temp._retention_ids
+                SELECT id FROM snapshot_hourly WHERE ts < ? ORDER BY ts, id LIMIT ?
+            """, (cutoff, batch))
+            n = conn.execute("SELECT COUNT(*) FROM temp._retention_ids").fetchone()[0]
+            if not n:
+                break
+            conn.execute(fold)
+            conn.execute("DELETE FROM snapshot_hourly WHERE id IN (SELECT id FROM temp._retention_ids)")
+            mark_changed(conn, "retention_at")
+        done += n
+        time.sleep(pause)
+    return done
+
+
+def drop_json(cutoff: str, archive=None, batch: int = DEFAULT_BATCH,
+              pause: float = BATCH_PAUSE_SECONDS) -> int:
+    """
+    NULL the redundant snapshot.json blob on rows with ts < cutoff. With
+    `archive` (a path), the blobs are appended there as gzipped NDJSON first.
+    """
+    out = gzip.open(archive, "at", encoding="utf-8") if archive else None
+    done, last_id = 0, 0
+    try:
+        while True:
+            with db_write() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute("""
+                    SELECT id, player_id, ts, json FROM snapshot
+                    WHERE id > ? AND ts < ? AND json IS NOT NULL
+                    ORDER BY id
+                    LIMIT ?
+                """, (last_id, cutoff, batch)).fetchall()
+                if not rows:
+                    break
+                if out is not None:
+                    for r in rows:
+                        out.write(json.dumps({"id": r["id"], "player_id": r["player_id"],
+                                              "ts": r["ts"], "json": r["json"]}) + "\n")
+                    out.flush()
+                conn.executemany("UPDATE snapshot SET json = NULL WHERE id = ?",
+                                 [(r["id"],) for r in rows])
+                mark_changed(conn, "retention_at")
+            done += len(rows)
+            last_id = rows[-1]["id"]
+            time.sleep(pause)
+    finally:
+        if out is not None:
+            out.close()
+    return done
+
+
+def incremental_vacuum(pages: int = VACUUM_PAGES, pause: float = BATCH_PAUSE_SECONDS) -> int:
+    """Return free pages to the OS a chunk at a time. Returns pages freed."""
+    freed = 0
+    while True:
+        with db_write() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return freed
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                return freed
+            conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+        freed += min(free, pages)
+        time.sleep(pause)
+
+
+def enable_incremental_vacuum():
+    """
+    One-off: switch the file to auto_vacuum=INCREMENTAL. This needs a full
+    VACUUM, which rewrites the file and blocks writers while it runs.
+    """
+    with db_write() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    return True
+
+
+def run_retention(raw_days=DEFAULT_RAW_DAYS, hourly_days=DEFAULT_HOURLY_DAYS,
+                  json_days=DEFAULT_JSON_DAYS, batch=DEFAULT_BATCH, json_archive=None):
+    """One full pass. Returns counts of what was done."""
+    stats = {
+        "json_dropped": (drop_json(_cutoff(json_days, "hour"), json_archive, batch)
+                         if json_days is not None else 0),
+        "raw_folded": compact_raw(_cutoff(raw_days, "hour"), batch),
+        "hourly_folded": compact_hourly(_cutoff(hourly_days, "day"), batch),
+    }
+    stats["pages_freed"] = incremental_vacuum()
+    return stats
@@ -0,0 +1,627 @@
+"""
+Derived tables the API reads from, kept current by SQLite triggers.
+
+The poller that writes `snapshot` rows is a separate process, so anything we
+derive from those rows is maintained inside the database with triggers
+rather than in our own write path. Each piece also has a rebuild function for
+existing data, exposed as a `flask` CLI command in statsapp.
+"""
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+# Counters we keep per-snapshot deltas for (the ones the frontend shows).
+DELTA_COLUMNS = [
+    "kills_gm_granitebr",
+    "deaths_gm_granitebr",
+    "assists_gm_granitebr",
+    "dmg_gm_granitebr",
+    "wins_gm_granitebr",
+    "tp_gm_granitebr",
+    "scorein_gm_granitebr",
+    "revives_gm_granitebr",
+    "spot_gm_granitebr",
+]
+
+
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def mark_changed(conn: sqlite3.Connection, key: str):
+    """
+    Bump app_state `key` (to a fresh value) in the caller's transaction. For
+    writes that change what the API returns without a new snapshot id --
+    retention, moving leaderboard windows, recomputed deltas -- so the
+    response cache's data version moves too (see respcache.VERSION_SQL).
+    """
+    conn.execute("""
+        INSERT INTO app_state (key, value, updated_at)
+        VALUES (?, ?, datetime('now'))
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """, (key, str(time.time_ns())))
+
+
+def create_write_marker(conn: sqlite3.Connection):
+    """
+    Bump app_state 'snapshot_at' on every snapshot insert, whoever writes it
+    (the poller, ingest, a late write with an old ts). respcache's
+    Last-Modified is MAX(app_state.updated_at), so it has to move with every
+    write, not just the ones that also set timer state.
+    """
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS snapshot_written_ai
+    AFTER INSERT ON snapshot
+    BEGIN
+        INSERT INTO app_state (key, value, updated_at)
+        VALUES ('snapshot_at', NEW.id, datetime('now'))
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at;
+    END""")
+
+
+# --- snapshot deltas ---
+#
+# snapshot_delta holds, per snapshot, the raw (unclamped) difference to the
+# same player's previous snapshot ordered by (ts, id). A player's first
+# snapshot, or a NULL previous value, gives 0 -- same as the old LAG() SQL.
+# Clamping is applied at read time.
+
+def _delta_select(where: str) -> str:
+    """SELECT producing snapshot_delta rows for the `cur` snapshots matching `where`."""
+    exprs = ",\n        ".join(
+        f"COALESCE(cur.{c}, 0) - COALESCE(prev.{c}, COALESCE(cur.{c}, 0))"
+        for c in DELTA_COLUMNS
+    )
+    return f"""
+    SELECT
+        cur.id,
+        {exprs}
+    FROM snapshot cur
+    LEFT JOIN snapshot prev ON prev.id = (
+        SELECT p.id FROM snapshot p
+        WHERE p.player_id = cur.player_id
+          AND (p.ts < cur.ts OR (p.ts = cur.ts AND p.id < cur.id))
+        ORDER BY p.ts DESC, p.id DESC
+        LIMIT 1
+    )
+    WHERE {where}"""
+
+
+def _delta_insert_cols() -> str:
+    return ", ".join(["snapshot_id"] + [f"delta_{c}" for c in DELTA_COLUMNS])
+
+
+def create_snapshot_delta(conn: sqlite3.Connection) -> bool:
+    """Create snapshot_delta and its triggers. Returns True if the table is new."""
+    is_new = not _table_exists(conn, "snapshot_delta")
+    cols = ",\n    ".join(f"delta_{c} INTEGER NOT NULL DEFAULT 0" for c in DELTA_COLUMNS)
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS snapshot_delta (
+        snapshot_id INTEGER PRIMARY KEY,
+        {cols}
+    )""")
+
+    # A new snapshot gets its delta; if it landed before an existing snapshot
+    # of the same player (late write), that following row is recomputed too.
+    next_row = """
+        SELECT n.id FROM snapshot n
+        WHERE n.player_id = NEW.player_id
+          AND (n.ts > NEW.ts OR (n.ts = NEW.ts AND n.id > NEW.id))
+        ORDER BY n.ts, n.id
+        LIMIT 1"""
+    # An upsert rather than INSERT OR REPLACE, so the recomputed next row is
+    # an UPDATE: the leaderboard triggers add the difference, not the row again.
+    updates = ", ".join(f"delta_{c} = excluded.delta_{c}" for c in DELTA_COLUMNS)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS snapshot_delta_ai
+    AFTER INSERT ON snapshot
+    BEGIN
+        INSERT INTO snapshot_delta ({_delta_insert_cols()})
+        {_delta_select(f"cur.id = NEW.id OR cur.id = ({next_row})")}
+        ON CONFLICT (snapshot_id) DO UPDATE SET {updates};
+    END""")
+
+    # Deleting a snapshot only drops its own delta: the following row keeps
+    # its difference to the value that was actually observed before it.
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS snapshot_delta_ad
+    AFTER DELETE ON snapshot
+    BEGIN
+        DELETE FROM snapshot_delta WHERE snapshot_id = OLD.id;
+    END""")
+    return is_new
+
+
+def rebuild_snapshot_delta(conn: sqlite3.Connection) -> int:
+    """
+    Recompute every stored delta from `snapshot`. Returns rows written.
+    The retention tiers go into the window too: each bucket holds the last
+    counters of the raw rows folded into it, so the oldest raw row left for
+    a player is measured against those instead of starting again at 0.
+    The leaderboard is rebuilt too: its triggers would count the re-inserted
+    deltas a second time. Bumps app_state 'deltas_at', which tells the read
+    model (readmodel.py) its copy of the deltas is stale.
+    """
+    cols = ", ".join(DELTA_COLUMNS)
+    sources = [f"SELECT id, player_id, ts, 1 AS raw, {cols} FROM snapshot"] + [
+        f"SELECT id, player_id, ts, 0, {cols} FROM {table}"
+        for table in TIER_TABLES if _table_exists(conn, table)
+    ]
+    exprs = ",\n            ".join(
+        f"COALESCE({c}, 0) - COALESCE(LAG({c}) OVER w, COALESCE({c}, 0)) AS delta_{c}"
+        for c in DELTA_COLUMNS
+    )
+    conn.execute("DELETE FROM snapshot_delta")
+    cur = conn.execute(f"""
+    INSERT INTO snapshot_delta ({_delta_insert_cols()})
+    SELECT {_delta_insert_cols().replace("snapshot_id", "id", 1)}
+    FROM (
+        SELECT
+            id, raw,
+            {exprs}
+        FROM ({" UNION ALL ".join(sources)})
+        WINDOW w AS (PARTITION BY player_id ORDER BY ts, id)
+    )
+    WHERE raw""")
+    if _table_exists(conn, "leaderboard"):
+        rebuild_leaderboard(conn)
+    mark_changed(conn, "deltas_at")
+    return cur.rowcount
+
+
+# --- per-player summary ---
+#
+# One row per player: latest snapshot id + its counters, snapshot count and
+# first/last seen. /api/overall and /api/last read this in O(players)
+# instead of scanning every snapshot.
+
+# Latest counters kept in player_summary (what /api/overall reports).
+SUMMARY_COLUMNS = [
+    "kills_gm_granitebr",
+    "deaths_gm_granitebr",
+    "assists_gm_granitebr",
+    "dmg_gm_granitebr",
+    "wins_gm_granitebr",
+    "intel_pickup_gm_granitebr",
+    "vehd_gm_granitebr",
+    "tp_gm_granitebr",
+    "scorein_gm_granitebr",
+    "revives_gm_granitebr",
+    "spot_gm_granitebr",
+]
+
+_SUMMARY_FIELDS = ["player_id", "latest_snapshot_id", "snapshots", "first_seen", "last_seen"] + SUMMARY_COLUMNS
+
+
+def create_player_summary(conn: sqlite3.Connection) -> bool:
+    """Create player_summary and its triggers. Returns True if the table is new."""
+    is_new = not _table_exists(conn, "player_summary")
+    cols = ",\n        ".join(f"{c} INTEGER" for c in SUMMARY_COLUMNS)
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS player_summary (
+        player_id INTEGER PRIMARY KEY,
+        latest_snapshot_id INTEGER,
+        snapshots INTEGER NOT NULL DEFAULT 0,
+        first_seen TEXT,
+        last_seen TEXT,
+        {cols}
+    )""")
+
+    set_latest = ", ".join(f"{c} = NEW.{c}" for c in SUMMARY_COLUMNS)
+    # The "latest" check runs before last_seen is bumped, so last_seen is
+    # still the ts of the current latest snapshot.
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS player_summary_ai
+    AFTER INSERT ON snapshot
+    BEGIN
+        INSERT OR IGNORE INTO player_summary (player_id) VALUES (NEW.player_id);
+        UPDATE player_summary
+        SET latest_snapshot_id = NEW.id, {set_latest}
+        WHERE player_id = NEW.player_id
+          AND (latest_snapshot_id IS NULL
+               OR NEW.ts > last_seen
+               OR (NEW.ts = last_seen AND NEW.id > latest_snapshot_id));
+        UPDATE player_summary
+        SET snapshots = snapshots + 1,
+            first_seen = COALESCE(MIN(first_seen, NEW.ts), NEW.ts),
+            last_seen = COALESCE(MAX(last_seen, NEW.ts), NEW.ts)
+        WHERE player_id = NEW.player_id;
+    END""")
+
+    # Deletes touch only index lookups for the affected player: first_seen
+    # via MIN(ts), and the latest row only when the latest one went away.
+    latest_row = """(
+            SELECT l.id FROM snapshot l
+            WHERE l.player_id = OLD.player_id
+            ORDER BY l.ts DESC, l.id DESC
+            LIMIT 1
+        )"""
+    set_from_latest = ",\n            ".join(
+        f"{c} = (SELECT {c} FROM snapshot WHERE id = {latest_row})" for c in SUMMARY_COLUMNS
+    )
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS player_summary_ad
+    AFTER DELETE ON snapshot
+    BEGIN
+        UPDATE player_summary
+        SET snapshots = snapshots - 1,
+            first_seen = (SELECT MIN(ts) FROM snapshot WHERE player_id = OLD.player_id)
+        WHERE player_id = OLD.player_id;
+        UPDATE player_summary
+        SET latest_snapshot_id = {latest_row},
+            last_seen = (SELECT ts FROM snapshot WHERE id = {latest_row}),
+            {set_from_latest}
+        WHERE player_id = OLD.player_id AND latest_snapshot_id = OLD.id;
+        DELETE FROM player_summary WHERE player_id = OLD.player_id AND snapshots <= 0;
+    END""")
+    return is_new
+
+
+def _summary_select() -> str:
+    """
+    player_summary rows recomputed from scratch out of `snapshot` plus the
+    rolled-up tiers (counts and first_seen include compacted snapshots; a
+    player's latest snapshot is never compacted, so it is always raw).
+    """
+    latest = ", ".join(f"s.{c}" for c in SUMMARY_COLUMNS)
+    return f"""
+    WITH agg AS (
+        SELECT player_id, SUM(n) AS snapshots, MIN(first_ts) AS first_seen, MAX(ts) AS last_seen
+        FROM (
+            SELECT player_id, 1 AS n, ts AS first_ts, ts FROM snapshot
+            UNION ALL
+            SELECT player_id, snapshots, first_ts, ts FROM snapshot_hourly
+            UNION ALL
+            SELECT player_id, snapshots, first_ts, ts FROM snapshot_daily
+        )
+        GROUP BY player_id
+    ), ranked AS (
+        SELECT id, player_id,
+               ROW_NUMBER() OVER (PARTITION BY player_id ORDER BY ts DESC, id DESC) AS rn
+        FROM snapshot
+    )
+    SELECT agg.player_id, s.id, agg.snapshots, agg.first_seen, agg.last_seen, {latest}
+    FROM agg
+    JOIN ranked r ON r.player_id = agg.player_id AND r.rn = 1
+    JOIN snapshot s ON s.id = r.id"""
+
+
+def rebuild_player_summary(conn: sqlite3.Connection) -> int:
+    """Recompute player_summary from `snapshot`. Returns rows written."""
+    conn.execute("DELETE FROM player_summary")
+    cur = conn.execute(
+        f"INSERT INTO player_summary ({', '.join(_SUMMARY_FIELDS)}) {_summary_select()}"
+    )
+    return cur.rowcount
+
+
+def check_player_summary(conn: sqlite3.Connection) -> list:
+    """
+    Compare player_summary with a fresh recomputation.
+    Returns a list of (player_id, field, stored, expected) for every mismatch.
+    """
+    fields = ", ".join(_SUMMARY_FIELDS)
+    expected = {r[0]: tuple(r) for r in conn.execute(_summary_select())}
+    stored = {r[0]: tuple(r) for r in conn.execute(f"SELECT {fields} FROM player_summary")}
+    drift = []
+    for pid in sorted(set(expected) | set(stored)):
+        want = expected.get(pid)
+        have = stored.get(pid)
+        if want is None or have is None:
+            drift.append((pid, "<row>", "present" if have else "missing",
+                          "present" if want else "missing"))
+            continue
+        for name, h, w in zip(_SUMMARY_FIELDS, have, want):
+            if h != w:
+                drift.append((pid, name, h, w))
+    return drift
+
+
+# --- retention tiers ---
+#
+# Old raw snapshots are rolled up by retention.py into snapshot_hourly and,
+# later, snapshot_daily: one row per (player, bucket) with the bucket's last
+# counter values and its summed deltas. Column names mirror snapshot /
+# snapshot_delta so the API can UNION ALL the tiers with the raw table:
+#   id        id of the last raw snapshot folded into the bucket
+#   ts        ts of that snapshot; first_ts the first one's
+#   snapshots how many raw snapshots the bucket stands for
+
+# Counter values kept per bucket: everything the API reports.
+TIER_COLUMNS = list(dict.fromkeys(DELTA_COLUMNS + SUMMARY_COLUMNS))
+
+TIER_TABLES = {
+    "snapshot_hourly": "%Y-%m-%d %H:00:00",
+    "snapshot_daily": "%Y-%m-%d 00:00:00",
+}
+
+
+def create_tiers(conn: sqlite3.Connection):
+    cols = ",\n        ".join(
+        [f"{c} INTEGER" for c in TIER_COLUMNS]
+        + [f"delta_{c} INTEGER NOT NULL DEFAULT 0" for c in DELTA_COLUMNS]
+    )
+    for table in TIER_TABLES:
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            player_id INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            first_ts TEXT NOT NULL,
+            snapshots INTEGER NOT NULL,
+            {cols},
+            UNIQUE (player_id, bucket)
+        )""")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table}(ts, id)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_player_ts ON {table}(player_id, ts, id)")
+
+
+# --- leaderboards ---
+#
+# /api/leaderboard ranks players per span: the last 24h / 7d / 30d (sums of
+# the stored deltas, to the hour) and "all" (the lifetime counters
+# player_summary holds, i.e. what /api/overall shows). One row per
+# (span, player) with kd/kda/win_rate as generated columns and an index per
+# rankable column, so a top N reads N index entries whatever the player count.
+#
+# Windows move by the hour. leaderboard_hourly keeps per-(hour, player) delta
+# sums back to the oldest span edge. A new delta (or the recomputed next row
+# after a late write) is added to its hour and to every span whose edge it
+# is past; advance_leaderboard() later moves the edges to the current hour by
+# subtracting the hours that fell out (on the write side: each ingest tick,
+# or cron; until then a window reaches back to its stored edge). Deleted snapshots aren't subtracted:
+# retention deletes raw rows it has rolled up, and those matches still
+# happened. rebuild_leaderboard() recomputes everything.
+
+LEADERBOARD_SPANS = {"24h": 24, "7d": 7 * 24, "30d": 30 * 24, "all": None}
+HOUR_FORMAT = "%Y-%m-%d %H:00:00"
+
+# same formulas as /api/overall
+LEADERBOARD_RATIOS = {
+    "kd": "CAST(kills_gm_granitebr AS REAL) / MAX(deaths_gm_granitebr, 1)",
+    "kda": "CAST(kills_gm_granitebr + assists_gm_granitebr AS REAL) / MAX(deaths_gm_granitebr, 1)",
+    "win_rate": "CASE WHEN snapshots > 0 THEN 100.0 * wins_gm_granitebr / snapshots ELSE 0.0 END",
+}
+LEADERBOARD_RANKED = ["snapshots"] + DELTA_COLUMNS + list(LEADERBOARD_RATIOS)
+
+
+def leaderboard_edges(now=None) -> dict:
+    """First hour bucket in each windowed span, for `now` (default: now, UTC)."""
+    now = now or datetime.now(timezone.utc)
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    return {
+        span: (hour - timedelta(hours=hours)).strftime(HOUR_FORMAT)
+        for span, hours in LEADERBOARD_SPANS.items() if hours is not None
+    }
+
+
+def create_leaderboard(conn: sqlite3.Connection) -> bool:
+    """Create the leaderboard tables, indexes and triggers. Returns True if new."""
+    is_new = not _table_exists(conn, "leaderboard")
+    cols = ",\n        ".join(f"{c} INTEGER NOT NULL DEFAULT 0" for c in DELTA_COLUMNS)
+    ratios = ",\n        ".join(
+        f"{name} REAL GENERATED ALWAYS AS ({expr}) VIRTUAL"
+        for name, expr in LEADERBOARD_RATIOS.items()
+    )
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS leaderboard (
+        span TEXT NOT NULL,
+        player_id INTEGER NOT NULL,
+        snapshots INTEGER NOT NULL DEFAULT 0,
+        {cols},
+        {ratios},
+        PRIMARY KEY (span, player_id)
+    ) WITHOUT ROWID""")
+    # the primary key rides along in each index, so ties come out by player_id
+    for col in LEADERBOARD_RANKED:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_leaderboard_{col} ON leaderboard(span, {col} DESC)")
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS leaderboard_hourly (
+        hour TEXT NOT NULL,
+        player_id INTEGER NOT NULL,
+        snapshots INTEGER NOT NULL DEFAULT 0,
+        {cols},
+        PRIMARY KEY (hour, player_id)
+    ) WITHOUT ROWID""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS leaderboard_span (
+        span TEXT PRIMARY KEY,
+        edge TEXT NOT NULL
+    )""")
+
+    names = ", ".join(DELTA_COLUMNS)
+    add = ", ".join(f"{c} = {c} + excluded.{c}" for c in DELTA_COLUMNS)
+    hour = "strftime('%Y-%m-%d %H:00:00', s.ts)"
+    recent = f"""(SELECT {hour} FROM snapshot s WHERE s.id = NEW.snapshot_id)
+        >= (SELECT MIN(edge) FROM leaderboard_span)"""
+    for event, n, values in (
+        ("INSERT", 1, ", ".join(f"NEW.delta_{c}" for c in DELTA_COLUMNS)),
+        ("UPDATE", 0, ", ".join(f"NEW.delta_{c} - OLD.delta_{c}" for c in DELTA_COLUMNS)),
+    ):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS leaderboard_delta_a{event[0].lower()}
+        AFTER {event} ON snapshot_delta
+        WHEN {recent}
+        BEGIN
+            INSERT INTO leaderboard_hourly (hour, player_id, snapshots, {names})
+            SELECT {hour}, s.player_id, {n}, {values}
+            FROM snapshot s WHERE s.id = NEW.snapshot_id
+            ON CONFLICT (hour, player_id) DO UPDATE SET
+                snapshots = snapshots + excluded.snapshots, {add};
+            INSERT INTO leaderboard (span, player_id, snapshots, {names})
+            SELECT w.span, s.player_id, {n}, {values}
+            FROM snapshot s JOIN leaderboard_span w ON {hour} >= w.edge
+            WHERE s.id = NEW.snapshot_id
+            ON CONFLICT (span, player_id) DO UPDATE SET
+                snapshots = snapshots + excluded.snapshots, {add};
+        END""")
+
+    # "all" mirrors player_summary. Plain UPDATEs of just the columns that
+    # changed: the summary triggers update it twice per snapshot, and an
+    # UPDATE only rewrites the indexes on the columns it sets.
+    latest = ", ".join(f"COALESCE(NEW.{c}, 0)" for c in DELTA_COLUMNS)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS leaderboard_summary_ai
+    AFTER INSERT ON player_summary
+    BEGIN
+        INSERT OR REPLACE INTO leaderboard (span, player_id, snapshots, {names})
+        VALUES ('all', NEW.player_id, NEW.snapshots, {latest});
+    END""")
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS leaderboard_summary_au_snapshots
+    AFTER UPDATE OF snapshots ON player_summary
+    BEGIN
+        UPDATE leaderboard SET snapshots = NEW.snapshots
+        WHERE span = 'all' AND player_id = NEW.player_id;
+    END""")
+    set_latest = ", ".join(f"{c} = COALESCE(NEW.{c}, 0)" for c in DELTA_COLUMNS)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS leaderboard_summary_au_counters
+    AFTER UPDATE OF {names} ON player_summary
+    BEGIN
+        UPDATE leaderboard SET {set_latest}
+        WHERE span = 'all' AND player_id = NEW.player_id;
+    END""")
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS leaderboard_summary_ad
+    AFTER DELETE ON player_summary
+    BEGIN
+        DELETE FROM leaderboard WHERE span = 'all' AND player_id = OLD.player_id;
+    END""")
+    return is_new
+
+
+def rebuild_leaderboard(conn: sqlite3.Connection, now=None) -> int:
+    """Recompute the leaderboard tables as of `now`. Returns leaderboard rows written."""
+    edges = leaderboard_edges(now)
+    oldest = min(edges.values())
+    names = ", ".join(DELTA_COLUMNS)
+    sums = ", ".join(f"SUM({c})" for c in DELTA_COLUMNS)
+    conn.execute("DELETE FROM leaderboard")
+    conn.execute("DELETE FROM leaderboard_hourly")
+    conn.execute("DELETE FROM leaderboard_span")
+    conn.executemany("INSERT INTO leaderboard_span (span, edge) VALUES (?, ?)", edges.items())
+    # raw snapshots plus whatever retention has already rolled up in range
+    deltas = ", ".join(f"d.delta_{c} AS {c}" for c in DELTA_COLUMNS)
+    tier_deltas = ", ".join(f"delta_{c} AS {c}" for c in DELTA_COLUMNS)
+    sources = [f"""
+        SELECT s.player_id, s.ts, 1 AS n, {deltas}
+        FROM snapshot s JOIN snapshot_delta d ON d.snapshot_id = s.id
+        WHERE s.ts >= :oldest"""]
+    sources += [f"""
+        SELECT player_id, ts, snapshots AS n, {tier_deltas}
+        FROM {table} WHERE ts >= :oldest""" for table in TIER_TABLES]
+    conn.execute(f"""
+    INSERT INTO leaderboard_hourly (hour, player_id, snapshots, {names})
+    SELECT strftime('{HOUR_FORMAT}', ts), player_id, SUM(n), {sums}
+    FROM ({" UNION ALL ".join(sources)})
+    GROUP BY 1, 2""", {"oldest": oldest})
+    conn.execute(f"""
+    INSERT INTO leaderboard (span, player_id, snapshots, {names})
+    SELECT w.span, h.player_id, SUM(h.snapshots), {", ".join(f"SUM(h.{c})" for c in DELTA_COLUMNS)}
+    FROM leaderboard_hourly h JOIN leaderboard_span w ON h.hour >= w.edge
+    GROUP BY w.span, h.player_id""")
+    conn.execute(f"""
+    INSERT INTO leaderboard (span, player_id, snapshots, {names})
+    SELECT 'all', player_id, snapshots, {", ".join(f"COALESCE({c}, 0)" for c in DELTA_COLUMNS)}
+    FROM player_summary""")
+    return conn.execute("SELECT COUNT(*) FROM leaderboard").fetchone()[0]
+
+
+def leaderboard_stale(conn: sqlite3.Connection, now=None) -> bool:
+    """True if a span's edge is behind the current hour."""
+    stored = dict(conn.execute("SELECT span, edge FROM leaderboard_span").fetchall())
+    return any(stored.get(span, "") < edge for span, edge in leaderboard_edges(now).items())
+
+
+def advance_leaderboard(conn: sqlite3.Connection, now=None) -> bool:
+    """
+    Move each span's edge up to the current hour, subtracting the hours that
+    fell out of it. Returns False if there was nothing to do. Takes the write
+    lock first, so of two workers that both saw it stale only one does it.
+    Called from each ingest group commit (ingest.write_group) and from
+    `flask advance-leaderboard` (cron); reads never advance it.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    edges = leaderboard_edges(now)
+    stored = dict(conn.execute("SELECT span, edge FROM leaderboard_span").fetchall())
+    if len(stored) < len(edges):
+        rebuild_leaderboard(conn, now)
+        mark_changed(conn, "leaderboard_at")
+        return True
+    names = ", ".join(DELTA_COLUMNS)
+    add = ", ".join(f"{c} = {c} + excluded.{c}" for c in DELTA_COLUMNS)
+    negated = ", ".join(f"-SUM({c})" for c in DELTA_COLUMNS)
+    moved = False
+    for span, edge in edges.items():
+        if stored[span] >= edge:
+            continue
+        conn.execute(f"""
+        INSERT INTO leaderboard (span, player_id, snapshots, {names})
+        SELECT ?, player_id, -SUM(snapshots), {negated}
+        FROM leaderboard_hourly
+        WHERE hour >= ? AND hour < ?
+        GROUP BY player_id
+        ON CONFLICT (span, player_id) DO UPDATE SET
+            snapshots = snapshots + excluded.snapshots, {add}""", (span, stored[span], edge))
+        conn.execute("DELETE FROM leaderboard WHERE span = ? AND snapshots <= 0", (span,))
+        conn.execute("UPDATE leaderboard_span SET edge = ? WHERE span = ?", (edge, span))
+        moved = True
+    conn.execute("DELETE FROM leaderboard_hourly WHERE hour < ?", (min(edges.values()),))
+    if moved:
+        mark_changed(conn, "leaderboard_at")
+    return moved
+
+
+# --- migrations ---
+#
+# Changes to tables we don't own (snapshot, player) are numbered steps, applied
+# once each and recorded in PRAGMA user_version. Append new ones at the end;
+# never edit or reorder one that has shipped. Statements should still be
+# idempotent (IF NOT EXISTS), since databases from before this list existed
+# may already have some of them.
+
+MIGRATIONS = [
+    # All-players pages (/api/snapshots without `player`, keyset cursor on
+    # (ts, id)) and /api/export walk this instead of sorting the table.
+    # Per-player reads already have idx_snapshot_player_ts: (player_id, ts)
+    # ends in the rowid, so it is (player_id, ts, id) as far as ORDER BY
+    # ts, id and the cursor are concerned.
+    ("index snapshot(ts, id)",
+     ["CREATE INDEX IF NOT EXISTS idx_snapshot_ts ON snapshot(ts, id)"]),
+]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply the MIGRATIONS past PRAGMA user_version. Call inside a transaction."""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, (what, statements) in enumerate(MIGRATIONS[current:], current + 1):
+        for sql in statements:
+            conn.execute(sql)
+        print(f"[schema] migration {version}: {what}")
+    if current < len(MIGRATIONS):
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    return len(MIGRATIONS)
+
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Create derived tables/triggers that don't exist yet and backfill new ones."""
+    conn.execute("BEGIN IMMEDIATE")
+    migrate(conn)
+    create_write_marker(conn)
+    create_tiers(conn)
+    if create_snapshot_delta(conn):
+        n = rebuild_snapshot_delta(conn)
+        print(f"[schema] created snapshot_delta, backfilled {n} rows")
+    if create_player_summary(conn):
+        n = rebuild_player_summary(conn)
+        print(f"[schema] created player_summary, backfilled {n} rows")
+    if create_leaderboard(conn):
+        n = rebuild_leaderboard(conn)
+        print(f"[schema] created leaderboard, backfilled {n} rows")
+
@@ -1,26 +1,184 @@
-﻿from flask import Flask, jsonify, request, send_from_directory, redirect
-import sqlite3
-from contextlib import contextmanager
+﻿from flask import Flask, Response, jsonify, request, redirect
+import click
+import counters
+import csv
+import heapq
+import io
+import itertools
+import json
 from functools import lru_cache
 from pathlib import Path
 import re
 from datetime import datetime, timezone, timedelta
 
+import accesslog
+import assets
+import auth
+import ingest
+import metrics
+import readmodel
+import retention
+import schema
+from compress import compress_response
+from respcache import cached_response, response_cache
+from stream import SnapshotWatcher
+from statsdb import DB_PATH, db, db_write
+
 # Paths
 BASE_DIR = Path(__file__).resolve().parent
-DB_PATH = BASE_DIR / "stats.sqlite3"
 WEB_DIR = BASE_DIR / "web"  # Put stats.html and any assets here
 DEFAULT_SNAPSHOT_LIMIT = 100
 MAX_SNAPSHOT_LIMIT = 2000
+DEFAULT_SERIES_POINTS = 500
+EXPORT_BATCH_ROWS = 1000
+MAX_SERIES_POINTS = 2000
+
+# web/ is served by assets.py (built, fingerprinted copies when there is a build)
+app = Flask(__name__, static_folder=None)
+
+# Derived tables (stored deltas, ...) are created and backfilled on first start.
+with db_write() as _conn:
+    schema.ensure_schema(_conn)
+    # counter columns of snapshot, by game mode (see counters.py)
+    counter_registry = counters.Registry.from_conn(_conn)
+
+# Optional columnar copy of `snapshot` for /api/snapshots (see readmodel.py).
+# Built here, at import, so gunicorn --preload workers share the one file.
+read_model = None
+if readmodel.ENABLED:
+    read_model = readmodel.ReadModel(DB_PATH, list(counter_registry.counters), schema.DELTA_COLUMNS)
+    try:
+        with db() as _conn:
+            read_model.refresh(_conn)
+        print(f"[readmodel] {read_model.stats()}")
+    except readmodel.ModelError as e:
+        print(f"[readmodel] disabled: {e}")
+        read_model = None
+
+
+@app.cli.command("rebuild-deltas")
+def rebuild_deltas_command():
+    """Recompute snapshot_delta from snapshot (flask --app statsapp rebuild-deltas)."""
+    with db_write() as conn:
+        n = schema.rebuild_snapshot_delta(conn)
+    print(f"rebuilt {n} snapshot deltas")
+
+
+@app.cli.command("rebuild-leaderboard")
+def rebuild_leaderboard_command():
+    """Recompute the leaderboard tables from snapshot_delta and player_summary."""
+    with db_write() as conn:
+        n = schema.rebuild_leaderboard(conn)
+    print(f"rebuilt leaderboard ({n} rows)")
+
+
+@app.cli.command("advance-leaderboard")
+def advance_leaderboard_command():
+    """Move the leaderboard windows up to the current hour (cron, when nothing goes through ingest)."""
+    with db() as conn:
+        stale = schema.leaderboard_stale(conn)
+    if stale:
+        with db_write() as conn:
+            stale = schema.advance_leaderboard(conn)
+    print("leaderboard windows advanced" if stale else "leaderboard windows already current")
+
+
+@app.cli.command("check-summary")
+@click.option("--repair", is_flag=True, help="Rebuild player_summary if it drifted.")
+def check_summary_command(repair):
+    """Recompute player_summary from snapshot and report any drift."""
+    with db() as conn:
+        drift = schema.check_player_summary(conn)
+    for player_id, field, stored, expected in drift:
+        print(f"player {player_id}: {field} stored={stored!r} expected={expected!r}")
+    if not drift:
+        print("player_summary OK")
+        return
+    if repair:
+        with db_write() as conn:
+            n = schema.rebuild_player_summary(conn)
+        print(f"rebuilt player_summary ({n} players)")
+    else:
+        raise SystemExit(1)
+
+
+@app.cli.command("check-plans")
+def check_plans_command():
+    """Fail if any /api/snapshots or /api/export query shape sorts or scans (flask --app statsapp check-plans)."""
+    with db() as conn:
+        problems = snapshot_plan_problems(conn)
+    for shape, line in problems:
+        print(f"{shape}: {line}")
+    if problems:
+        raise SystemExit(1)
+    print("snapshot query plans OK")
+
+
+@app.cli.command("check-readmodel")
+def check_readmodel_command():
+    """Compare the read model's /api/snapshots pages with SQL's for every query shape."""
+    model = readmodel.ReadModel(DB_PATH, list(counter_registry.counters), schema.DELTA_COLUMNS)
+    with db() as conn:
+        model.refresh(conn)
+        shapes, bad = read_model_mismatches(conn, model)
+    for shape in bad:
+        print(f"differs: {shape}")
+    if bad:
+        raise SystemExit(1)
+    print(f"read model matches SQL ({shapes} query shapes, {model.stats()['rows']} rows)")
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Fingerprint + precompress web/ into build/web/ (see assets.py). Run on deploy."""
+    try:
+        manifest = assets.build()
+    except assets.VendorError as e:
+        print(f"build-assets: {e}")
+        raise SystemExit(1)
+    for name, info in manifest["assets"].items():
+        print(f"assets/{name}  {info['size']} bytes  {','.join(info['encodings']) or '-'}")
+    for page, info in manifest["pages"].items():
+        print(f"{page}  {info['size']} bytes  {','.join(info['encodings']) or '-'}")
+
+
+@app.cli.command("retention")
+@click.option("--raw-days", default=retention.DEFAULT_RAW_DAYS, show_default=True,
+              help="Roll raw snapshots older than this into hourly buckets.")
+@click.option("--hourly-days", default=retention.DEFAULT_HOURLY_DAYS, show_default=True,
+              help="Roll hourly buckets older than this into daily buckets.")
+@click.option("--json-days", type=float, default=retention.DEFAULT_JSON_DAYS,
+              help="Drop the snapshot.json blob on rows older than this (default: keep it).")
+@click.option("--json-archive", type=click.Path(dir_okay=False), default=None,
+              help="Append dropped json blobs to this .ndjson.gz first.")
+@click.option("--batch", default=retention.DEFAULT_BATCH, show_default=True)
+@click.option("--enable-incremental-vacuum", is_flag=True,
+              help="One-off full VACUUM to switch the file to auto_vacuum=INCREMENTAL.")
+def retention_command(raw_days, hourly_days, json_days, json_archive, batch,
+                      enable_incremental_vacuum):
+    """Compact old snapshots into hourly/daily tiers and reclaim space."""
+    if enable_incremental_vacuum and retention.enable_incremental_vacuum():
+        print("auto_vacuum set to INCREMENTAL")
+    stats = retention.run_retention(raw_days, hourly_days, json_days, batch, json_archive)
+    print(json.dumps(stats))
 
-app = Flask(__name__, static_folder=str(WEB_DIR), static_url_path="")
 
-@app.after_request
-def log_response_size(response):
-    size = response.calculate_content_length()
-    if request.path.startswith("/api"):
-        print(f"{request.path} -> {size} bytes")
-    return response
+@app.cli.command("prune-access-log")
+@click.option("--days", default=accesslog.DEFAULT_KEEP_DAYS, show_default=True,
+              help="Keep this many days of access log.")
+def prune_access_log_command(days):
+    """Delete old rows from the access log (see view_logger.py)."""
+    n = accesslog.prune(days)
+    print(f"deleted {n} access log rows")
+
+
+# Access log and metrics first, so their after_request hooks run last (Flask
+# runs these in reverse): they time the whole request and see the bytes on
+# the wire after compress_response.
+accesslog.init_app(app)
+metrics.init_app(app)
+app.after_request(compress_response)
+assets.init_app(app)
 
 BLACKLISTED_IPS = {
     "108.90.110.51",    # Dallas, Texas | Big Phil
@@ -28,28 +186,33 @@ BLACKLISTED_IPS = {
 
 @app.post("/api/trigger_refresh")
 def api_trigger_refresh():
-    from datetime import datetime
+    # through the ingest writer queue: no write transaction of our own
+    try:
+        result = ingest.request_refresh()
+    except ingest.IngestBusy as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(result), (200 if result["ok"] else 429)
 
-    with db() as conn:
-        row = conn.execute(
-            "SELECT updated_at FROM app_state WHERE key='force_refresh'"
-        ).fetchone()
-
-        if row:
-            # SQLite's datetime('now') comes back like "YYYY-MM-DD HH:MM:SS"
-            last_time = datetime.fromisoformat(row["updated_at"])
-            delta = datetime.utcnow() - last_time
-            if delta.total_seconds() < 30:
-                return jsonify({"ok": False, "message": "Please wait before refreshing again."}), 429
-
-        conn.execute("""
-            INSERT INTO app_state (key, value, updated_at)
-            VALUES ('force_refresh', '1', datetime('now'))
-            ON CONFLICT(key) DO UPDATE SET value='1', updated_at=datetime('now')
-        """)
-        conn.commit()   # <-- important
-
-    return jsonify({"ok": True, "message": "Refresh requested"})
+
+@app.post("/api/ingest")
+def api_ingest():
+    """
+    A batch of player snapshots from the poller (see ingest.py for the
+    format). Waits for the group commit and returns {"ok": true, "snapshots": n}.
+    """
+    if not ingest.authorized(request.headers.get("Authorization")):
+        return jsonify({"error": "ingest needs STATS_INGEST_TOKEN"}), 403
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "expected a JSON object"}), 400
+    try:
+        result = ingest.submit_snapshots(body.get("snapshots") or [], body.get("state"),
+                                         body.get("mode"), registry=counter_registry)
+    except ingest.IngestError as e:
+        return jsonify({"error": str(e)}), 400
+    except ingest.IngestBusy as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(result)
 
 def _get_state(key: str):
     with db() as conn:
@@ -94,19 +257,15 @@ def seconds_until_next_tick(now=None):
     return max(0, int((dt - now).total_seconds()))
 
 
-@app.get("/api/timer")
-def api_timer():
-    import json
-    from datetime import datetime, timezone
-
+def timer_state(conn):
+    """timer_minutes / next_tick_at / seconds_remaining as served by /api/timer."""
     # read raw values directly
-    with db() as conn:
-        row_next = conn.execute(
-            "SELECT value FROM app_state WHERE key = 'next_tick_at'"
-        ).fetchone()
-        row_min = conn.execute(
-            "SELECT value FROM app_state WHERE key = 'timer_minutes'"
-        ).fetchone()
+    row_next = conn.execute(
+        "SELECT value FROM app_state WHERE key = 'next_tick_at'"
+    ).fetchone()
+    row_min = conn.execute(
+        "SELECT value FROM app_state WHERE key = 'timer_minutes'"
+    ).fetchone()
 
     raw_iso = row_next["value"] if row_next else None
     raw_min = row_min["value"] if row_min else None
@@ -140,37 +299,42 @@ def api_timer():
         except Exception as e:
             print(f"[api_timer] parse error for next_tick_at={iso_str!r}: {e}")
 
-    return jsonify({
+    return {
         "timer_minutes": timer_minutes,
         "next_tick_at": iso_str,
         "seconds_remaining": seconds_remaining
-    })
+    }
+
+
+@app.get("/api/timer")
+def api_timer():
+    with db() as conn:
+        return jsonify(timer_state(conn))
 
 
 @app.before_request
 def log_ip():
     ip = request.headers.get("X-Forwarded-For", request.remote_addr)
-    print(f"[{datetime.now().isoformat()}] Visit from {ip} -> {request.path}")
+    # every request (incl. this redirect) lands in the access log, see accesslog.py
     raw_ip = ip.split(",")[0].strip() if ip else None    
     if raw_ip in BLACKLISTED_IPS:
         print(f'{raw_ip} redirected!')
         return redirect("https://www.youtube.com/watch?v=Eo-KmOd3i7s&list=RDEo-KmOd3i7s&start_radio=1", code=301)
 
-@contextmanager
-def db():
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
 
 
 
+@app.get("/api/cache_stats")
+@auth.metrics_only
+def api_cache_stats():
+    """Hit/miss counters of this worker's response cache."""
+    return jsonify(response_cache.stats())
+
+
 @app.get("/api/players")
+@cached_response
 def api_players():
     """List of players."""
-    print(DB_PATH)
     with db() as conn:
         rows = conn.execute(
             "SELECT id, name FROM player ORDER BY name"
@@ -179,61 +343,307 @@ def api_players():
 
 # --- helpers ---
 
-NUMERIC_TYPE_RE = re.compile(r"(INT|REAL|NUM|DEC|FLOA|DOUB)", re.I)
-
 BASE_SNAPSHOT_COLS = [
     "s.id",
     "s.player_id",
     "p.name AS player_name",
     "s.ts AS timestamp",
-    "s.kills_gm_granitebr",
-    "s.deaths_gm_granitebr",
-    "s.assists_gm_granitebr",
-    "s.dmg_gm_granitebr",
-    "s.wins_gm_granitebr",
-    "s.tp_gm_granitebr",
-    "s.scorein_gm_granitebr",
-    "s.revives_gm_granitebr",
-    "s.spot_gm_granitebr",
 ]
 
-@lru_cache(maxsize=1)
-def snapshot_numeric_columns():
+# Counters /api/snapshots and /api/export return without fields= (the ones
+# the frontend uses, and the ones with stored deltas).
+DEFAULT_SNAPSHOT_FIELDS = list(schema.DELTA_COLUMNS)
+
+def requested_fields(default):
     """
-    Only the numeric snapshot columns that the frontend actually uses.
+    Counters picked by ?fields= and ?mode= (see counters.py), `default`
+    column names without fields=. ValueError on an unknown name or mode.
     """
-    return [
-        "kills_gm_granitebr",
-        "deaths_gm_granitebr",
-        "assists_gm_granitebr",
-        "dmg_gm_granitebr",
-        "wins_gm_granitebr",
-        "tp_gm_granitebr",
-    	"scorein_gm_granitebr",
-        "revives_gm_granitebr",
-        "spot_gm_granitebr"
-    ]
+    return counter_registry.resolve(
+        request.args.get("fields"), request.args.get("mode"), default
+    )
 
-def delta_sql(col: str, clamp: bool) -> str:
+def delta_sql(col: str, clamp: bool, alias: str = "d") -> str:
     """
-    Build SQL for delta of one column, safe for NULLs and first row.
+    Read the stored delta of one column (see schema.snapshot_delta; the
+    retention tiers carry the same delta_* columns, read with alias="s").
+    Stored deltas are relative to the player's previous snapshot in the whole
+    table, so they stay correct across cursor pages and from/to ranges.
     First row delta -> 0.
     """
-    # current and previous guarded for NULLs
-    curr = f"COALESCE(s.{col}, 0)"
-    prev = f"COALESCE(LAG(s.{col}) OVER (PARTITION BY s.player_id ORDER BY s.ts), {curr})"
-    expr = f"({curr} - {prev})"
+    expr = f"COALESCE({alias}.delta_{col}, 0)"
     if clamp:
         expr = f"MAX({expr}, 0)"
     return f"{expr} AS delta_{col}"
 
+def retention_tiers_in_use(conn):
+    """Retention tier tables that hold rows (so queries can skip empty ones)."""
+    return [
+        t for t in schema.TIER_TABLES
+        if conn.execute(f"SELECT EXISTS (SELECT 1 FROM {t})").fetchone()[0]
+    ]
+
+PLAYER_ID_SQL = "SELECT id FROM player WHERE name = ?"
+
+def player_id_for(conn, name):
+    """player.id for `name`, or None if there's no such player."""
+    row = conn.execute(PLAYER_ID_SQL, (name,)).fetchone()
+    return row[0] if row else None
+
+def snapshot_filters(conn, player=None, since=None, until=None, order_sql="DESC",
+                     cursor_ts=None, cursor_id=None):
+    """
+    "AND ..." clauses + params for snapshot_query_sql.
+
+    The player name is resolved to an id here so the filter is on
+    s.player_id and uses the (player_id, ts) index instead of joining on
+    p.name; an unknown name binds NULL, which matches nothing. The keyset
+    cursor is a row-value comparison: written as `ts < ? OR (ts = ? AND
+    id < ?)` SQLite can't use it as an index range and sorts the table.
+    `flask --app statsapp check-plans` checks every combination.
+    """
+    where, params = [], []
+    if player:
+        where.append("AND s.player_id = ?")
+        params.append(player_id_for(conn, player))
+    if since:
+        where.append("AND s.ts >= ?")
+        params.append(since)
+    if until:
+        where.append("AND s.ts < ?")
+        params.append(until)
+    if cursor_ts:
+        op = "<" if order_sql == "DESC" else ">"
+        if cursor_id is not None:
+            where.append(f"AND (s.ts, s.id) {op} (?, ?)")
+            params.extend([cursor_ts, cursor_id])
+        else:
+            where.append(f"AND s.ts {op} ?")
+            params.append(cursor_ts)
+    return where, params
+
+def snapshot_query_sql(table, where, order_sql, with_deltas, clamp, limit=False, fields=None):
+    """
+    Snapshot rows from `snapshot` or one of the retention tiers, shaped like
+    /api/snapshots rows. `where` is a list of "AND ..." clauses over s/p.
+    `fields` (Counters, default DEFAULT_SNAPSHOT_FIELDS) are the counters to
+    read; with_deltas adds delta_* for those that have stored deltas. A tier
+    table has NULL for counters it doesn't keep.
+    """
+    if fields is None:
+        fields = counter_registry.resolve(None, default=DEFAULT_SNAPSHOT_FIELDS)
+    raw = table == "snapshot"
+    select_cols = list(BASE_SNAPSHOT_COLS)
+    for c in fields:
+        select_cols.append(f"s.{c.column}" if raw or c.in_tiers else f"NULL AS {c.column}")
+    deltas = [c for c in fields if c.has_delta] if with_deltas else []
+    for c in deltas:
+        select_cols.append(delta_sql(c.column, clamp, "d" if raw else "s"))
+    sql = [
+        "SELECT",
+        ", ".join(select_cols),
+        f"FROM {table} s",
+        "JOIN player p ON p.id = s.player_id",
+    ]
+    if deltas and raw:
+        sql.append("LEFT JOIN snapshot_delta d ON d.snapshot_id = s.id")
+    sql.append("WHERE 1=1")
+    sql += where
+    sql.append(f"ORDER BY s.ts {order_sql}, s.id {order_sql}")
+    if limit:
+        sql.append("LIMIT ?")
+    return "\n".join(sql)
+
+def snapshot_plan_problems(conn):
+    """
+    EXPLAIN QUERY PLAN every shape /api/snapshots and /api/export can ask
+    for -- each combination of player, from, to, cursor and order, with and
+    without deltas and LIMIT -- on `snapshot` and each tier table. Returns
+    (shape, plan line) for plans that sort (temp B-tree) or scan: the only
+    scan allowed is the unfiltered walk of the table's (ts, id) index.
+    (When tiers are in use, /api/snapshots re-sorts the arms' merged top-N,
+    at most LIMIT rows per arm; that part isn't checked.)
+    """
+    problems = []
+    for table in ["snapshot"] + list(schema.TIER_TABLES):
+        for (player, since, until, cursor, order_sql, with_deltas, limit) in itertools.product(
+            (None, "somebody"), (None, "2025-01-01 00:00:00"), (None, "2025-02-01 00:00:00"),
+            (None, "ts", "ts+id"), ("DESC", "ASC"), (False, True), (False, True),
+        ):
+            cursor_ts = "2025-01-15 00:00:00" if cursor else None
+            cursor_id = 12345 if cursor == "ts+id" else None
+            where, params = snapshot_filters(conn, player, since, until, order_sql, cursor_ts, cursor_id)
+            sql = snapshot_query_sql(table, where, order_sql, with_deltas, False, limit)
+            plan = [r[3] for r in conn.execute(
+                "EXPLAIN QUERY PLAN " + sql, params + ([100] if limit else []))]
+            shape = (f"{table} player={player is not None} from={since is not None} "
+                     f"to={until is not None} cursor={cursor} order={order_sql} "
+                     f"with_deltas={with_deltas} limit={limit}")
+            unfiltered = not where
+            for line in plan:
+                if "TEMP B-TREE" in line:
+                    problems.append((shape, line))
+                elif line.startswith("SCAN ") and not (
+                    unfiltered and re.fullmatch(rf"SCAN s USING (COVERING )?INDEX idx_{table}_ts", line)
+                ):
+                    problems.append((shape, line))
+    return problems
+
+def read_model_mismatches(conn, model):
+    """
+    Run every /api/snapshots shape (player, from, to, cursor, order, deltas,
+    clamp, fields, limit) through `model` and through SQL on `snapshot`,
+    with values picked from the data. Returns (shapes tried, [differing shape]).
+    """
+    n = conn.execute("SELECT COUNT(*) FROM snapshot").fetchone()[0]
+    if not n:
+        return 0, []
+    player, = conn.execute("""
+        SELECT p.name FROM snapshot s JOIN player p ON p.id = s.player_id
+        GROUP BY s.player_id ORDER BY COUNT(*) DESC LIMIT 1""").fetchone()
+    # a row a third and two thirds of the way in: from/to and the cursor
+    probe = "SELECT ts, id FROM snapshot ORDER BY ts, id LIMIT 1 OFFSET ?"
+    early, late = conn.execute(probe, (n // 3,)).fetchone(), conn.execute(probe, (2 * n // 3,)).fetchone()
+    all_fields = counter_registry.resolve("all")
+    default_fields = counter_registry.resolve(None, default=DEFAULT_SNAPSHOT_FIELDS)
+    tried, bad = 0, []
+    for (who, since, until, cursor, order_sql, with_deltas, clamp, fields, limit) in itertools.product(
+        (None, player, "nobody at all"), (None, early[0]), (None, late[0]),
+        (None, "ts", "ts+id"), ("DESC", "ASC"), (False, True), (False, True),
+        ("default", "all"), (3, MAX_SNAPSHOT_LIMIT),
+    ):
+        picked = all_fields if fields == "all" else default_fields
+        mid = late if order_sql == "DESC" else early
+        cursor_ts = mid[0] if cursor else None
+        cursor_id = mid[1] if cursor == "ts+id" else None
+        where, params = snapshot_filters(conn, who, since, until, order_sql, cursor_ts, cursor_id)
+        sql = snapshot_query_sql("snapshot", where, order_sql, with_deltas, clamp, True, picked)
+        expected = [tuple(r) for r in conn.execute(sql, params + [limit])]
+        names, got = model.snapshots(
+            picked, with_deltas, clamp, order_sql, limit,
+            player_id=player_id_for(conn, who) if who else None, any_player=not who,
+            since=since, until=until, cursor_ts=cursor_ts, cursor_id=cursor_id,
+        )
+        tried += 1
+        if got != expected:
+            bad.append(f"player={who!r} from={since} to={until} cursor={cursor} order={order_sql} "
+                       f"with_deltas={with_deltas} clamp={clamp} fields={fields} limit={limit}")
+    return tried, bad
+
+def snapshots_after(conn, after_id: int, limit: int):
+    """Snapshot rows (same shape as /api/snapshots?with_deltas=1) with id > after_id."""
+    select_cols = list(BASE_SNAPSHOT_COLS)
+    select_cols += [f"s.{c}" for c in DEFAULT_SNAPSHOT_FIELDS]
+    select_cols += [delta_sql(c, clamp=False) for c in DEFAULT_SNAPSHOT_FIELDS]
+    rows = conn.execute(f"""
+        SELECT {", ".join(select_cols)}
+        FROM snapshot s
+        JOIN player p ON p.id = s.player_id
+        LEFT JOIN snapshot_delta d ON d.snapshot_id = s.id
+        WHERE s.id > ?
+        ORDER BY s.id
+        LIMIT ?
+    """, (after_id, limit)).fetchall()
+    return [dict(r) for r in rows]
+
+
+snapshot_watcher = SnapshotWatcher(snapshots_after, timer_state)
+
+def to_columnar(names, rows):
+    """
+    format=columnar body: one array per column instead of one object per row.
+    player_name is replaced by a player_id -> name dictionary.
+    """
+    cols = [n for n in names if n != "player_name"]
+    idx = [names.index(n) for n in cols]
+    players = {}
+    if rows:
+        pid_i, name_i = names.index("player_id"), names.index("player_name")
+        for r in rows:
+            players[r[pid_i]] = r[name_i]
+    values = list(zip(*rows)) if rows else [()] * len(names)
+    return {
+        "format": "columnar",
+        "count": len(rows),
+        "columns": cols,
+        "players": {str(k): v for k, v in players.items()},
+        "data": {n: list(values[i]) for n, i in zip(cols, idx)},
+    }
+
+
+# /api/series buckets (strftime formats over snapshot.ts) and derived metrics.
+SERIES_BUCKETS = {
+    "1h": "%Y-%m-%d %H:00:00",
+    "1d": "%Y-%m-%d 00:00:00",
+}
+SERIES_AGGS = ("sum", "last", "avg")
+# name -> (numerator stats, denominator stat, from bucket deltas); the stats
+# are looked up in the request's mode
+SERIES_RATIOS = {
+    "kd": (["kills"], "deaths", False),
+    "kda": (["kills", "assists"], "deaths", False),
+    "kd_match": (["kills"], "deaths", True),
+    "kda_match": (["kills", "assists"], "deaths", True),
+}
+
+
+def lttb(points, threshold: int):
+    """
+    Largest-Triangle-Three-Buckets downsampling of [(x, y), ...] sorted by x.
+    Keeps the first and last point and the visually significant ones between.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket is the third corner of the triangle
+        nxt_start = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        span = nxt_end - nxt_start
+        avg_x = sum(p[0] for p in points[nxt_start:nxt_end]) / span
+        avg_y = sum(p[1] for p in points[nxt_start:nxt_end]) / span
+
+        ax, ay = points[a]
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
 # --- ROUTES ---
 
 @app.get("/")
 def index():
-    return send_from_directory(WEB_DIR, "stats.html")
+    return assets.send_page("stats.html")
+
+@app.get("/api/stream")
+def api_stream():
+    """
+    Server-Sent Events: `timer` and `snapshot` events from the shared
+    per-process watcher (see stream.py). Honors Last-Event-ID on reconnect.
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    resp = Response(snapshot_watcher.subscribe(last_event_id), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"   # nginx: don't buffer the stream
+    return resp
+
 
 @app.get("/api/snapshots")
+@cached_response
 def api_snapshots():
     player = request.args.get("player")
     paged = request.args.get("paged", "0").lower() in ("1", "true", "yes")
@@ -257,67 +667,74 @@ def api_snapshots():
     order = request.args.get("order", "desc").lower()
     with_deltas = request.args.get("with_deltas", "0").lower() in ("1", "true", "yes")
     clamp = request.args.get("clamp", "0").lower() in ("1", "true", "yes")
+    columnar = request.args.get("format", "rows").lower() == "columnar"
 
     order_sql = "DESC" if order != "asc" else "ASC"
-
-    select_cols = list(BASE_SNAPSHOT_COLS)
+    try:
+        fields = requested_fields(DEFAULT_SNAPSHOT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     if with_deltas:
-        cols = snapshot_numeric_columns()
-        print("with_deltas=1 -> adding deltas for", cols)
-        for col in cols:
-            select_cols.append(delta_sql(col, clamp))
-
-    sql = [
-        "SELECT",
-        ", ".join(select_cols),
-        "FROM snapshot s",
-        "JOIN player p ON p.id = s.player_id",
-        "WHERE 1=1",
-    ]
-    params = []
-
-    if player:
-        sql.append("AND p.name = ?")
-        params.append(player)
-    if since:
-        sql.append("AND s.ts >= ?")
-        params.append(since)
-    if until:
-        sql.append("AND s.ts < ?")
-        params.append(until)
-    if cursor_ts:
-        if cursor_id is not None:
-            if order_sql == "DESC":
-                sql.append("AND (s.ts < ? OR (s.ts = ? AND s.id < ?))")
-            else:
-                sql.append("AND (s.ts > ? OR (s.ts = ? AND s.id > ?))")
-            params.extend([cursor_ts, cursor_ts, cursor_id])
-        else:
-            sql.append("AND s.ts < ?" if order_sql == "DESC" else "AND s.ts > ?")
-            params.append(cursor_ts)
+        app.logger.debug("with_deltas=1 -> adding deltas for %s", [c.column for c in fields if c.has_delta])
 
-    sql.append(f"ORDER BY s.ts {order_sql}, s.id {order_sql}")
-    sql.append("LIMIT ?")
     query_limit = limit + 1 if paged else limit
-    params.append(query_limit)
 
     with db() as conn:
-        rows = conn.execute("\n".join(sql), params).fetchall()
+        where, params = snapshot_filters(conn, player, since, until, order_sql, cursor_ts, cursor_id)
+
+        def arm(table):
+            sql = snapshot_query_sql(table, where, order_sql, with_deltas, clamp, limit=True,
+                                     fields=fields)
+            return sql, params + [query_limit]
+
+        tiers = retention_tiers_in_use(conn)
+        if read_model is not None:
+            # raw rows from the read model, tiers (if any) from SQL
+            read_model.refresh(conn)
+            names, rows = read_model.snapshots(
+                fields, with_deltas, clamp, order_sql, query_limit,
+                player_id=player_id_for(conn, player) if player else None, any_player=not player,
+                since=since, until=until, cursor_ts=cursor_ts, cursor_id=cursor_id,
+            )
+            for t in tiers:
+                rows += [tuple(r) for r in conn.execute(*arm(t))]
+            if tiers:
+                rows.sort(key=lambda r: (r[3], r[0]), reverse=order_sql == "DESC")
+                rows = rows[:query_limit]
+        else:
+            sql, sql_params = arm("snapshot")
+            if tiers:
+                # Rolled-up rows (see retention.py) read like snapshots: id/ts of
+                # the bucket's last snapshot, its counters and summed deltas.
+                # Each arm is an indexed top-N; merge them and cut the page again.
+                parts = [arm(t) for t in ["snapshot"] + tiers]
+                sql = (
+                    "SELECT * FROM ("
+                    + ")\nUNION ALL\nSELECT * FROM (".join(q for q, _ in parts)
+                    + f")\nORDER BY timestamp {order_sql}, id {order_sql}\nLIMIT ?"
+                )
+                sql_params = [x for _, ps in parts for x in ps] + [query_limit]
+            cur = conn.execute(sql, sql_params)
+            names = [d[0] for d in cur.description]
+            rows = cur.fetchall()
         page_rows = rows[:limit] if paged else rows
-        out = []
-        for r in page_rows:
-            d = dict(r)
-            # We already expose "timestamp" via SELECT; drop raw ts if present
-            d.pop("ts", None)
-            out.append(d)
+        if columnar:
+            out = to_columnar(names, page_rows)
+        else:
+            out = []
+            for r in page_rows:
+                d = dict(zip(names, r))
+                # We already expose "timestamp" via SELECT; drop raw ts if present
+                d.pop("ts", None)
+                out.append(d)
         if not paged:
             return jsonify(out)
 
         has_more = len(rows) > limit
         next_cursor = None
         if has_more and page_rows:
-            tail = page_rows[-1]
+            tail = dict(zip(names, page_rows[-1]))
             next_cursor = {
                 "ts": tail["timestamp"],
                 "id": tail["id"],
@@ -329,96 +746,392 @@ def api_snapshots():
         })
 
 
+@app.get("/api/export")
+def api_export():
+    """
+    Streaming bulk export, no row cap.
+    Query params: format=ndjson|csv, player, from, to, with_deltas, clamp,
+    fields, mode.
+    Rows come oldest first, merged across `snapshot` and the retention tiers
+    (the extra "tier" column says which). Each source is read through its own
+    cursor EXPORT_BATCH_ROWS at a time, so memory stays flat however many
+    rows go out, and the first batch is sent as soon as it is read.
+    """
+    fmt = request.args.get("format", "ndjson").lower()
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    player = request.args.get("player")
+    since = request.args.get("from")
+    until = request.args.get("to")
+    with_deltas = request.args.get("with_deltas", "0").lower() in ("1", "true", "yes")
+    clamp = request.args.get("clamp", "0").lower() in ("1", "true", "yes")
+    try:
+        fields = requested_fields(DEFAULT_SNAPSHOT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with db() as conn:
+        where, params = snapshot_filters(conn, player, since, until, "ASC")
+
+    def batches(cur, tier):
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_ROWS)
+            if not rows:
+                return
+            for r in rows:
+                yield tuple(r) + (tier,)
+
+    def encode(names, rows):
+        if fmt == "csv":
+            buf = io.StringIO()
+            csv.writer(buf, lineterminator="\n").writerows(rows)
+            return buf.getvalue()
+        return "".join(json.dumps(dict(zip(names, r)), separators=(",", ":")) + "\n" for r in rows)
+
+    def generate():
+        with db() as conn:
+            sources = []
+            names = None
+            for table in ["snapshot"] + retention_tiers_in_use(conn):
+                cur = conn.execute(
+                    snapshot_query_sql(table, where, "ASC", with_deltas, clamp, fields=fields), params
+                )
+                names = [d[0] for d in cur.description] + ["tier"]
+                tier = "raw" if table == "snapshot" else table[len("snapshot_"):]
+                sources.append(batches(cur, tier))
+            ts_i = names.index("timestamp")
+            if fmt == "csv":
+                yield encode(None, [names])
+            out = []
+            for row in heapq.merge(*sources, key=lambda r: (r[ts_i], r[0])):
+                out.append(row)
+                if len(out) >= EXPORT_BATCH_ROWS:
+                    yield encode(names, out)
+                    out = []
+            if out:
+                yield encode(names, out)
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    resp = Response(generate(), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f'attachment; filename="snapshots.{fmt}"'
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+@app.get("/api/series")
+@cached_response
+def api_series():
+    """
+    Time-bucketed series for charts.
+    Query params:
+      - metric: a snapshot counter with stored deltas (kills_gm_granitebr,
+        or kills with mode=) or kd / kda (cumulative, at bucket end) /
+        kd_match / kda_match (from bucket deltas)
+      - mode: game mode for stat names, default granitebr
+      - player: exact player name, repeatable; default all players
+      - bucket: 1h | 1d
+      - agg: sum (of deltas) | last (counter value) | avg (delta per snapshot);
+        counters only
+      - from / to: ts range, to exclusive
+      - points: max points per player (LTTB downsampled), default 500
+    """
+    metric = request.args.get("metric", "kd_match")
+    bucket = request.args.get("bucket", "1h")
+    agg = request.args.get("agg", "sum").lower()
+    players = request.args.getlist("player")
+    since = request.args.get("from")
+    until = request.args.get("to")
+    try:
+        max_points = int(request.args.get("points", str(DEFAULT_SERIES_POINTS)))
+    except ValueError:
+        max_points = DEFAULT_SERIES_POINTS
+    max_points = max(3, min(max_points, MAX_SERIES_POINTS))
+
+    mode = request.args.get("mode") or counters.DEFAULT_MODE
+    if metric in SERIES_RATIOS:
+        num_stats, den_stat, from_deltas = SERIES_RATIOS[metric]
+        num_cols = [counter_registry.column(st, mode) for st in num_stats]
+        den_col = counter_registry.column(den_stat, mode)
+        if None in num_cols or den_col is None:
+            return jsonify({"error": f"{metric} isn't available in mode {mode!r}"}), 400
+        cols = num_cols + [den_col]
+    else:
+        counter = counter_registry.get(metric, mode)
+        if counter is None or not counter.has_delta:
+            return jsonify({"error": f"unknown metric {metric!r}"}), 400
+        col = counter.column
+        cols = [col]
+    if bucket not in SERIES_BUCKETS:
+        return jsonify({"error": f"bucket must be one of {sorted(SERIES_BUCKETS)}"}), 400
+    if agg not in SERIES_AGGS:
+        return jsonify({"error": f"agg must be one of {list(SERIES_AGGS)}"}), 400
+
+    # One row per (player, bucket). With a single MAX() aggregate, SQLite
+    # takes the bare s.<col> values from the row holding MAX(s.ts), i.e. the
+    # last snapshot in the bucket. Retention tiers join in as pre-summed rows
+    # (n = snapshots they stand for), so old history charts too.
+    select = [
+        "s.player_id",
+        f"CAST(strftime('%s', strftime('{SERIES_BUCKETS[bucket]}', s.ts)) AS INTEGER) AS t",
+        "MAX(s.ts) AS last_ts",
+        "SUM(s.n) AS n",
+    ]
+    for c in cols:
+        select.append(f"s.{c} AS last_{c}")
+        select.append(f"SUM(s.delta_{c}) AS sum_{c}")
+    params = []
+
+    with db() as conn:
+        sources = [
+            "SELECT s.id, s.player_id, s.ts, 1 AS n, "
+            + ", ".join(f"s.{c}, COALESCE(d.delta_{c}, 0) AS delta_{c}" for c in cols)
+            + " FROM snapshot s LEFT JOIN snapshot_delta d ON d.snapshot_id = s.id"
+        ]
+        for tier in retention_tiers_in_use(conn):
+            sources.append(
+                "SELECT id, player_id, ts, snapshots AS n, "
+                + ", ".join(f"{c}, delta_{c}" for c in cols)
+                + f" FROM {tier}"
+            )
+        sql = [
+            "SELECT", ", ".join(select),
+            "FROM (", "\nUNION ALL\n".join(sources), ") s",
+            "WHERE 1=1",
+        ]
+        names = {r["id"]: r["name"] for r in conn.execute("SELECT id, name FROM player")}
+        if players:
+            ids = [pid for pid, name in names.items() if name in players]
+            if not ids:
+                return jsonify({"metric": metric, "bucket": bucket, "agg": agg, "series": []})
+            sql.append(f"AND s.player_id IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+        if since:
+            sql.append("AND s.ts >= ?")
+            params.append(since)
+        if until:
+            sql.append("AND s.ts < ?")
+            params.append(until)
+        sql.append("GROUP BY s.player_id, t ORDER BY s.player_id, t")
+        rows = conn.execute("\n".join(sql), params).fetchall()
+
+    by_player = {}
+    for r in rows:
+        if metric in SERIES_RATIOS:
+            src = "sum_" if from_deltas else "last_"
+            num = sum(r[src + c] or 0 for c in num_cols)
+            den = r[src + den_col] or 0
+            # same guards as the frontend: cumulative max(1, d), per-match d or 1
+            den = (den or 1) if from_deltas else max(1, den)
+            y = round(num / den, 4)
+        elif agg == "last":
+            y = r["last_" + col]
+        elif agg == "sum":
+            y = r["sum_" + col]
+        else:
+            y = round(r["sum_" + col] / r["n"], 4)
+        if y is None:
+            continue
+        by_player.setdefault(r["player_id"], []).append((r["t"], y))
+
+    series = []
+    for pid, points in by_player.items():
+        series.append({
+            "player_id": pid,
+            "player": names.get(pid, ""),
+            "raw_points": len(points),
+            "points": [list(p) for p in lttb(points, max_points)],
+        })
+    series.sort(key=lambda x: x["player"])
+    return jsonify({
+        "metric": metric,
+        "bucket": bucket,
+        "agg": agg,
+        "max_points": max_points,
+        "series": series,
+    })
+
+
+# Fixed queries live at module level so their SQL text is identical on every
+# call and the connection's statement cache hands back the prepared statement.
+LAST_PER_PLAYER_SQL = """
+SELECT s.*
+FROM player_summary ps
+JOIN snapshot s ON s.id = ps.latest_snapshot_id
+"""
+
+# /api/overall's names for the summary counters, as the frontend knows them;
+# any other counter is overall_<stat>
+OVERALL_NAMES = {
+    "kills": "overall_kills",
+    "deaths": "overall_deaths",
+    "assists": "overall_assists",
+    "dmg": "overall_damage",
+    "wins": "overall_wins",
+    "intel_pickup": "overall_intel_picked_up",
+    "vehd": "overall_vehicles_destroyed",
+    "tp": "overall_time_played",
+    "scorein": "overall_score",
+    "revives": "overall_revives",
+    "spot": "overall_spots",
+}
+
+@lru_cache(maxsize=64)
+def overall_sql(columns: tuple) -> str:
+    """
+    player_summary (see schema.py) already holds each player's latest counters
+    and first/last seen, so this is one row per player, not a window over
+    history. Counters player_summary doesn't keep come from the latest
+    snapshot itself (0 once retention has rolled that snapshot up: the tiers
+    keep only TIER_COLUMNS). Cached per column set, so the SQL text (and the
+    prepared statement) is reused.
+    """
+    select = [
+        "ps.player_id",
+        "p.name AS player_name",
+        "ps.snapshots AS snapshots",
+        "ps.snapshots AS matches_tracked",
+        "ps.first_seen",
+        "ps.last_seen",
+    ]
+    latest = False
+    for c in (counter_registry.counters[col] for col in columns):
+        latest = latest or not c.in_summary
+        src = "ps" if c.in_summary else "ls"
+        select.append(f"COALESCE({src}.{c.column}, 0) AS {OVERALL_NAMES.get(c.stat, 'overall_' + c.stat)}")
+    sql = ["SELECT", ",\n".join(select), "FROM player_summary ps", "JOIN player p ON p.id = ps.player_id"]
+    if latest:
+        sql.append("LEFT JOIN snapshot ls ON ls.id = ps.latest_snapshot_id")
+    sql += ["WHERE (? IS NULL OR p.name = ?)", "ORDER BY player_name ASC"]
+    return "\n".join(sql)
+
 @app.get("/api/last")
+@cached_response
 def api_last_per_player():
     """Latest snapshot per player."""
     with db() as conn:
-        rows = conn.execute("""
-            SELECT s.*
-            FROM snapshot s
-            JOIN (
-                SELECT player_id, MAX(ts) AS max_ts
-                FROM snapshot
-                GROUP BY player_id
-            ) x ON x.player_id = s.player_id AND x.max_ts = s.ts
-        """).fetchall()
+        rows = conn.execute(LAST_PER_PLAYER_SQL).fetchall()
         return jsonify([dict(r) for r in rows])
 
 
 @app.get("/api/overall")
+@cached_response
 def api_overall():
     """
     Overall profile totals from each player's latest snapshot.
-    Optional query param:
+    Optional query params:
       - player: exact player name
+      - fields / mode: counters to include (see counters.py), default the
+        ones player_summary keeps. overall_kd / overall_kda / win_rate are
+        added when the counters they need are there.
     """
     player = request.args.get("player")
-
-    sql = """
-    WITH base AS (
-        SELECT
-            s.id,
-            s.player_id,
-            p.name AS player_name,
-            s.ts,
-            COALESCE(s.kills_gm_granitebr, 0) AS kills,
-            COALESCE(s.deaths_gm_granitebr, 0) AS deaths,
-            COALESCE(s.assists_gm_granitebr, 0) AS assists,
-            COALESCE(s.dmg_gm_granitebr, 0) AS dmg,
-            COALESCE(s.wins_gm_granitebr, 0) AS wins,
-            COALESCE(s.intel_pickup_gm_granitebr, 0) AS intel_pickups,
-            COALESCE(s.vehd_gm_granitebr, 0) AS vehicles_destroyed,
-            COALESCE(s.tp_gm_granitebr, 0) AS tp,
-            COALESCE(s.scorein_gm_granitebr, 0) AS score,
-            COALESCE(s.revives_gm_granitebr, 0) AS revives,
-            COALESCE(s.spot_gm_granitebr, 0) AS spots,
-            ROW_NUMBER() OVER (
-                PARTITION BY s.player_id
-                ORDER BY s.ts DESC, s.id DESC
-            ) AS rn_latest
-        FROM snapshot s
-        JOIN player p ON p.id = s.player_id
-        WHERE (? IS NULL OR p.name = ?)
-    )
-    SELECT
-        player_id,
-        player_name,
-        COUNT(*) AS snapshots,
-        COUNT(*) AS matches_tracked,
-        MIN(ts) AS first_seen,
-        MAX(ts) AS last_seen,
-        MAX(CASE WHEN rn_latest = 1 THEN kills END) AS overall_kills,
-        MAX(CASE WHEN rn_latest = 1 THEN deaths END) AS overall_deaths,
-        MAX(CASE WHEN rn_latest = 1 THEN assists END) AS overall_assists,
-        MAX(CASE WHEN rn_latest = 1 THEN dmg END) AS overall_damage,
-        MAX(CASE WHEN rn_latest = 1 THEN wins END) AS overall_wins,
-        MAX(CASE WHEN rn_latest = 1 THEN intel_pickups END) AS overall_intel_picked_up,
-        MAX(CASE WHEN rn_latest = 1 THEN vehicles_destroyed END) AS overall_vehicles_destroyed,
-        MAX(CASE WHEN rn_latest = 1 THEN tp END) AS overall_time_played,
-        MAX(CASE WHEN rn_latest = 1 THEN score END) AS overall_score,
-        MAX(CASE WHEN rn_latest = 1 THEN revives END) AS overall_revives,
-        MAX(CASE WHEN rn_latest = 1 THEN spots END) AS overall_spots
-    FROM base
-    GROUP BY player_id, player_name
-    ORDER BY player_name ASC
-    """
+    try:
+        fields = requested_fields(schema.SUMMARY_COLUMNS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     with db() as conn:
-        rows = conn.execute(sql, (player, player)).fetchall()
+        rows = conn.execute(overall_sql(tuple(c.column for c in fields)), (player, player)).fetchall()
         out = []
         for r in rows:
             d = dict(r)
-            deaths = max(1, int(d.get("overall_deaths") or 0))
-            kills = int(d.get("overall_kills") or 0)
-            assists = int(d.get("overall_assists") or 0)
-            wins = int(d.get("overall_wins") or 0)
             matches = int(d.get("matches_tracked") or 0)
-            d["overall_kd"] = round(kills / deaths, 2)
-            d["overall_kda"] = round((kills + assists) / deaths, 2)
-            d["win_rate"] = round((wins / matches) * 100, 2) if matches > 0 else 0.0
+            if "overall_kills" in d and "overall_deaths" in d:
+                deaths = max(1, int(d["overall_deaths"] or 0))
+                kills = int(d["overall_kills"] or 0)
+                d["overall_kd"] = round(kills / deaths, 2)
+                if "overall_assists" in d:
+                    assists = int(d["overall_assists"] or 0)
+                    d["overall_kda"] = round((kills + assists) / deaths, 2)
+            if "overall_wins" in d:
+                wins = int(d["overall_wins"] or 0)
+                d["win_rate"] = round((wins / matches) * 100, 2) if matches > 0 else 0.0
             out.append(d)
         return jsonify(out)
 
+DEFAULT_LEADERBOARD_LIMIT = 25
+MAX_LEADERBOARD_LIMIT = 500
+# metric= names that aren't counters: leaderboard column -> response key
+LEADERBOARD_METRICS = {"kd": "kd", "kda": "kda", "win_rate": "win_rate", "matches": "snapshots"}
+
+
+@app.get("/api/leaderboard")
+@cached_response
+def api_leaderboard():
+    """
+    Top players for one metric over a window, from the precomputed
+    leaderboard tables (see schema.py): a read of `limit` index entries,
+    whatever the number of players.
+    Query params:
+      - metric: kd | kda | win_rate | matches, or a counter with stored
+        deltas (kills, dmg, ... in ?mode=). Default kd.
+      - window: 24h | 7d | 30d | all. Default 7d. Timed windows sum the
+        deltas since the start of the hour that far back; "all" ranks the
+        lifetime totals /api/overall shows.
+      - limit: default 25, max 500
+    Read-only: the windows are moved on the write side (each ingest group
+    commit, or `flask advance-leaderboard` from cron), and "since" in the
+    response is where this window actually starts.
+    """
+    metric = request.args.get("metric", "kd")
+    window = request.args.get("window", "7d")
+    if window not in schema.LEADERBOARD_SPANS:
+        return jsonify({"error": f"unknown window {window!r} (one of {', '.join(schema.LEADERBOARD_SPANS)})"}), 400
+    try:
+        limit = min(MAX_LEADERBOARD_LIMIT, max(1, int(request.args.get("limit", DEFAULT_LEADERBOARD_LIMIT))))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    col = LEADERBOARD_METRICS.get(metric)
+    if col is None:
+        c = counter_registry.get(metric, request.args.get("mode") or counters.DEFAULT_MODE)
+        if c is None or not c.has_delta:
+            return jsonify({"error": f"unknown metric {metric!r}"}), 400
+        col = c.column
+
+    counter_cols = ", ".join(f"l.{c}" for c in schema.DELTA_COLUMNS)
+    with db() as conn:
+        rows = conn.execute(f"""
+            SELECT l.player_id, p.name AS player_name, l.snapshots,
+                   l.kd, l.kda, l.win_rate, {counter_cols}, l.{col} AS value
+            FROM leaderboard l
+            JOIN player p ON p.id = l.player_id
+            WHERE l.span = ?
+            ORDER BY l.{col} DESC
+            LIMIT ?""", (window, limit)).fetchall()
+        edge = conn.execute("SELECT edge FROM leaderboard_span WHERE span = ?", (window,)).fetchone()
+    items = []
+    for rank, r in enumerate(rows, 1):
+        value = r["value"]
+        items.append({
+            "rank": rank,
+            "player_id": r["player_id"],
+            "player_name": r["player_name"],
+            "value": round(value, 2) if isinstance(value, float) else value,
+            "matches": r["snapshots"],
+            "kd": round(r["kd"], 2),
+            "kda": round(r["kda"], 2),
+            "win_rate": round(r["win_rate"], 2),
+            "counters": {c: r[c] for c in schema.DELTA_COLUMNS},
+        })
+    return jsonify({
+        "metric": metric,
+        "window": window,
+        "since": edge[0] if edge else None,
+        "items": items,
+    })
+
+@app.get("/api/fields")
+@cached_response
+def api_fields():
+    """The metric registry: every snapshot counter by game mode, for fields=."""
+    return jsonify({
+        "default_mode": counters.DEFAULT_MODE,
+        "modes": {
+            mode or "": [c.as_dict() for c in by_stat.values()]
+            for mode, by_stat in counter_registry.modes.items()
+        },
+    })
+
 
 if __name__ == "__main__":
     WEB_DIR.mkdir(exist_ok=True)
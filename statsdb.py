@@ -0,0 +1,139 @@
+"""
+SQLite connection layer for the stats app.
+
+Readers get one long-lived connection per thread (per worker process), so we
+pay for connect + schema parse + page cache warmup once instead of on every
+`with db()`. The sqlite3 module keeps a per-connection LRU of prepared
+statements keyed by SQL text, so the fixed queries in statsapp are prepared
+once per connection and reused.
+
+Writes go through `db_write()`: one writer connection per process behind a
+lock, so the app never has two of its own write transactions fighting over
+the file. The poller is a separate process and still writes on its own; WAL
+mode means our readers don't block behind it.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = Path(os.environ.get("STATS_DB", BASE_DIR / "stats.sqlite3"))
+
+BUSY_TIMEOUT_MS = 30_000
+CACHE_SIZE_KIB = 16 * 1024          # negative cache_size = KiB, so 16 MiB
+MMAP_SIZE = 256 * 1024 * 1024
+STATEMENT_CACHE = 256               # sqlite3 prepared statement LRU per conn
+
+_local = threading.local()
+_write_lock = threading.Lock()
+_writer = None
+_writer_pid = None
+_wal_checked = False
+_wrap = None                        # see set_connection_wrapper()
+
+
+def _open(readonly: bool) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE,
+        check_same_thread=readonly,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if readonly:
+        conn.execute("PRAGMA query_only = 1")
+    else:
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def ensure_wal():
+    """Switch the database file to WAL once. The setting is persistent."""
+    global _wal_checked
+    if _wal_checked:
+        return
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+    try:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if mode.lower() != "wal":
+            conn.execute("PRAGMA journal_mode = WAL")
+    finally:
+        conn.close()
+    _wal_checked = True
+
+
+def read_conn() -> sqlite3.Connection:
+    """
+    The calling thread's read-only connection. Reopened after a fork so
+    gunicorn workers never share a handle inherited from the master.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        ensure_wal()
+        conn = _open(readonly=True)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+@contextmanager
+def db():
+    """
+    Read connection for one unit of work. Kept open after the block; any
+    read transaction left open is ended so the next request sees fresh data.
+    """
+    conn = read_conn()
+    try:
+        yield conn if _wrap is None else _wrap(conn)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+
+
+@contextmanager
+def db_write():
+    """
+    The process's writer connection, serialized by a lock. Commits on
+    success, rolls back on error.
+    """
+    global _writer, _writer_pid
+    with _write_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            ensure_wal()
+            _writer = _open(readonly=False)
+            _writer_pid = os.getpid()
+        try:
+            yield _writer if _wrap is None else _wrap(_writer)
+            _writer.commit()
+        except BaseException:
+            _writer.rollback()
+            raise
+
+
+def set_connection_wrapper(wrap):
+    """
+    Hand out wrap(conn) instead of the bare connection from db()/db_write()
+    (metrics uses this to time queries). None turns it off.
+    """
+    global _wrap
+    _wrap = wrap
+
+
+def close_all():
+    """Close this thread's reader and the process writer (tests/benchmarks)."""
+    global _writer, _wal_checked
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+    with _write_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+    _wal_checked = False
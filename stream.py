@@ -0,0 +1,154 @@
+"""
+Server-Sent Events for /api/stream.
+
+One watcher thread per process checks `PRAGMA data_version` on its own read
+connection every POLL_SECONDS. Only when another connection has committed
+does it look for snapshot rows past the last id it saw and re-read the timer
+state, then wakes every subscriber. Idle tabs are just generators parked on
+a Condition, so they cost no SQL at all.
+
+Events:
+    event: timer      data: {"timer_minutes", "next_tick_at", "seconds_remaining"}
+    event: snapshot   id: <max snapshot id>   data: {"items": [rows with deltas]}
+    event: reset      the client fell too far behind (or one commit added more
+                      than MAX_CATCHUP_BATCHES batches); reload from /api/snapshots
+
+Snapshot event ids are snapshot ids, so a reconnect's Last-Event-ID resumes
+from the database whichever worker it lands on.
+
+Each open stream holds a worker connection: run gunicorn with gthread or
+gevent workers (e.g. `-k gthread --threads 200`) rather than sync workers.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from statsdb import db
+
+POLL_SECONDS = 2.0
+KEEPALIVE_SECONDS = 15.0
+BACKLOG_EVENTS = 256        # events kept in memory for slow subscribers
+MAX_RESUME_ROWS = 2000      # more than this missed -> tell the client to reload
+MAX_CATCHUP_BATCHES = 10    # per commit; past that, publish a reset instead
+
+
+def format_event(kind, data, event_id=None):
+    lines = [f"event: {kind}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
+
+
+class SnapshotWatcher:
+    """
+    Shared per-process change detector.
+
+    `fetch_rows(conn, after_id, limit)` returns snapshot rows (dicts with an
+    "id") newer than after_id; `fetch_timer(conn)` returns the timer dict.
+    """
+
+    def __init__(self, fetch_rows, fetch_timer, poll_seconds=POLL_SECONDS):
+        self.fetch_rows = fetch_rows
+        self.fetch_timer = fetch_timer
+        self.poll_seconds = poll_seconds
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=BACKLOG_EVENTS)   # (seq, text)
+        self._seq = 0
+        self._thread = None
+        self.last_id = 0
+        self.timer = None
+        self.subscribers = 0
+
+    def _max_id(self, conn):
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM snapshot").fetchone()[0]
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            with db() as conn:
+                self.last_id = self._max_id(conn)
+                self.timer = self.fetch_timer(conn)
+            self._thread = threading.Thread(target=self._run, name="snapshot-watcher", daemon=True)
+            self._thread.start()
+
+    def _publish(self, text):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, text))
+            self._cond.notify_all()
+
+    def _run(self):
+        data_version = None
+        while True:
+            try:
+                with db() as conn:
+                    dv = conn.execute("PRAGMA data_version").fetchone()[0]
+                    if dv != data_version:
+                        data_version = dv
+                        self._check(conn)
+            except Exception as e:
+                print(f"[stream] watcher error: {e}")
+            time.sleep(self.poll_seconds)
+
+    def _check(self, conn):
+        # one commit can add more than a batch (an ingest group, gen_data, ...)
+        for _ in range(MAX_CATCHUP_BATCHES):
+            rows = self.fetch_rows(conn, self.last_id, MAX_RESUME_ROWS)
+            if rows:
+                self.last_id = rows[-1]["id"]
+                self._publish(format_event("snapshot", {"items": rows}, self.last_id))
+            if len(rows) < MAX_RESUME_ROWS:
+                break
+        else:
+            # still more: cheaper for clients to reload than to get it as events
+            self.last_id = self._max_id(conn)
+            self._publish(format_event("reset", {"reason": "too many new rows"}, self.last_id))
+        timer = self.fetch_timer(conn)
+        if (timer["next_tick_at"], timer["timer_minutes"]) != (
+            self.timer["next_tick_at"], self.timer["timer_minutes"]
+        ):
+            self.timer = timer
+            self._publish(format_event("timer", timer))
+
+    def subscribe(self, last_event_id=None):
+        """Generator of SSE text for one client."""
+        self.start()
+        with self._cond:
+            seq = self._seq
+            timer = self.timer
+            live_from = self.last_id
+            self.subscribers += 1
+        try:
+            yield "retry: 5000\n\n"
+            yield format_event("timer", timer)
+            if last_event_id is not None and last_event_id < live_from:
+                # catch up on what this client missed, straight from the DB
+                with db() as conn:
+                    rows = self.fetch_rows(conn, last_event_id, MAX_RESUME_ROWS + 1)
+                rows = [r for r in rows if r["id"] <= live_from]
+                if len(rows) > MAX_RESUME_ROWS:
+                    yield format_event("reset", {"reason": "too far behind"}, live_from)
+                elif rows:
+                    yield format_event("snapshot", {"items": rows}, rows[-1]["id"])
+
+            while True:
+                with self._cond:
+                    if self._seq == seq:
+                        self._cond.wait(KEEPALIVE_SECONDS)
+                    pending = [(s, t) for s, t in self._events if s > seq]
+                    dropped = bool(self._events) and self._events[0][0] > seq + 1
+                    seq = self._seq
+                    newest = self.last_id
+                if dropped:
+                    yield format_event("reset", {"reason": "backlog overflow"}, newest)
+                    continue
+                if not pending:
+                    yield ": keepalive\n\n"
+                for _, text in pending:
+                    yield text
+        finally:
+            with self._cond:
+                self.subscribers -= 1
@@ -0,0 +1,38 @@
+"""
+The tests run the app against a copy of stats.sqlite3 in a temp dir. statsapp
+and the modules under it read their settings (STATS_DB etc.) at import, so
+they are set here, before any test imports them.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+TMP = Path(tempfile.mkdtemp(prefix="statstest-"))
+atexit.register(shutil.rmtree, TMP, ignore_errors=True)
+shutil.copy(ROOT / "stats.sqlite3", TMP / "stats.sqlite3")
+os.environ.update(
+    STATS_DB=str(TMP / "stats.sqlite3"),
+    STATS_METRICS_DIR=str(TMP / "metrics"),
+    STATS_ACCESS_LOG=str(TMP / "access_log.sqlite3"),
+    STATS_ASSETS_DIR=str(TMP / "assets"),
+    STATS_METRICS_TOKEN="test-token",
+)
+
+
+@pytest.fixture(scope="session")
+def statsapp():
+    import statsapp
+    return statsapp
+
+
+@pytest.fixture
+def client(statsapp):
+    return statsapp.app.test_client()
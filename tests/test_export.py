@@ -0,0 +1,13 @@
+import bench
+from statsdb import DB_PATH
+
+# peak heap of an export of EXPORT_GROWTH times the rows, against the original's
+MAX_PEAK_RATIO = 1.5
+
+
+def test_export_memory_flat_as_rows_grow(client):
+    small = bench.stream_export(client)
+    bench.grow_db(DB_PATH, bench.EXPORT_GROWTH)
+    big = bench.stream_export(client)
+    assert big["rows"] > small["rows"]
+    assert big["peak_kib"] <= small["peak_kib"] * MAX_PEAK_RATIO
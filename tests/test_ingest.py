@@ -0,0 +1,32 @@
+import pytest
+
+import schema
+from statsdb import db, db_write
+
+
+@pytest.fixture
+def ingest(statsapp):
+    import ingest
+    return ingest
+
+
+def _edges():
+    with db() as conn:
+        return dict(conn.execute("SELECT span, edge FROM leaderboard_span").fetchall())
+
+
+def _rewind_edges():
+    with db_write() as conn:
+        conn.execute("UPDATE leaderboard_span SET edge = strftime(?, edge, '-1 hour')",
+                     (schema.HOUR_FORMAT,))
+
+
+def test_only_snapshot_groups_move_the_leaderboard(ingest):
+    _rewind_edges()
+    behind = _edges()
+    ingest.request_refresh()
+    assert _edges() == behind
+
+    result = ingest.submit_snapshots([{"player": "ingest-test", "counters": {"kills": 1}}])
+    assert result == {"ok": True, "snapshots": 1}
+    assert _edges() == {**behind, **schema.leaderboard_edges()}
@@ -0,0 +1,5 @@
+def test_snapshot_queries_use_indexes(statsapp):
+    """What `flask check-plans` runs: no /api/snapshots or /api/export shape sorts or scans."""
+    with statsapp.db() as conn:
+        problems = statsapp.snapshot_plan_problems(conn)
+    assert [f"{shape}: {line}" for shape, line in problems] == []
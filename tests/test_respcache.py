@@ -0,0 +1,63 @@
+import time
+
+import metrics
+import pytest
+import respcache
+import schema
+from statsdb import db_write
+
+
+def _start_of_second():
+    time.sleep(1.05 - time.time() % 1)
+
+
+def _bump():
+    with db_write() as conn:
+        schema.mark_changed(conn, "retention_at")
+
+
+def test_two_writes_in_one_second_not_304(client):
+    """A client that only revalidates by date still sees the second write."""
+    _start_of_second()
+    _bump()
+    first = client.get("/api/players")
+    assert first.status_code == 200
+    _bump()
+    _start_of_second()
+
+    headers = {}
+    if "Last-Modified" in first.headers:
+        headers["If-Modified-Since"] = first.headers["Last-Modified"]
+    again = client.get("/api/players", headers=headers)
+    assert again.status_code == 200
+    assert again.headers["ETag"] != first.headers["ETag"]
+
+
+def test_if_modified_since_304_once_the_second_is_over(client):
+    _bump()
+    _start_of_second()
+    first = client.get("/api/players")
+    assert "Last-Modified" in first.headers
+    again = client.get("/api/players", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert again.status_code == 304
+
+
+def _version_sql_runs():
+    hist = metrics._sql.get(metrics.fingerprint(respcache.VERSION_SQL))
+    return sum(hist[:-1]) if hist else 0
+
+
+@pytest.mark.skipif(not metrics.ENABLED, reason="STATS_METRICS=0")
+def test_cache_hits_reuse_the_data_version(client):
+    """
+    With metrics on, db() hands out a new TimedConnection per call; hits
+    still shouldn't run VERSION_SQL again until something commits.
+    """
+    client.get("/api/players")
+    before = _version_sql_runs()
+    for _ in range(10):
+        assert client.get("/api/players").headers["X-Cache"] == "HIT"
+    assert _version_sql_runs() == before
+    _bump()
+    client.get("/api/players")
+    assert _version_sql_runs() == before + 1
@@ -1,33 +1,277 @@
 # /opt/stats-log-view/app.py
-from flask import Flask, Response, request
-import subprocess, json, html, time, datetime
+"""
+Access log viewer for the stats app. Reads the SQLite access log that
+statsapp writes (accesslog.py) read-only: set STATS_ACCESS_LOG to the same
+path as statsapp when this runs from somewhere else. Until statsapp has
+written the file, every view is just empty.
+
+    /                HTML: newest first, 200 per page, filters + top paths/IPs
+    /api/logs        same rows as JSON, keyset-paginated (next_before)
+    /api/aggregates  per-path and per-IP totals for the window and filters
+    /export.ndjson   every matching row, streamed
+
+Filters (all optional): since=6h|30m|2d|"6 hours ago"|2025-11-05T12:00,
+path=/api/snapshots (exact) or path=/api/* (prefix), ip=, status=404 or 4xx.
+Pages are keyed on (ts, id), so rows come straight off the (ts) / (path, ts)
+/ (ip, ts) indexes in order. Unfiltered aggregates come from the per-minute
+rollup tables; with a path/ip/status filter they add up the same rows the
+list shows (the rollups don't have those dimensions), off the same index.
+Either way a view never scans the whole log.
+"""
+from flask import Flask, Response, jsonify, request
+import datetime, html, json, os, re, sqlite3, time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlencode
 
 app = Flask(__name__)
 
+LOG_DB = Path(os.environ.get("STATS_ACCESS_LOG", Path(__file__).resolve().parent / "access_log.sqlite3"))
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 2000
+TOP_N = 25
+EXPORT_BATCH = 1000
+
+SINCE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(m|min|minutes?|h|hours?|d|days?)\b(?:\s+ago)?\s*$", re.I)
+UNIT_SECONDS = {"m": 60, "h": 3600, "d": 86400}
+
+
+@contextmanager
+def connect():
+    """Read-only connection to the log, or None if statsapp hasn't created it yet."""
+    if not LOG_DB.exists():
+        yield None
+        return
+    conn = sqlite3.connect(f"file:{LOG_DB}?mode=ro", uri=True, timeout=10)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = 1")
+        yield conn
+    finally:
+        conn.close()
+
+
+def parse_since(raw):
+    """'6h', '30 minutes ago', '2 days ago' or an ISO time (UTC) -> unix seconds."""
+    m = SINCE_RE.match(raw)
+    if m:
+        return time.time() - float(m.group(1)) * UNIT_SECONDS[m.group(2)[0].lower()]
+    dt = datetime.datetime.fromisoformat(raw.strip().rstrip("Z"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+def filters():
+    """WHERE clauses + params for the request's filters. Raises ValueError on bad input."""
+    since = request.args.get("since", "6h")
+    where, params = ["ts >= ?"], [parse_since(since)]
+    path = request.args.get("path")
+    if path and path.endswith("*"):
+        # prefix match as a range so the (path, ts) index is still used
+        where.append("path >= ? AND path < ?")
+        params += [path[:-1], path[:-1] + "\uffff"]
+    elif path:
+        where.append("path = ?")
+        params.append(path)
+    ip = request.args.get("ip")
+    if ip:
+        where.append("ip = ?")
+        params.append(ip)
+    status = request.args.get("status", "").lower()
+    if re.fullmatch(r"[1-5]xx", status):
+        lo = int(status[0]) * 100
+        where.append("status >= ? AND status < ?")
+        params += [lo, lo + 100]
+    elif status:
+        where.append("status = ?")
+        params.append(int(status))
+    return where, params
+
+
+def page(conn, where, params, before, limit):
+    """Newest-first page of rows older than `before` ((ts, id) or None), plus the next cursor."""
+    if conn is None:
+        return [], None
+    if before:
+        where = where + ["(ts, id) < (?, ?)"]
+        params = params + list(before)
+    rows = conn.execute(
+        "SELECT id, ts, ip, method, path, query, status, bytes, latency_ms FROM access_log "
+        "WHERE " + " AND ".join(where) + " ORDER BY ts DESC, id DESC LIMIT ?",
+        params + [limit + 1],
+    ).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (f"{rows[-1]['ts']!r}:{rows[-1]['id']}" if more and rows else None)
+
+
+def aggregates(conn, since_ts, where, params):
+    """
+    Top paths and IPs for the rows filters() matches. Without a path/ip/status
+    filter (just the window), from the rollups: per-minute rows up to the
+    first full hour, per-hour rows after that.
+    """
+    if conn is None:
+        return [], []
+    if len(where) > 1:
+        return filtered_aggregates(conn, where, params)
+    minute = int(since_ts // 60)
+    hour = -(-minute // 60)                 # first whole hour in the window
+    args = (minute, hour * 60, hour, TOP_N)
+    paths = conn.execute("""
+        SELECT path, SUM(requests) AS requests, SUM(errors) AS errors, SUM(bytes) AS bytes,
+               SUM(latency_ms_sum) / SUM(requests) AS avg_ms, MAX(latency_ms_max) AS max_ms
+        FROM (
+            SELECT * FROM access_path_minute WHERE bucket >= ? AND bucket < ?
+            UNION ALL
+            SELECT * FROM access_path_hour WHERE bucket >= ?
+        )
+        GROUP BY path ORDER BY requests DESC LIMIT ?
+    """, args).fetchall()
+    ips = conn.execute("""
+        SELECT ip, SUM(requests) AS requests, SUM(errors) AS errors, SUM(bytes) AS bytes
+        FROM (
+            SELECT * FROM access_ip_minute WHERE bucket >= ? AND bucket < ?
+            UNION ALL
+            SELECT * FROM access_ip_hour WHERE bucket >= ?
+        )
+        GROUP BY ip ORDER BY requests DESC LIMIT ?
+    """, args).fetchall()
+    return [dict(r) for r in paths], [dict(r) for r in ips]
+
+
+def filtered_aggregates(conn, where, params):
+    """Top paths and IPs added up from the matching access_log rows."""
+    cond = " AND ".join(where)
+    paths = conn.execute(f"""
+        SELECT path, COUNT(*) AS requests, SUM(status >= 400) AS errors, COALESCE(SUM(bytes), 0) AS bytes,
+               AVG(latency_ms) AS avg_ms, MAX(latency_ms) AS max_ms
+        FROM access_log WHERE {cond}
+        GROUP BY path ORDER BY requests DESC LIMIT ?
+    """, params + [TOP_N]).fetchall()
+    ips = conn.execute(f"""
+        SELECT ip, COUNT(*) AS requests, SUM(status >= 400) AS errors, COALESCE(SUM(bytes), 0) AS bytes
+        FROM access_log WHERE {cond} AND ip IS NOT NULL
+        GROUP BY ip ORDER BY requests DESC LIMIT ?
+    """, params + [TOP_N]).fetchall()
+    return [dict(r) for r in paths], [dict(r) for r in ips]
+
+
+def row_dict(r):
+    d = dict(r)
+    d["time"] = iso(r["ts"])
+    return d
+
+
+def iso(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + "Z"
+
+
+def page_args():
+    limit = min(MAX_PAGE_SIZE, max(1, int(request.args.get("limit", PAGE_SIZE))))
+    before = request.args.get("before")
+    if before:
+        ts, _, row_id = before.partition(":")
+        before = (float(ts), int(row_id))
+    return before, limit
+
+
+@app.get("/api/logs")
+def api_logs():
+    try:
+        where, params = filters()
+        before, limit = page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with connect() as conn:
+        rows, next_before = page(conn, where, params, before, limit)
+    return jsonify({"items": [row_dict(r) for r in rows], "next_before": next_before})
+
+
+@app.get("/api/aggregates")
+def api_aggregates():
+    try:
+        where, params = filters()
+        since = parse_since(request.args.get("since", "6h"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with connect() as conn:
+        paths, ips = aggregates(conn, since, where, params)
+    return jsonify({"paths": paths, "ips": ips})
+
+
+@app.get("/export.ndjson")
+def export():
+    try:
+        where, params = filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        with connect() as conn:
+            if conn is None:
+                return
+            cur = conn.execute(
+                "SELECT id, ts, ip, method, path, query, status, bytes, latency_ms FROM access_log "
+                "WHERE " + " AND ".join(where) + " ORDER BY ts, id", params)
+            while True:
+                rows = cur.fetchmany(EXPORT_BATCH)
+                if not rows:
+                    break
+                yield "".join(json.dumps(row_dict(r)) + "\n" for r in rows)
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
 @app.route("/")
 def index():
-    since = request.args.get("since", "6 hours ago")
-    cmd = ["journalctl","-u","stats","--since",since,"-g","snapshots","-o","json"]
-    out = subprocess.run(cmd, capture_output=True, text=True, check=False).stdout
-    rows = []
-    for line in out.splitlines():
-        if not line.strip(): continue
-        j = json.loads(line)
-        ts_us = int(j.get("__REALTIME_TIMESTAMP","0"))
-        ts = datetime.datetime.utcfromtimestamp(ts_us/1_000_000).isoformat()+"Z" if ts_us else ""
-        msg = html.escape(j.get("MESSAGE",""))
-        rows.append((ts, msg, j.get("_PID",""), j.get("_HOSTNAME","")))
-    rows.sort(reverse=True)  # newest first
+    since = request.args.get("since", "6h")
+    try:
+        where, params = filters()
+        before, limit = page_args()
+        since_ts = parse_since(since)
+    except ValueError as e:
+        return Response(f"bad filter: {html.escape(str(e))}", status=400, mimetype="text/plain")
+    with connect() as conn:
+        rows, next_before = page(conn, where, params, before, limit)
+        paths, ips = aggregates(conn, since_ts, where, params)
+
+    esc = html.escape
+    keep = {k: v for k, v in request.args.items() if k != "before" and v}
+    def link(**extra):
+        return esc("?" + urlencode(dict(keep, **extra)), quote=True)
 
     html_page = [
-      "<!doctype html><meta charset='utf-8'><title>Stats snapshots</title>",
-      "<style>body{font:14px system-ui;margin:24px} table{border-collapse:collapse;width:100%} th,td{border:1px solid #ddd;padding:6px 8px} th{background:#f6f6f6} tr:nth-child(even){background:#fafafa} code{white-space:pre-wrap}</style>",
-      "<h1>Stats snapshots</h1>",
-      f"<div class='meta'>Window: {html.escape(since)} — generated {datetime.datetime.utcnow().isoformat()}Z</div>",
-      "<table><thead><tr><th>Time (UTC)</th><th>Message</th><th>PID</th><th>Host</th></tr></thead><tbody>"
+      "<!doctype html><meta charset='utf-8'><title>Stats access log</title>",
+      "<style>body{font:14px system-ui;margin:24px} table{border-collapse:collapse;width:100%;margin-bottom:24px} th,td{border:1px solid #ddd;padding:6px 8px} th{background:#f6f6f6} tr:nth-child(even){background:#fafafa} td.n{text-align:right} .aggs{display:flex;gap:24px} .aggs>div{flex:1} form input{width:12em}</style>",
+      "<h1>Stats access log</h1>",
+      "<form>"
+      f"since <input name='since' value='{esc(since, quote=True)}'> "
+      f"path <input name='path' value='{esc(request.args.get('path', ''), quote=True)}' placeholder='/api/snapshots'> "
+      f"ip <input name='ip' value='{esc(request.args.get('ip', ''), quote=True)}'> "
+      f"status <input name='status' value='{esc(request.args.get('status', ''), quote=True)}' placeholder='4xx'> "
+      "<button>Filter</button></form>",
+      f"<div class='meta'>generated {iso(time.time())} — <a href='/export.ndjson{link()}'>export NDJSON</a></div>",
+      "<div class='aggs'><div><h2>Top paths</h2><table><thead><tr><th>Path</th><th>Requests</th><th>Errors</th><th>Avg ms</th><th>Max ms</th><th>Bytes</th></tr></thead><tbody>",
     ]
-    for ts,msg,pid,host in rows:
-        html_page.append(f"<tr><td>{ts}</td><td><code>{msg}</code></td><td>{pid}</td><td>{host}</td></tr>")
+    for p in paths:
+        html_page.append(
+            f"<tr><td><a href='{link(path=p['path'])}'>{esc(p['path'])}</a></td><td class='n'>{p['requests']}</td>"
+            f"<td class='n'>{p['errors']}</td><td class='n'>{p['avg_ms']:.1f}</td><td class='n'>{p['max_ms']:.1f}</td><td class='n'>{p['bytes']}</td></tr>")
+    html_page.append("</tbody></table></div><div><h2>Top IPs</h2><table><thead><tr><th>IP</th><th>Requests</th><th>Errors</th><th>Bytes</th></tr></thead><tbody>")
+    for i in ips:
+        html_page.append(
+            f"<tr><td><a href='{link(ip=i['ip'])}'>{esc(i['ip'])}</a></td><td class='n'>{i['requests']}</td>"
+            f"<td class='n'>{i['errors']}</td><td class='n'>{i['bytes']}</td></tr>")
+    html_page.append("</tbody></table></div></div>")
+    html_page.append("<table><thead><tr><th>Time (UTC)</th><th>IP</th><th>Request</th><th>Status</th><th>Bytes</th><th>ms</th></tr></thead><tbody>")
+    for r in rows:
+        target = r["path"] + ("?" + r["query"] if r["query"] else "")
+        html_page.append(
+            f"<tr><td>{iso(r['ts'])}</td><td>{esc(r['ip'] or '')}</td><td><code>{esc(r['method'])} {esc(target)}</code></td>"
+            f"<td class='n'>{r['status']}</td><td class='n'>{'' if r['bytes'] is None else r['bytes']}</td><td class='n'>{r['latency_ms']:.1f}</td></tr>")
     html_page.append("</tbody></table>")
+    if next_before:
+        html_page.append(f"<a href='{link(before=next_before)}'>older &rarr;</a>")
     return Response("\n".join(html_page), mimetype="text/html")
-